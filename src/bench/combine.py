@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from argparse import SUPPRESS, ArgumentParser
+from typing import Any, Dict, List
+
+from openpyxl import load_workbook
+
+from bench.pipeline import peak_rss_kb, reset_peak_rss
+from utils import BASE_DIR, OUT_DIR
+
+SRC_DIR = os.path.join(BASE_DIR, 'src')
+RESULTS_DIR = os.path.join(OUT_DIR, 'bench')
+WRITERS = ('workbook', 'write_only')
+
+
+def measure(writer: str, trace: bool) -> Dict[str, Any]:
+    import combine
+    import pipeline
+    # Extraction is not part of the measurement and may come from the build cache
+    sources = pipeline.extract(use_cache=True)
+    dest_path = os.path.join(RESULTS_DIR, 'combine-{}.xlsx'.format(writer))
+    build = combine.build_write_only if writer == 'write_only' else combine.build_workbook
+
+    rss_reset = reset_peak_rss()
+    # tracemalloc slows allocation heavy code down several times, so its timings are not comparable
+    if trace:
+        tracemalloc.start()
+    t0 = time.perf_counter()
+    wb_out = build(sources)
+    t1 = time.perf_counter()
+    wb_out.save(dest_path)
+    t2 = time.perf_counter()
+
+    result = {
+        'build_s': round(t1 - t0, 4),
+        'save_s': round(t2 - t1, 4),
+        'total_s': round(t2 - t0, 4),
+        'peak_rss_kb': peak_rss_kb(),
+        'peak_rss_reset': rss_reset,
+        'path': dest_path,
+    }
+    if trace:
+        result['tracemalloc_peak_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+    return result
+
+
+def run_writer(writer: str, trace: bool) -> Dict[str, Any]:
+    # A fresh interpreter per writer so the peak RSS of one does not hide the other
+    cmd = [sys.executable, '-m', 'bench.combine', '--child', writer]
+    if trace:
+        cmd.append('--tracemalloc')
+    proc = subprocess.run(cmd, cwd=SRC_DIR, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    return json.loads(proc.stdout.decode('utf-8').strip().splitlines()[-1])
+
+
+def sheet_values(fpath: str) -> List[List[tuple]]:
+    wb = load_workbook(fpath, read_only=True)
+    values = [list(ws.iter_rows(values_only=True)) for ws in wb]
+    wb.close()
+    return values
+
+
+def main(writers: List[str], trace: bool = False) -> Dict[str, Any]:
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    results = {}
+
+    print('{:12} {:>10} {:>10} {:>10} {:>14} {:>12}'.format(
+        'writer', 'build (s)', 'save (s)', 'total (s)', 'py peak (KB)', 'rss (KB)'))
+    for writer in writers:
+        result = run_writer(writer, trace)
+        results[writer] = result
+        print('{:12} {:10.3f} {:10.3f} {:10.3f} {:>14} {:12}'.format(
+            writer, result['build_s'], result['save_s'], result['total_s'], result.get('tracemalloc_peak_kb', '-'),
+            result['peak_rss_kb']))
+
+    if len(results) == len(WRITERS):
+        same = sheet_values(results['workbook']['path']) == sheet_values(results['write_only']['path'])
+        print('parity {}'.format('OK' if same else 'FAILED'))
+    return results
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Peak memory and save time of the combine workbook writers')
+    parser.add_argument('writers', nargs='*', metavar='writer',
+                        help='Writers to run: {} (default: both)'.format(', '.join(WRITERS)))
+    parser.add_argument('--tracemalloc', action='store_true', help='Also record the Python allocation peak')
+    parser.add_argument('--child', choices=WRITERS, help=SUPPRESS)
+    args = parser.parse_args()
+    for writer in args.writers:
+        if writer not in WRITERS:
+            parser.error('invalid writer: {}'.format(writer))
+
+    if args.child:
+        print(json.dumps(measure(args.child, args.tracemalloc)))
+    else:
+        main(args.writers or list(WRITERS), args.tracemalloc)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import os
+import random
+import time
+from argparse import ArgumentParser
+from typing import Dict, List, Sequence
+
+import combine
+from export import DBMS
+
+DBNAME = os.path.join('output', 'bench', 'db')
+# Never the production database, the load drops and recreates its tables
+SERVER_DBNAME = combine.OUTPUT_BASENAME + '_bench'
+JOIN_SQL = '''
+SELECT d.kode, p.provinsi, k.kabupaten_kota, c.kecamatan, d.desa_kelurahan
+FROM desa_kelurahan d
+JOIN kecamatan c ON c.kode = d.kode_kecamatan
+JOIN kabupaten_kota k ON k.kode = c.kode_kabupaten_kota
+JOIN provinsi p ON p.kode = k.kode_provinsi
+WHERE d.kode = %s
+'''
+# name -> (sql, table the parameters are sampled from, column of that table)
+QUERIES = {
+    'desa by kecamatan': ('SELECT kode, desa_kelurahan FROM desa_kelurahan WHERE kode_kecamatan = %s',
+                          'kecamatan', 'kode'),
+    'kecamatan by kab': ('SELECT kode, kecamatan FROM kecamatan WHERE kode_kabupaten_kota = %s',
+                         'kabupaten_kota', 'kode'),
+    'desa by name': ('SELECT kode FROM desa_kelurahan WHERE desa_kelurahan = %s', 'desa_kelurahan', 'desa_kelurahan'),
+    'hierarchy join': (JOIN_SQL, 'desa_kelurahan', 'kode'),
+    'hierarchy wilayah': ('SELECT * FROM wilayah WHERE kode = %s', 'desa_kelurahan', 'kode'),
+}
+
+
+def placeholder(dbms: str, sql: str) -> str:
+    return sql.replace('%s', '?') if dbms == 'sqlite' else sql
+
+
+def explain(cur, dbms: str, sql: str, param) -> List[str]:
+    if dbms == 'sqlite':
+        cur.execute('EXPLAIN QUERY PLAN ' + placeholder(dbms, sql), (param,))
+        return [row[-1] for row in cur.fetchall()]
+    cur.execute('EXPLAIN ' + sql, (param,))
+    return [' '.join(str(value) for value in row) for row in cur.fetchall()]
+
+
+def sample(cur, table_name: str, column: str, count: int) -> list:
+    cur.execute('SELECT {} FROM {}'.format(column, table_name))
+    values = [row[0] for row in cur.fetchall()]
+    return random.Random(0).sample(values, min(count, len(values)))
+
+
+def measure(dbms: str, dbname: str, count: int, names: Sequence[str]) -> Dict[str, float]:
+    conn = combine.connect_db(dbms, dbname)
+    cur = conn.cursor()
+    result = {}
+    for name in names:
+        sql, table_name, column = QUERIES[name]
+        params = sample(cur, table_name, column, count)
+        for line in explain(cur, dbms, sql, params[0]):
+            print('    {:18} {}'.format(name, line))
+        sql = placeholder(dbms, sql)
+        t0 = time.perf_counter()
+        for param in params:
+            cur.execute(sql, (param,))
+            cur.fetchall()
+        result[name] = (time.perf_counter() - t0) / len(params) * 1e6
+    cur.close()
+    conn.close()
+    return result
+
+
+def main(dbms: str, dbname: str, count: int):
+    if dbms == 'sqlite':
+        os.makedirs(os.path.join(combine.BASE_DIR, os.path.dirname(dbname)), exist_ok=True)
+    runs = {}
+    for label, indexes in (('plain', False), ('indexed', True)):
+        t0 = time.perf_counter()
+        combine.insert_into_db(dbms, dbname, indexes=indexes, wilayah=indexes)
+        print('{}: loaded in {:.2f} seconds'.format(label, time.perf_counter() - t0))
+        names = [name for name in QUERIES if indexes or name != 'hierarchy wilayah']
+        runs[label] = measure(dbms, dbname, count, names)
+
+    print('{:18} {:>12} {:>12}'.format('query (us)', 'plain', 'indexed'))
+    for name in QUERIES:
+        plain = runs['plain'].get(name)
+        print('{:18} {:>12} {:12.1f}'.format(name, '-' if plain is None else '{:.1f}'.format(plain),
+                                             runs['indexed'][name]))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Query plans and latency before and after the indexes and wilayah table')
+    parser.add_argument('--dbms', choices=DBMS, default='sqlite')
+    parser.add_argument('--dbname', default=None,
+                        help='Database to load (default: output/bench/db.db for sqlite, {} otherwise)'.format(
+                            SERVER_DBNAME))
+    parser.add_argument('-n', '--queries', type=int, default=500, help='Queries per kind')
+    args = parser.parse_args()
+    main(args.dbms, args.dbname or (DBNAME if args.dbms == 'sqlite' else SERVER_DBNAME), args.queries)
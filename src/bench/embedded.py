@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import os
+import random
+import sqlite3
+import statistics
+import time
+from argparse import ArgumentParser
+from typing import Callable, Dict, List, Sequence
+
+import combine
+import embedded
+import validate
+from combine import TABLES
+from utils import BASE_DIR
+
+CURRENT_DBNAME = os.path.join('output', 'bench', 'current')
+CURRENT_PATH = os.path.join(BASE_DIR, '{}.db'.format(CURRENT_DBNAME))
+EMBEDDED_PATH = os.path.join(BASE_DIR, 'output', 'bench', 'embedded.sqlite')
+LOOKUP_SQL = 'SELECT desa_kelurahan FROM desa_kelurahan WHERE kode = ?'
+CHILDREN_SQL = 'SELECT kode, desa_kelurahan FROM desa_kelurahan WHERE kode_kecamatan = ?'
+# The current database has no text index, the closest it has to a name search is LIKE over every level
+LIKE_SQL = ' UNION ALL '.join("SELECT kode, {0} FROM {0} WHERE {0} LIKE '%' || ? || '%'".format(table_name)
+                              for table_name in TABLES) + ' LIMIT {}'.format(embedded.SEARCH_LIMIT)
+
+
+def evict(fpath: str):
+    # Drops the file from the page cache, so the next open reads from disk
+    if hasattr(os, 'posix_fadvise'):
+        fd = os.open(fpath, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def connect_current(fpath: str = CURRENT_PATH) -> sqlite3.Connection:
+    # The way service.load_sqlite opens a database
+    return sqlite3.connect('file:{}?mode=ro'.format(fpath), uri=True)
+
+
+def cold_open(connect: Callable[[str], sqlite3.Connection], fpath: str, kode: str, repeat: int) -> float:
+    # Open, parse the schema and answer one lookup, with the file out of the page cache
+    times = []
+    for _ in range(repeat):
+        evict(fpath)
+        t0 = time.perf_counter()
+        conn = connect(fpath)
+        conn.execute(LOOKUP_SQL, (kode,)).fetchall()
+        times.append(time.perf_counter() - t0)
+        conn.close()
+    return statistics.median(times) * 1000
+
+
+def latency(query: Callable[[str], list], params: Sequence[str]) -> float:
+    # One untimed pass first, cold reads are what cold_open measures
+    for param in params:
+        query(param)
+    t0 = time.perf_counter()
+    for param in params:
+        query(param)
+    return (time.perf_counter() - t0) / len(params) * 1e6
+
+
+def sample(conn: sqlite3.Connection, sql: str, count: int) -> List[str]:
+    values = [row[0] for row in conn.execute(sql)]
+    return random.Random(0).sample(values, min(count, len(values)))
+
+
+def main(count: int, repeat: int) -> Dict[str, Dict[str, float]]:
+    sources = validate.load_sources()
+    os.makedirs(os.path.dirname(CURRENT_PATH), exist_ok=True)
+    t0 = time.perf_counter()
+    combine.insert_into_db('sqlite', CURRENT_DBNAME, sources)
+    print('current: loaded in {:.2f} seconds'.format(time.perf_counter() - t0))
+    t0 = time.perf_counter()
+    embedded.build(sources, EMBEDDED_PATH)
+    print('embedded: built in {:.2f} seconds'.format(time.perf_counter() - t0))
+
+    conn = embedded.connect(EMBEDDED_PATH)
+    codes = sample(conn, 'SELECT kode FROM desa_kelurahan', count)
+    parents = sample(conn, 'SELECT kode FROM kecamatan', count)
+    # A partly typed word of a village name, e.g. "Sukam"
+    words = sample(conn, 'SELECT DISTINCT substr(desa_kelurahan, 1, 5) FROM desa_kelurahan '
+                         "WHERE desa_kelurahan NOT LIKE '% %'", count)
+    conn.close()
+
+    results = {}
+    for name, connect, fpath in (('current', connect_current, CURRENT_PATH),
+                                 ('embedded', embedded.connect, EMBEDDED_PATH)):
+        result = {'size_kb': os.path.getsize(fpath) / 1024, 'cold_open_ms': cold_open(connect, fpath, codes[0], repeat)}
+        conn = connect(fpath)
+        result['lookup_us'] = latency(lambda kode: conn.execute(LOOKUP_SQL, (kode,)).fetchall(), codes)
+        result['children_us'] = latency(lambda kode: conn.execute(CHILDREN_SQL, (kode,)).fetchall(), parents)
+        if name == 'embedded':
+            result['search_us'] = latency(lambda word: embedded.search(conn, word), words)
+        else:
+            result['search_us'] = latency(lambda word: conn.execute(LIKE_SQL, (word,) * len(TABLES)).fetchall(),
+                                          words)
+        conn.close()
+        results[name] = result
+
+    print('{:16} {:>12} {:>12}'.format('', 'current', 'embedded'))
+    for key in ('size_kb', 'cold_open_ms', 'lookup_us', 'children_us', 'search_us'):
+        print('{:16} {:12.1f} {:12.1f}'.format(key, results['current'][key], results['embedded'][key]))
+    return results
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Size, cold open and query latency of the embedded SQLite build '
+                                        'against the database combine.insert_into_db loads')
+    parser.add_argument('-n', '--queries', type=int, default=1000, help='Queries per kind')
+    parser.add_argument('--repeat', type=int, default=20, help='Cold opens per database')
+    args = parser.parse_args()
+    main(args.queries, args.repeat)
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+from argparse import ArgumentParser
+from multiprocessing import cpu_count
+from typing import Dict, List, Optional
+
+import combine
+from export import DBMS
+from utils import EXECUTOR_MODES, OUT_DIR
+
+RESULTS_DIR = os.path.join(OUT_DIR, 'bench')
+# Scratch databases, the load drops and recreates the tables of the one it is given
+DBNAME = os.path.join('output', 'bench', 'levels')
+SERVER_DBNAME = combine.OUTPUT_BASENAME + '_bench'
+
+
+def time_combine(mode: str, workers: Optional[int]) -> float:
+    # Levels are read from the extraction outputs, which is what the workers parallelize
+    dest_path = os.path.join(RESULTS_DIR, 'levels-{}.xlsx'.format(mode))
+    t0 = time.perf_counter()
+    combine.main(use_cache=False, dest_path=dest_path, mode=mode, workers=workers)
+    return time.perf_counter() - t0
+
+
+def time_load(dbms: str, dbname: str, mode: str, workers: Optional[int]) -> float:
+    t0 = time.perf_counter()
+    combine.insert_into_db(dbms, dbname, mode=mode, workers=workers)
+    return time.perf_counter() - t0
+
+
+def main(modes: List[str], workers: Optional[int], runs: int, dbms: Optional[str],
+         dbname: str) -> Dict[str, Dict[str, float]]:
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    results = {'combine': {}, 'load': {}}
+    for mode in modes:
+        results['combine'][mode] = min(time_combine(mode, workers) for _ in range(runs))
+        if dbms:
+            results['load'][mode] = min(time_load(dbms, dbname, mode, workers) for _ in range(runs))
+
+    print('{} CPUs, best of {} runs'.format(cpu_count(), runs))
+    print('{:10} {:>12} {:>12}'.format('mode', 'combine (s)', 'load (s)'))
+    for mode in modes:
+        load = results['load'].get(mode)
+        print('{:10} {:12.3f} {:>12}'.format(mode, results['combine'][mode],
+                                             '-' if load is None else '{:.3f}'.format(load)))
+    return results
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Wall clock of combine and the database load with the levels in parallel')
+    parser.add_argument('-m', '--mode', dest='modes', action='append', choices=EXECUTOR_MODES,
+                        help='Mode to run, may be repeated (default: all)')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='Number of workers')
+    parser.add_argument('-n', '--runs', type=int, default=3, help='Runs per mode')
+    parser.add_argument('--dbms', choices=DBMS, default=None,
+                        help='Also time insert_into_db, sqlite always loads on one connection')
+    parser.add_argument('-d', '--dbname', default=None,
+                        help='Database to load (default: output/bench/levels.db for sqlite, {} otherwise)'.format(
+                            SERVER_DBNAME))
+    args = parser.parse_args()
+    dbname = args.dbname or (DBNAME if args.dbms == 'sqlite' else SERVER_DBNAME)
+    main(args.modes or list(EXECUTOR_MODES), args.workers, args.runs, args.dbms, dbname)
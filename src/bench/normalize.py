@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import sys
+import time
+from argparse import ArgumentParser
+from glob import glob
+from typing import Callable, Dict, List, Tuple
+
+import kode
+from utils import DATA_DIR, read_xlsx
+
+
+# Implementations used before the kode module, kept as the baseline
+def legacy_normalize_value(value) -> str:
+    if value is None:
+        return ''
+    value = str(value).strip().replace('\n', ' ')
+    value = re.sub(r'^\d+\s+', '', value)
+    return re.sub(r'\s+', ' ', value)
+
+
+def legacy_is_kode_desa(value: str) -> bool:
+    return re.match(r'^(\d{2}\.){3}\d{4}$', value) is not None
+
+
+def legacy_is_numbered_name(value: str) -> bool:
+    return re.match(r'^\d+ .+$', value) is not None
+
+
+def legacy_parent_kode(value: str) -> str:
+    return re.sub(r'\.\d+$', '', value)
+
+
+def load_samples(pattern: str) -> Tuple[List[str], List[str]]:
+    # Every kode and name line exactly as extract_desa sees them
+    kode_cells, name_lines = [], []
+    for fpath in sorted(glob(os.path.join(DATA_DIR, pattern))):
+        for row in read_xlsx(fpath, 1, 7):
+            if row[0] is not None:
+                kode_cells.extend(k.strip() for k in str(row[0]).strip().split('\n'))
+            for nama in row[4:]:
+                if nama is not None:
+                    name_lines.extend(n.strip() for n in str(nama).strip().split('\n'))
+    return kode_cells, name_lines
+
+
+def timeit(func: Callable, values: List, repeat: int) -> Tuple[float, List]:
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = [func(value) for value in values]
+        td = time.perf_counter() - t0
+        best = td if best is None else min(best, td)
+    return best, result
+
+
+def main(pattern: str, repeat: int) -> bool:
+    kode_cells, name_lines = load_samples(pattern)
+    desa_codes = [k for k in kode_cells if kode.is_kode_desa(k)]
+    cases: Dict[str, Tuple[Callable, Callable, List]] = {
+        'is_kode_desa': (legacy_is_kode_desa, kode.is_kode_desa, kode_cells),
+        'is_numbered_name': (legacy_is_numbered_name, kode.is_numbered_name, name_lines),
+        'normalize_value': (legacy_normalize_value, kode.normalize_value, name_lines),
+        'parent_kode': (legacy_parent_kode, kode.parent_kode, desa_codes),
+    }
+    ok = True
+
+    print('{} kode cells, {} name lines'.format(len(kode_cells), len(name_lines)))
+    print('{:18} {:>12} {:>12} {:>9}'.format('case', 'before (ns)', 'after (ns)', 'speedup'))
+    for name, (before, after, values) in cases.items():
+        t_before, r_before = timeit(before, values, repeat)
+        t_after, r_after = timeit(after, values, repeat)
+        if r_before != r_after:
+            ok = False
+            print('MISMATCH {}'.format(name))
+        print('{:18} {:12.1f} {:12.1f} {:8.2f}x'.format(
+            name, t_before / len(values) * 1e9, t_after / len(values) * 1e9, t_before / t_after))
+
+    td = timeit(kode.normalize_many, [name_lines], repeat)[0]
+    print('{:18} {:>12} {:12.1f}'.format('normalize_many', '', td / len(name_lines) * 1e9))
+    print('parity {}'.format('OK' if ok else 'FAILED'))
+    return ok
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Per-row cost of kode validation and name normalization')
+    parser.add_argument('pattern', nargs='?', default='desa/*.xlsx', help='Glob relative to the data directory')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    sys.exit(0 if main(args.pattern, args.repeat) else 1)
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+import cProfile
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from argparse import SUPPRESS, ArgumentParser, Namespace
+from itertools import chain
+from multiprocessing import cpu_count
+from typing import Any, Callable, Dict, Optional
+
+from utils import BASE_DIR, EXECUTOR_MODES, OUT_DIR, XLSX_ENGINES
+
+SRC_DIR = os.path.join(BASE_DIR, 'src')
+RESULTS_DIR = os.path.join(OUT_DIR, 'bench')
+STAGES = ('extract_kab', 'extract_kec', 'extract_desa', 'combine', 'all')
+
+
+def run_extract_kab(args: Namespace) -> int:
+    import extract_kab
+    return len(extract_kab.extract_data(engine=args.engine))
+
+
+def run_extract_kec(args: Namespace) -> int:
+    import extract_kec
+    return len(list(chain.from_iterable(extract_kec.extract_all(args.mode, args.workers, args.engine, args.cache))))
+
+
+def run_extract_desa(args: Namespace) -> int:
+    import extract_desa
+    return len(list(chain.from_iterable(extract_desa.extract_all(args.mode, args.workers, args.engine, args.cache))))
+
+
+def setup_combine(args: Namespace) -> Dict[str, list]:
+    # The extraction feeding combine is not part of the measurement, so it may use the build cache
+    import pipeline
+    return pipeline.extract(args.mode, args.workers, args.engine, True)
+
+
+def run_combine(args: Namespace, sources: Dict[str, list]) -> int:
+    import combine
+    combine.main(sources, use_cache=False)
+    return sum(len(rows) for rows in sources.values())
+
+
+def run_all(args: Namespace) -> int:
+    import combine
+    import pipeline
+    sources = pipeline.extract(args.mode, args.workers, args.engine, args.cache)
+    combine.main(sources, use_cache=args.cache)
+    return sum(len(rows) for rows in sources.values())
+
+
+STAGE_FUNCS: Dict[str, Callable] = {
+    'extract_kab': run_extract_kab,
+    'extract_kec': run_extract_kec,
+    'extract_desa': run_extract_desa,
+    'combine': run_combine,
+    'all': run_all,
+}
+STAGE_SETUP: Dict[str, Callable] = {
+    'combine': setup_combine,
+}
+
+
+def reset_peak_rss() -> bool:
+    # Linux only: writing 5 to clear_refs resets the VmHWM high water mark
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_kb() -> int:
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return maxrss // 1024 if sys.platform == 'darwin' else maxrss
+
+
+def measure(stage: str, args: Namespace) -> Dict[str, Any]:
+    setup = STAGE_SETUP.get(stage)
+    params = (setup(args),) if setup else ()
+    func = STAGE_FUNCS[stage]
+    profiler = cProfile.Profile() if args.profile else None
+
+    rss_reset = reset_peak_rss()
+    if args.tracemalloc:
+        tracemalloc.start()
+    t0 = time.perf_counter()
+    times0 = os.times()
+    if profiler:
+        profiler.enable()
+
+    rows = func(args, *params)
+
+    if profiler:
+        profiler.disable()
+    times1 = os.times()
+    wall = time.perf_counter() - t0
+
+    # os.times covers every thread of this process plus worker processes that have exited
+    result = {
+        'wall_s': round(wall, 4),
+        'cpu_s': round(sum(times1[:4]) - sum(times0[:4]), 4),
+        'cpu_self_s': round(sum(times1[:2]) - sum(times0[:2]), 4),
+        'cpu_children_s': round(sum(times1[2:4]) - sum(times0[2:4]), 4),
+        'peak_rss_kb': peak_rss_kb(),
+        'peak_rss_reset': rss_reset,
+        'children_peak_rss_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        'rows': rows,
+        'rows_per_s': round(rows / wall, 1) if wall else None,
+    }
+    if args.tracemalloc:
+        current, peak = tracemalloc.get_traced_memory()
+        result['tracemalloc_peak_kb'] = peak // 1024
+        result['tracemalloc_top'] = [
+            str(stat) for stat in tracemalloc.take_snapshot().statistics('lineno')[:10]]
+        tracemalloc.stop()
+    if profiler:
+        os.makedirs(args.profile, exist_ok=True)
+        prof_path = os.path.join(args.profile, '{}.prof'.format(stage))
+        profiler.dump_stats(prof_path)
+        result['profile'] = prof_path
+    return result
+
+
+def run_stage(stage: str, args: Namespace) -> Dict[str, Any]:
+    # Each stage runs in a fresh interpreter so peak RSS and imports do not leak between stages
+    cmd = [sys.executable, '-m', 'bench.pipeline', '--child', stage, '--mode', args.mode, '--engine', args.engine]
+    if args.workers:
+        cmd += ['--workers', str(args.workers)]
+    if args.cache:
+        cmd.append('--cache')
+    if args.profile:
+        cmd += ['--profile', args.profile]
+    if args.tracemalloc:
+        cmd.append('--tracemalloc')
+    proc = subprocess.run(cmd, cwd=SRC_DIR, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    return json.loads(proc.stdout.decode('utf-8').strip().splitlines()[-1])
+
+
+def git_revision() -> Optional[str]:
+    try:
+        proc = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+        return proc.stdout.decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: Dict[str, Any], baseline_path: str):
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    print('\nCompared to {} ({})'.format(baseline_path, baseline.get('revision')))
+    print('{:14} {:>10} {:>10} {:>8} {:>12} {:>12}'.format('stage', 'wall', 'base', 'delta', 'rss (KB)', 'base'))
+    for stage, result in results['stages'].items():
+        base = baseline.get('stages', {}).get(stage)
+        if not base:
+            continue
+        delta = (result['wall_s'] - base['wall_s']) / base['wall_s'] * 100 if base['wall_s'] else 0
+        print('{:14} {:10.3f} {:10.3f} {:+7.1f}% {:12} {:12}'.format(
+            stage, result['wall_s'], base['wall_s'], delta, result['peak_rss_kb'], base['peak_rss_kb']))
+
+
+def main(args: Namespace) -> Dict[str, Any]:
+    stages = args.stages or list(STAGES)
+    results = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': cpu_count(),
+        'mode': args.mode,
+        'workers': args.workers,
+        'engine': args.engine,
+        'cache': args.cache,
+        'stages': {},
+    }
+
+    print('{:14} {:>10} {:>10} {:>12} {:>8} {:>12}'.format('stage', 'wall (s)', 'cpu (s)', 'rss (KB)', 'rows', 'rows/s'))
+    for stage in stages:
+        result = run_stage(stage, args)
+        results['stages'][stage] = result
+        print('{:14} {:10.3f} {:10.3f} {:12} {:8} {:12}'.format(
+            stage, result['wall_s'], result['cpu_s'], max(result['peak_rss_kb'], result['children_peak_rss_kb']),
+            result['rows'], result['rows_per_s']))
+
+    output = args.output or os.path.join(RESULTS_DIR, '{}.json'.format(results['revision'] or 'results'))
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print('Results saved to {}'.format(output))
+
+    if args.compare:
+        compare(results, args.compare)
+    return results
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark the extraction pipeline stage by stage')
+    parser.add_argument('stages', nargs='*', metavar='stage',
+                        help='Stages to run: {} (default: all of them)'.format(', '.join(STAGES)))
+    parser.add_argument('-m', '--mode', choices=EXECUTOR_MODES, default='process')
+    parser.add_argument('-w', '--workers', type=int, default=None)
+    parser.add_argument('-e', '--engine', choices=XLSX_ENGINES, default='xml')
+    parser.add_argument('--cache', action='store_true', help='Use the build cache (default: cold runs)')
+    parser.add_argument('--profile', metavar='DIR', help='Write a cProfile dump per stage into DIR')
+    parser.add_argument('--tracemalloc', action='store_true', help='Record Python allocation peaks per stage')
+    parser.add_argument('-o', '--output', help='JSON results path (default: output/bench/<revision>.json)')
+    parser.add_argument('--compare', metavar='JSON', help='Previous results to compare against')
+    parser.add_argument('--child', choices=STAGES, help=SUPPRESS)
+    args = parser.parse_args()
+    for stage in args.stages:
+        if stage not in STAGES:
+            parser.error('invalid stage: {}'.format(stage))
+
+    if args.child:
+        print(json.dumps(measure(args.child, args)))
+    else:
+        main(args)
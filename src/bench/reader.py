@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from glob import glob
+
+from utils import DATA_DIR, XLSX_ENGINES, read_xlsx
+
+
+def strip_trailing(rows: list) -> list:
+    # openpyxl pads up to the sheet dimension, the XML reader stops at the last row
+    while rows and all(v is None for v in rows[-1]):
+        rows.pop()
+    return rows
+
+
+def main(pattern: str, min_col: int, max_col: int) -> bool:
+    fpaths = sorted(glob(os.path.join(DATA_DIR, pattern), recursive=True))
+    timings = {engine: 0.0 for engine in XLSX_ENGINES}
+    ok = True
+
+    for fpath in fpaths:
+        results = {}
+        for engine in XLSX_ENGINES:
+            t0 = time.perf_counter()
+            results[engine] = strip_trailing(list(read_xlsx(fpath, min_col, max_col, engine=engine)))
+            timings[engine] += time.perf_counter() - t0
+        if results['xml'] != results['openpyxl']:
+            ok = False
+            print('MISMATCH {}'.format(fpath))
+
+    print('{} files, columns {}-{}'.format(len(fpaths), min_col, max_col))
+    for engine, td in timings.items():
+        print('{:10} {:8.3f} s'.format(engine, td))
+    print('speedup    {:8.2f}x'.format(timings['openpyxl'] / timings['xml']))
+    print('parity     {}'.format('OK' if ok else 'FAILED'))
+    return ok
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Compare the XML and openpyxl workbook readers')
+    parser.add_argument('pattern', nargs='?', default='desa/*.xlsx', help='Glob relative to the data directory')
+    parser.add_argument('--min-col', type=int, default=1)
+    parser.add_argument('--max-col', type=int, default=7)
+    args = parser.parse_args()
+    sys.exit(0 if main(args.pattern, args.min_col, args.max_col) else 1)
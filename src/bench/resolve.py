@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import io
+import os
+import random
+import sqlite3
+import time
+from argparse import ArgumentParser
+from multiprocessing import cpu_count
+
+import resolve
+from lookup import RegionIndex
+from snapshot import SNAPSHOT_PATH
+from utils import BASE_DIR, OUT_DIR
+
+DB_PATH = os.path.join(BASE_DIR, 'kode_wilayah_indonesia.db')
+INPUT_PATH = os.path.join(OUT_DIR, 'bench', 'resolve-input.csv')
+JOIN_SQL = '''
+SELECT p.provinsi, k.kabupaten_kota, c.kecamatan, d.desa_kelurahan
+FROM desa_kelurahan d
+JOIN kecamatan c ON c.kode = d.kode_kecamatan
+JOIN kabupaten_kota k ON k.kode = c.kode_kabupaten_kota
+JOIN provinsi p ON p.kode = k.kode_provinsi
+WHERE d.kode = ?
+'''
+
+
+def generate(path: str, rows: int):
+    # ETL-like records: a few thousand villages repeat a lot, some kode are unknown or without dots
+    index = RegionIndex.load(SNAPSHOT_PATH)
+    codes = [kode for kode, _ in index.items(3)]
+    index.close()
+    rng = random.Random(0)
+    hot = rng.sample(codes, 5000)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(['id', 'kode_desa', 'nilai'])
+        for i in range(rows):
+            kode = rng.choice(hot) if rng.random() < 0.7 else rng.choice(codes)
+            if rng.random() < 0.01:
+                kode = kode.replace('.', '')
+            elif rng.random() < 0.01:
+                kode = '99.99.99.9999'
+            # Some exports leave trailing empty fields out
+            if rng.random() < 0.01:
+                writer.writerow([i, kode])
+            else:
+                writer.writerow([i, kode, rng.randrange(1000)])
+
+
+def time_resolver(path: str, workers: int, chunk_size: int) -> float:
+    with open(path, 'r', encoding='utf-8', newline='') as src:
+        dest = io.StringIO()
+        t0 = time.perf_counter()
+        count, _ = resolve.resolve_csv(src, dest, chunk_size=chunk_size, workers=workers)
+        td = time.perf_counter() - t0
+    # Every output row, short input rows included, has a field for each header
+    dest.seek(0)
+    rows = csv.reader(dest)
+    width = len(next(rows))
+    misaligned = sum(1 for row in rows if len(row) != width)
+    if misaligned:
+        print('MISALIGNED {} rows'.format(misaligned))
+    return count / td
+
+
+def time_join(path: str, limit: int) -> float:
+    # The per record SQL join the resolver replaces
+    conn = sqlite3.connect(DB_PATH)
+    with open(path, 'r', encoding='utf-8', newline='') as src:
+        reader = csv.reader(src)
+        next(reader)
+        t0 = time.perf_counter()
+        count = 0
+        for row in reader:
+            conn.execute(JOIN_SQL, (row[1],)).fetchone()
+            count += 1
+            if count >= limit:
+                break
+        td = time.perf_counter() - t0
+    conn.close()
+    return count / td
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Rows per second of the bulk kode resolver')
+    parser.add_argument('-n', '--rows', type=int, default=1000000)
+    parser.add_argument('-w', '--workers', type=int, default=cpu_count())
+    parser.add_argument('--chunk-size', type=int, default=resolve.CHUNK_SIZE)
+    parser.add_argument('--join-rows', type=int, default=100000, help='Rows for the SQL join baseline, 0 to skip')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    generate(INPUT_PATH, args.rows)
+    print('Generated {} rows in {:.2f} seconds'.format(args.rows, time.perf_counter() - t0))
+
+    t0 = time.perf_counter()
+    resolve.get_hierarchy()
+    print('Flattened hierarchy built in {:.3f} seconds'.format(time.perf_counter() - t0))
+
+    print('{:24} {:>12}'.format('resolver', 'rows/s'))
+    if args.join_rows and os.path.exists(DB_PATH):
+        print('{:24} {:12.0f}'.format('sqlite join per row', time_join(INPUT_PATH, args.join_rows)))
+    print('{:24} {:12.0f}'.format('serial', time_resolver(INPUT_PATH, 1, args.chunk_size)))
+    if args.workers > 1:
+        print('{:24} {:12.0f}'.format('{} processes'.format(args.workers),
+                                      time_resolver(INPUT_PATH, args.workers, args.chunk_size)))
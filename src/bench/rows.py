@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from argparse import ArgumentParser
+from typing import Callable, List, Sequence, Tuple
+
+from combine import SOURCE_PATHS
+from rows import RowBuffer
+from utils import read_xlsx, write_rows
+
+# Every level RowBuffer stores, the index is the level passed to it
+LEVELS = list(SOURCE_PATHS)
+# Codes a RowBuffer keeps as is, next to a well-formed one
+ODD_ROWS = [('11.01.01.2001', 'Lhok Bengkuang'), (None, 'Ulu'), (1101, None), ('11.1', 'Ilir'), ('', '')]
+SLICES = [slice(None), slice(10, 100), slice(-50, None), slice(None, None, 7), slice(None, None, -3), slice(5, 1)]
+
+
+def measure(build: Callable[[], Sequence]) -> Tuple[Sequence, float, float]:
+    # Time and memory left allocated once the rows are built, i.e. what a stage keeps while the next one runs
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    rows = build()
+    td = time.perf_counter() - t0
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return rows, td, size / (1 << 20)
+
+
+def written(rows: Sequence, dest_dir: str) -> bytes:
+    dest_path = os.path.join(dest_dir, 'rows.xlsx')
+    write_rows(dest_path, 'ROWS', rows, (14, 50))
+    with zipfile.ZipFile(dest_path) as archive:
+        return archive.read('xl/worksheets/sheet1.xml')
+
+
+def mismatches(rows: List[tuple], buffer: RowBuffer, dest_dir: str) -> List[str]:
+    # repr tells 1101 from '1101', == would not
+    failed = []
+    if [repr(row) for row in buffer] != [repr(row) for row in rows]:
+        failed.append('iteration')
+    if len(buffer) != len(rows) or any(buffer[i] != rows[i] for i in range(-len(rows), len(rows))):
+        failed.append('indexing')
+    if any(list(buffer[s]) != rows[s] for s in SLICES):
+        failed.append('slicing')
+    if json.dumps(list(buffer)) != json.dumps(rows):
+        failed.append('cache')
+    if written(buffer, dest_dir) != written(rows, dest_dir):
+        failed.append('written')
+    return failed
+
+
+def main(levels: List[str]) -> bool:
+    ok = True
+    print('{:16} {:>8} {:>10} {:>10} {:>10} {:>10}  {}'.format(
+        'level', 'rows', 'list (MB)', 'buf (MB)', 'list (s)', 'buf (s)', 'parity'))
+    with tempfile.TemporaryDirectory() as dest_dir:
+        for level in levels + ['odd']:
+            if level == 'odd':
+                read = lambda: iter(ODD_ROWS)
+                nlevel = LEVELS.index('desa_kelurahan')
+            else:
+                read = lambda: read_xlsx(SOURCE_PATHS[level])
+                nlevel = LEVELS.index(level)
+            rows, list_td, list_size = measure(lambda: list(read()))
+            buffer, buffer_td, buffer_size = measure(lambda: RowBuffer(nlevel, read()))
+            failed = mismatches(rows, buffer, dest_dir)
+            ok = ok and not failed
+            print('{:16} {:8d} {:10.2f} {:10.2f} {:10.3f} {:10.3f}  {}'.format(
+                level, len(rows), list_size, buffer_size, list_td, buffer_td,
+                'FAILED ({})'.format(', '.join(failed)) if failed else 'OK'))
+    print('parity           {}'.format('OK' if ok else 'FAILED'))
+    return ok
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Compare RowBuffer with the lists of tuples it replaced')
+    parser.add_argument('-l', '--level', dest='levels', action='append', choices=LEVELS,
+                        help='Level to compare, may be repeated (default: all)')
+    args = parser.parse_args()
+    sys.exit(0 if main(args.levels or LEVELS) else 1)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import random
+import sqlite3
+import time
+from argparse import ArgumentParser
+from typing import Callable, Dict, List
+
+from lookup import RegionIndex
+from search import SearchIndex
+from snapshot import SNAPSHOT_PATH
+from utils import BASE_DIR
+
+DB_PATH = '{}/kode_wilayah_indonesia.db'.format(BASE_DIR)
+
+
+def typo(rng: random.Random, value: str) -> str:
+    # One substituted, dropped or doubled letter somewhere after the first two
+    if len(value) < 5:
+        return value
+    pos = rng.randrange(2, len(value) - 1)
+    op = rng.randrange(3)
+    if op == 0:
+        return value[:pos] + rng.choice('aiueonkrst') + value[pos+1:]
+    if op == 1:
+        return value[:pos] + value[pos+1:]
+    return value[:pos] + value[pos] + value[pos:]
+
+
+def sample_queries(index: SearchIndex, count: int) -> Dict[str, List[str]]:
+    rng = random.Random(0)
+    names = rng.sample(index.names, count)
+    return {
+        'exact': names,
+        'prefix': [name[:max(3, len(name) // 2)] for name in names],
+        'typo': [typo(rng, name) for name in names],
+        'kab': [index.names[i] for i in rng.choices(range(len(index)), k=count) if index.levels[i] == 1] or
+               ['Kab. Deli', 'Kota Medan'],
+    }
+
+
+def percentiles(func: Callable[[str], list], queries: List[str]) -> Dict[str, float]:
+    times = []
+    for query in queries:
+        t0 = time.perf_counter()
+        func(query)
+        times.append(time.perf_counter() - t0)
+    times.sort()
+    return {
+        'p50_ms': times[len(times) // 2] * 1000,
+        'p99_ms': times[min(len(times) - 1, int(len(times) * 0.99))] * 1000,
+        'max_ms': times[-1] * 1000,
+    }
+
+
+def like_scan(conn: sqlite3.Connection) -> Callable[[str], list]:
+    def query(value: str) -> list:
+        return conn.execute('SELECT kode, desa_kelurahan FROM desa_kelurahan WHERE desa_kelurahan LIKE ? LIMIT 10',
+                            ('%{}%'.format(value),)).fetchall()
+    return query
+
+
+def main(count: int, like: bool):
+    t0 = time.perf_counter()
+    index = SearchIndex(RegionIndex.load(SNAPSHOT_PATH))
+    print('Built search index over {} names in {:.3f} seconds'.format(len(index), time.perf_counter() - t0))
+
+    queries = sample_queries(index, count)
+    recall = sum(1 for name, query in zip(queries['exact'], queries['typo'])
+                 if name in [r['nama'] for r in index.search(query)])
+    print('typo recall@10: {:.1%}'.format(recall / len(queries['typo'])))
+
+    print('{:8} {:>10} {:>10} {:>10}'.format('queries', 'p50 (ms)', 'p99 (ms)', 'max (ms)'))
+    for name, values in queries.items():
+        result = percentiles(index.search, values)
+        print('{:8} {:10.3f} {:10.3f} {:10.3f}'.format(name, result['p50_ms'], result['p99_ms'], result['max_ms']))
+
+    if like:
+        conn = sqlite3.connect(DB_PATH)
+        result = percentiles(like_scan(conn), queries['prefix'][:100])
+        print('{:8} {:10.3f} {:10.3f} {:10.3f}  (sqlite LIKE %x%)'.format(
+            'like', result['p50_ms'], result['p99_ms'], result['max_ms']))
+        conn.close()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Name search latency over the full region set')
+    parser.add_argument('-n', '--queries', type=int, default=1000, help='Queries per kind')
+    parser.add_argument('--like', action='store_true', help='Also time a LIKE scan on the SQLite database')
+    args = parser.parse_args()
+    main(args.queries, args.like)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from typing import Any, Dict, List, Tuple
+
+from lookup import LEVELS, decode_kode
+from service import DEFAULT_SOURCE, load_index
+from utils import BASE_DIR
+
+SRC_DIR = os.path.join(BASE_DIR, 'src')
+HOT_CODES = 1000
+
+
+def sample_requests(source: str, count: int, resolve_size: int) -> List[Tuple[str, str, bytes]]:
+    # Mostly a small hot set of kode, as internal apps keep asking for the same villages
+    index = load_index(source)
+    codes = [decode_kode(level, code) for level in range(len(LEVELS)) for code in index.codes[level]]
+    rng = random.Random(0)
+    hot = rng.sample(codes, min(HOT_CODES, len(codes)))
+    requests = []
+    for _ in range(count):
+        kode = rng.choice(hot) if rng.random() < 0.8 else rng.choice(codes)
+        kind = rng.random()
+        if kind < 0.7:
+            requests.append(('GET', '/kode/{}'.format(kode), b''))
+        elif kind < 0.95:
+            requests.append(('GET', '/children/{}'.format(kode.rsplit('.', 1)[0]), b''))
+        else:
+            requests.append(('POST', '/resolve', json.dumps(rng.sample(codes, resolve_size)).encode('utf-8')))
+    return requests
+
+
+async def fetch(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, method: str, path: str,
+                body: bytes) -> Tuple[int, bytes]:
+    writer.write('{} {} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {}\r\n\r\n'.format(
+        method, path, len(body)).encode('latin-1') + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    return status, await reader.readexactly(length)
+
+
+async def client(host: str, port: int, queue: List[Tuple[str, str, bytes]], latencies: List[float],
+                 errors: List[int]):
+    # One keep-alive connection per client, requests are taken from the shared list until it is empty
+    reader, writer = await asyncio.open_connection(host, port)
+    while queue:
+        method, path, body = queue.pop()
+        t0 = time.perf_counter()
+        status, _ = await fetch(reader, writer, method, path, body)
+        latencies.append(time.perf_counter() - t0)
+        if status not in (200, 404):
+            errors.append(status)
+    writer.close()
+
+
+async def wait_ready(host: str, port: int, timeout: float):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+async def load_test(host: str, port: int, requests: List[Tuple[str, str, bytes]], concurrency: int) -> Dict[str, Any]:
+    await wait_ready(host, port, 120)
+    queue = list(reversed(requests))
+    latencies, errors = [], []
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client(host, port, queue, latencies, errors) for _ in range(concurrency)))
+    wall = time.perf_counter() - t0
+
+    reader, writer = await asyncio.open_connection(host, port)
+    stats = json.loads((await fetch(reader, writer, 'GET', '/stats', b''))[1])
+    writer.close()
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'wall_s': round(wall, 4),
+        'req_per_s': round(len(latencies) / wall, 1),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 3),
+        'p99_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3),
+        'cache': stats['cache'],
+    }
+
+
+def start_server(source: str, port: int, cache_size: int) -> subprocess.Popen:
+    cmd = [sys.executable, 'service.py', '--source', source, '--port', str(port), '--cache-size', str(cache_size)]
+
+    def pin():
+        # Single core service, as it would run next to the apps that call it
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, {min(os.sched_getaffinity(0))})
+
+    return subprocess.Popen(cmd, cwd=SRC_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, preexec_fn=pin)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Latency and throughput of the region lookup service')
+    parser.add_argument('-s', '--source', default=DEFAULT_SOURCE, help='Data the service loads, also used to pick kode')
+    parser.add_argument('-n', '--requests', type=int, default=20000)
+    parser.add_argument('-c', '--concurrency', type=int, default=32)
+    parser.add_argument('--resolve-size', type=int, default=100, help='Kode per POST /resolve')
+    parser.add_argument('--cache-size', type=int, default=4096)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=8765)
+    parser.add_argument('--external', action='store_true', help='Test an already running service instead')
+    args = parser.parse_args()
+
+    requests = sample_requests(args.source, args.requests, args.resolve_size)
+    proc = None if args.external else start_server(args.source, args.port, args.cache_size)
+    try:
+        result = asyncio.run(load_test(args.host, args.port, requests, args.concurrency))
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+
+    print('{} requests, {} connections, {} errors'.format(result['requests'], args.concurrency, result['errors']))
+    print('{:>10} {:>10} {:>10} {:>10}'.format('req/s', 'p50 (ms)', 'p99 (ms)', 'max (ms)'))
+    print('{:10.1f} {:10.3f} {:10.3f} {:10.3f}'.format(
+        result['req_per_s'], result['p50_ms'], result['p99_ms'], result['max_ms']))
+    for name, info in result['cache'].items():
+        print('cache {:9} {} hits, {} misses, {}/{} entries'.format(
+            name, info['hits'], info['misses'], info['size'], info['maxsize']))
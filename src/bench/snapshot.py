@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import os
+import random
+import sqlite3
+import time
+from argparse import ArgumentParser
+from typing import Callable, Dict, List
+
+from openpyxl import load_workbook
+
+from combine import OUTPUT_BASENAME
+from lookup import LEVELS, RegionIndex, decode_kode
+from snapshot import SNAPSHOT_PATH
+from utils import BASE_DIR
+
+DB_PATH = os.path.join(BASE_DIR, '{}.db'.format(OUTPUT_BASENAME))
+XLSX_PATH = os.path.join(BASE_DIR, '{}.xlsx'.format(OUTPUT_BASENAME))
+
+
+def load_snapshot() -> Callable[[str], str]:
+    return RegionIndex.load(SNAPSHOT_PATH).get
+
+
+def load_sqlite() -> Callable[[str], str]:
+    conn = sqlite3.connect(DB_PATH)
+    names = {}
+    for table_name in LEVELS:
+        names.update(conn.execute('SELECT kode, {} FROM {}'.format(table_name, table_name)))
+    conn.close()
+    return names.get
+
+
+def load_xlsx() -> Callable[[str], str]:
+    wb = load_workbook(XLSX_PATH, read_only=True)
+    names = {}
+    for ws in wb:
+        for row in ws.iter_rows(2, values_only=True):
+            names[str(row[-2])] = row[-1]
+    wb.close()
+    return names.get
+
+
+def sample_codes(count: int) -> List[str]:
+    index = RegionIndex.load(SNAPSHOT_PATH)
+    codes = [decode_kode(level, code) for level, level_codes in enumerate(index.codes) for code in level_codes]
+    index.close()
+    return random.Random(0).choices(codes, k=count)
+
+
+def main(repeat: int, lookups: int) -> Dict[str, Dict[str, float]]:
+    codes = sample_codes(lookups)
+    loaders = {'snapshot': load_snapshot, 'sqlite': load_sqlite, 'xlsx': load_xlsx}
+    results = {}
+
+    for name, loader in loaders.items():
+        load_times = []
+        for _ in range(repeat if name != 'xlsx' else 1):
+            t0 = time.perf_counter()
+            get = loader()
+            load_times.append(time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        for kode in codes:
+            get(kode)
+        lookup_time = time.perf_counter() - t0
+        results[name] = {'load_ms': min(load_times) * 1000, 'lookup_us': lookup_time / lookups * 1e6}
+
+    print('{:10} {:>12} {:>12}'.format('source', 'load (ms)', 'get (us)'))
+    for name, result in results.items():
+        print('{:10} {:12.2f} {:12.2f}'.format(name, result['load_ms'], result['lookup_us']))
+    return results
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Compare startup cost of the snapshot, SQLite and XLSX outputs')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--lookups', type=int, default=100000)
+    args = parser.parse_args()
+    main(args.repeat, args.lookups)
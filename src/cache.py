@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+import kode
+import utils
+from utils import BASE_DIR, OUT_DIR, map_tasks
+
+CACHE_DIR = os.path.join(OUT_DIR, '.cache')
+MANIFEST_VERSION = 1
+
+
+def file_digest(fpath: str) -> str:
+    digest = hashlib.sha256()
+    with open(fpath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def data_digest(*values: Any) -> str:
+    return hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def rows_digest(rows: Iterable[Sequence]) -> str:
+    digest = hashlib.sha256()
+    for row in rows:
+        digest.update(repr(tuple(row)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def code_version(*fpaths: str) -> str:
+    # Any edit to the extractor or its helpers invalidates the cached rows
+    return data_digest(*(file_digest(fpath) for fpath in fpaths + (utils.__file__, kode.__file__)))
+
+
+class BuildCache:
+    def __init__(self, namespace: str, salt: str = '', enabled: bool = True, cache_dir: str = CACHE_DIR,
+                 logger: Optional[logging.Logger] = None, rows_type: Callable[[Iterable[tuple]], Sequence] = list):
+        self.namespace = namespace
+        # Container the cached rows are loaded into, e.g. a RowBuffer
+        self.rows_type = rows_type
+        self.logger = logger or logging.getLogger()
+        self.salt = salt
+        self.enabled = enabled
+        self.cache_dir = cache_dir
+        self.manifest_path = os.path.join(cache_dir, 'manifest.json')
+        self.hits = 0
+        self.misses = 0
+        self.manifest = self._load_manifest() if enabled else {}
+        self.manifest.setdefault('version', MANIFEST_VERSION)
+        self.manifest.setdefault('entries', {})
+        self.manifest.setdefault('stages', {})
+
+    def _load_manifest(self) -> Dict[str, Any]:
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if manifest.get('version') != MANIFEST_VERSION:
+            return {}
+        return manifest
+
+    def _entry_name(self, src_path: str) -> str:
+        return '{}:{}'.format(self.namespace, os.path.relpath(src_path, BASE_DIR))
+
+    def key(self, src_path: str) -> str:
+        return data_digest(file_digest(src_path), self.salt)
+
+    def get(self, src_path: str, key: Optional[str] = None) -> Optional[List[tuple]]:
+        if not self.enabled:
+            self.misses += 1
+            return None
+        entry = self.manifest['entries'].get(self._entry_name(src_path))
+        if entry is None or entry['key'] != (key or self.key(src_path)):
+            self.misses += 1
+            return None
+        try:
+            with open(os.path.join(self.cache_dir, entry['file']), 'r', encoding='utf-8') as f:
+                rows = self.rows_type(tuple(row) for row in json.load(f))
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return rows
+
+    def put(self, src_path: str, rows: List[Sequence], key: Optional[str] = None):
+        if not self.enabled:
+            return
+        basename = os.path.splitext(os.path.basename(src_path))[0]
+        fname = os.path.join(self.namespace, '{}.json'.format(basename))
+        os.makedirs(os.path.join(self.cache_dir, self.namespace), exist_ok=True)
+        with open(os.path.join(self.cache_dir, fname), 'w', encoding='utf-8') as f:
+            json.dump(list(rows), f, ensure_ascii=False, separators=(',', ':'))
+        self.manifest['entries'][self._entry_name(src_path)] = {
+            'key': key or self.key(src_path),
+            'file': fname,
+            'rows': len(rows),
+        }
+
+    def map(self, func: Callable, src_paths: Sequence[str], mode: str = 'process',
+            workers: Optional[int] = None, runner: Optional[Callable[[List[str]], List]] = None) -> List[List[tuple]]:
+        # Only files whose content or extraction rules changed are handed to the workers,
+        # runner replaces the one task per file default, e.g. to split files into shards
+        keys = [self.key(src_path) if self.enabled else None for src_path in src_paths]
+        results = [self.get(src_path, key) for src_path, key in zip(src_paths, keys)]
+        missing = [i for i, rows in enumerate(results) if rows is None]
+        run = runner or (lambda paths: map_tasks(func, paths, mode, workers))
+        for i, rows in zip(missing, run([src_paths[i] for i in missing])):
+            results[i] = rows
+            self.put(src_paths[i], rows, keys[i])
+        self.save()
+        self.report()
+        return results
+
+    def is_fresh(self, dest_path: str, key: str) -> bool:
+        # A stage output is fresh when it exists and was built from the same inputs
+        stage = os.path.relpath(dest_path, BASE_DIR)
+        return self.enabled and os.path.exists(dest_path) and self.manifest['stages'].get(stage) == key
+
+    def mark(self, dest_path: str, key: str):
+        if self.enabled:
+            self.manifest['stages'][os.path.relpath(dest_path, BASE_DIR)] = key
+
+    def save(self):
+        if not self.enabled:
+            return
+        # Other stages may have updated the manifest since it was loaded
+        manifest = self._load_manifest()
+        for section in ('entries', 'stages'):
+            manifest.setdefault(section, {}).update(self.manifest[section])
+        manifest['version'] = MANIFEST_VERSION
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = '{}.tmp'.format(self.manifest_path)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+        self.manifest = manifest
+
+    def report(self):
+        self.logger.info('Cache %s: %s hits, %s misses', self.namespace, self.hits, self.misses)
@@ -1,18 +1,28 @@
 # -*- coding: utf-8 -*-
 
+import inspect
+import io
 import os
-import re
 import sqlite3
 import time
+import warnings
+from collections.abc import Sequence as SequenceABC
+from functools import partial
+from itertools import chain
 from subprocess import PIPE, Popen
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
-import mysql.connector
-import psycopg2
-from openpyxl import Workbook, load_workbook
-from openpyxl.utils import get_column_letter
-from openpyxl.worksheet.table import Table, TableStyleInfo
+import metrics
+from cache import BuildCache, code_version, data_digest, file_digest, rows_digest
+from kode import parent_kode
+from rows import RowBuffer
+from utils import (BASE_DIR, DATA_DIR, OUT_DIR, batched, create_logger, imap_tasks, log_filename, map_tasks, read_xlsx,
+                   touch)
 
-from utils import BASE_DIR, DATA_DIR, OUT_DIR, create_logger, log_filename, touch
+# openpyxl and the database drivers are imported where they are used, loading a SQLite database
+# or validating does not pay for them
+if TYPE_CHECKING:
+    from openpyxl import Workbook
 
 OUTPUT_BASENAME = 'kode_wilayah_indonesia'
 DB_CONFIG = {
@@ -30,59 +40,216 @@ DB_CONFIG = {
     }
 }
 
+SOURCE_PATHS = {
+    'provinsi': os.path.join(DATA_DIR, 'provinsi.xlsx'),
+    'kabupaten_kota': os.path.join(OUT_DIR, 'kabupaten-out.xlsx'),
+    'kecamatan': os.path.join(OUT_DIR, 'kecamatan-out.xlsx'),
+    'desa_kelurahan': os.path.join(OUT_DIR, 'desa-out.xlsx'),
+}
+
+TABLES = {
+    'provinsi': [
+        'kode VARCHAR(20) NOT NULL PRIMARY KEY',
+        'provinsi VARCHAR(255) NOT NULL',
+    ],
+    'kabupaten_kota': [
+        'kode VARCHAR(20) NOT NULL PRIMARY KEY',
+        'kode_provinsi VARCHAR(20) NOT NULL',
+        'kabupaten_kota VARCHAR(255) NOT NULL',
+    ],
+    'kecamatan': [
+        'kode VARCHAR(20) NOT NULL PRIMARY KEY',
+        'kode_kabupaten_kota VARCHAR(20) NOT NULL',
+        'kecamatan VARCHAR(255) NOT NULL',
+    ],
+    'desa_kelurahan': [
+        'kode VARCHAR(20) NOT NULL PRIMARY KEY',
+        'kode_kecamatan VARCHAR(20) NOT NULL',
+        'desa_kelurahan VARCHAR(255) NOT NULL',
+    ]
+}
+FOREIGN_KEYS = {
+    'kabupaten_kota': ('kode_provinsi', 'provinsi'),
+    'kecamatan': ('kode_kabupaten_kota', 'kabupaten_kota'),
+    'desa_kelurahan': ('kode_kecamatan', 'kecamatan'),
+}
+SHEETS = {
+    'PROVINSI': ('provinsi', ('KODE', 'PROVINSI')),
+    'KABUPATEN/KOTA': ('kabupaten_kota', ('KODE PROVINSI', 'KODE', 'KABUPATEN/KOTA')),
+    'KECAMATAN': ('kecamatan', ('KODE KABUPATEN/KOTA', 'KODE', 'KECAMATAN')),
+    'DESA/KELURAHAN': ('desa_kelurahan', ('KODE KECAMATAN', 'KODE', 'DESA/KELURAHAN')),
+}
+# Parent kode lookups ("all villages in kecamatan X") are answered from the index alone
+INDEXES = {
+    'provinsi': [('provinsi',)],
+    'kabupaten_kota': [('kode_provinsi', 'kode', 'kabupaten_kota'), ('kabupaten_kota',)],
+    'kecamatan': [('kode_kabupaten_kota', 'kode', 'kecamatan'), ('kecamatan',)],
+    'desa_kelurahan': [('kode_kecamatan', 'kode', 'desa_kelurahan'), ('desa_kelurahan',)],
+}
+WILAYAH_SQL = '''
+CREATE TABLE wilayah AS
+SELECT d.kode, p.kode AS kode_provinsi, p.provinsi, k.kode AS kode_kabupaten_kota, k.kabupaten_kota,
+       c.kode AS kode_kecamatan, c.kecamatan, d.desa_kelurahan
+FROM desa_kelurahan d
+JOIN kecamatan c ON c.kode = d.kode_kecamatan
+JOIN kabupaten_kota k ON k.kode = c.kode_kabupaten_kota
+JOIN provinsi p ON p.kode = k.kode_provinsi
+'''
+BATCH_SIZE = 5000
+
 logger = create_logger(log_filename(__file__))
 
 
-def main():
-    dest_path = os.path.join(BASE_DIR, '{}.xlsx'.format(OUTPUT_BASENAME))
-    try:
-        touch(dest_path)
-    except Exception as e:
-        logger.error('Could not write output file: %s', dest_path)
-        logger.error('%s', e)
-        return
+def foreign_key_sql(table_name: str) -> str:
+    column, ref_table = FOREIGN_KEYS[table_name]
+    return 'CONSTRAINT {0}_{1}_fk FOREIGN KEY({1}) REFERENCES {2}(kode)'.format(table_name, column, ref_table)
 
-    src_dict = {
-        'PROVINSI': (os.path.join(DATA_DIR, 'provinsi.xlsx'), ('KODE', 'PROVINSI')),
-        'KABUPATEN/KOTA': (os.path.join(OUT_DIR, 'kabupaten-out.xlsx'), ('KODE PROVINSI', 'KODE', 'KABUPATEN/KOTA')),
-        'KECAMATAN': (os.path.join(OUT_DIR, 'kecamatan-out.xlsx'), ('KODE KABUPATEN/KOTA', 'KODE', 'KECAMATAN')),
-        'DESA/KELURAHAN': (os.path.join(OUT_DIR, 'desa-out.xlsx'), ('KODE KECAMATAN', 'KODE', 'DESA/KELURAHAN')),
-    }
 
+def iter_source(level: str, sources: Optional[Dict[str, Iterable[Sequence]]] = None) -> Iterator[Sequence]:
+    if sources is not None and level in sources:
+        name = level
+        rows = sources[level]
+    else:
+        name = SOURCE_PATHS[level]
+        rows = read_xlsx(name)
+
+    for row in rows:
+        v1, v2 = row
+        if v1 is None or v2 is None:
+            logger.warn('Empty row in %s: %s, %s', name, v1, v2)
+        yield row
+
+
+def sources_digest(sources: Optional[Dict[str, Iterable[Sequence]]] = None) -> Optional[str]:
+    digests = []
+    for level, fpath in SOURCE_PATHS.items():
+        if sources is not None and level in sources:
+            # Hashing would consume a one-shot iterator, so those sources are never cached
+            if not isinstance(sources[level], SequenceABC):
+                return None
+            digests.append(rows_digest(sources[level]))
+        else:
+            digests.append(file_digest(fpath))
+    return rows_digest([digests])
+
+
+def sheet_rows(ws_name: str, level: str, sources: Optional[Dict[str, Iterable[Sequence]]] = None) -> Iterator[Sequence]:
+    for row in iter_source(level, sources):
+        if ws_name == 'PROVINSI':
+            yield row
+        else:
+            v1, v2 = row
+            yield (parent_kode(str(v1)), v1, v2)
+
+
+def add_table(ws_out, ws_name: str, headers: Sequence[str], nrow: int):
+    from openpyxl.worksheet.table import Table, TableColumn, TableStyleInfo
+
+    table_ref = 'A1:B{}'.format(nrow) if ws_name == 'PROVINSI' else 'A1:C{}'.format(nrow)
+    # Write-only sheets cannot be read back for the headings, so the columns are named up front
+    columns = [TableColumn(id=i, name=header) for i, header in enumerate(headers, 1)]
+    table = Table(displayName=ws_name.replace('/', '_'), ref=table_ref, tableColumns=columns)
+    table.tableStyleInfo = TableStyleInfo(
+        name='TableStyleMedium9', showFirstColumn=False, showLastColumn=False, showRowStripes=True, showColumnStripes=False)
+    with warnings.catch_warnings():
+        # openpyxl warns on every write-only add_table, even when the columns are already set
+        warnings.simplefilter('ignore', UserWarning)
+        ws_out.add_table(table)
+
+
+def build_workbook(sources: Optional[Dict[str, Iterable[Sequence]]] = None) -> 'Workbook':
+    from openpyxl import Workbook
+    from openpyxl.utils import get_column_letter
+
+    # Keeps every cell as an object until saved, only used to compare against build_write_only
     wb_out = Workbook()
     wb_out.remove(wb_out.active)
 
-    for ws_name, (fpath, headers) in src_dict.items():
+    for ws_name, (level, headers) in SHEETS.items():
         ws_out = wb_out.create_sheet(title=ws_name.replace('/', '-'))
         ws_out.append(headers)
-        ws_out.column_dimensions['A'].auto_size = True
-        ws_out.column_dimensions['B'].auto_size = True
-        ws_out.column_dimensions['C'].auto_size = True
-        wb = load_workbook(fpath, read_only=True)
-        ws = wb.active
+        for letter in 'ABC':
+            ws_out.column_dimensions[letter].auto_size = True
         nrow = 1
-        for row in ws.iter_rows(ws.min_row, ws.max_row, 1, 2, True):
-            v1, v2 = row
-            if v1 is None or v2 is None:
-                logger.warn('Empty row in %s: %s, %s', fpath, v1, v2)
-            if ws_name == 'PROVINSI':
-                ws_out.append(row)
-            else:
-                fk = re.sub(r'\.\d+$', '', str(v1))
-                ws_out.append([fk, v1, v2])
+        for row in sheet_rows(ws_name, level, sources):
+            ws_out.append(row)
             nrow += 1
-        wb.close()
-        ncol = 1
-        for col in ws_out.iter_cols(1, 2, 1, 2, True):
-            width = max(len(str(val)) for val in col) + 4
-            ws_out.column_dimensions[get_column_letter(ncol)].width = width
-            ncol += 1
+        for ncol, col in enumerate(ws_out.iter_cols(1, 2, 1, 2, True), 1):
+            ws_out.column_dimensions[get_column_letter(ncol)].width = max(len(str(val)) for val in col) + 4
         ws_out.column_dimensions['B' if ws_name == 'PROVINSI' else 'C'].width = 50
-        table_ref = 'A1:B{}'.format(nrow) if ws_name == 'PROVINSI' else 'A1:C{}'.format(nrow)
-        table = Table(displayName=ws_name.replace('/', '_'), ref=table_ref)
-        table.tableStyleInfo = TableStyleInfo(
-            name='TableStyleMedium9', showFirstColumn=False, showLastColumn=False, showRowStripes=True, showColumnStripes=False)
-        ws_out.add_table(table)
+        add_table(ws_out, ws_name, headers, nrow)
+    return wb_out
+
+
+def read_level(ws_name: str) -> RowBuffer:
+    # Reads one extraction output, shares nothing with the other levels so it can run in a worker process
+    level, _ = SHEETS[ws_name]
+    return RowBuffer(list(TABLES).index(level), read_xlsx(SOURCE_PATHS[level]))
+
+
+def write_sheet(wb_out: 'Workbook', ws_name: str, headers: Sequence[str], rows: Iterable[Sequence]):
+    # Write-only sheets need their column widths before the first row. As in build_workbook they come from
+    # the header and the first row, so only that row is read ahead and the rest is streamed.
+    rows = iter(rows)
+    first = next(rows, None)
+    ws_out = wb_out.create_sheet(title=ws_name.replace('/', '-'))
+    for letter in 'ABC':
+        ws_out.column_dimensions[letter].auto_size = True
+    for letter, header, value in zip('AB', headers, first if first is not None else (None, None)):
+        ws_out.column_dimensions[letter].width = max(len(str(header)), len(str(value))) + 4
+    ws_out.column_dimensions['B' if ws_name == 'PROVINSI' else 'C'].width = 50
+    ws_out.append(headers)
+    nrow = 1
+    for row in chain([first], rows) if first is not None else ():
+        ws_out.append(row)
+        nrow += 1
+    add_table(ws_out, ws_name, headers, nrow)
+
+
+def build_write_only(sources: Optional[Dict[str, Iterable[Sequence]]] = None, mode: str = 'process',
+                     workers: Optional[int] = None) -> 'Workbook':
+    from openpyxl import Workbook
+
+    wb_out = Workbook(write_only=True)
+
+    if sources is not None or mode == 'serial':
+        # Rows go from the source to the sheet one at a time, no level is held as a whole. Sources already
+        # in memory are always walked here, sending them to a process costs more than writing them.
+        for ws_name, (level, headers) in SHEETS.items():
+            write_sheet(wb_out, ws_name, headers, sheet_rows(ws_name, level, sources))
+        return wb_out
+
+    # The extraction outputs are read in parallel and each sheet is written as soon as its level is ready.
+    # A level read ahead is held in a RowBuffer until then, the serial mode streams instead.
+    levels = imap_tasks(read_level, list(SHEETS), mode, workers)
+    for (ws_name, (level, headers)), rows in zip(SHEETS.items(), levels):
+        write_sheet(wb_out, ws_name, headers, sheet_rows(ws_name, level, {level: rows}))
+    return wb_out
+
+
+@metrics.timed('combine')
+def main(sources: Optional[Dict[str, Iterable[Sequence]]] = None, use_cache: bool = True, write_only: bool = True,
+         dest_path: Optional[str] = None, mode: str = 'process', workers: Optional[int] = None):
+    dest_path = dest_path or os.path.join(BASE_DIR, '{}.xlsx'.format(OUTPUT_BASENAME))
+    cache = BuildCache('combine', enabled=use_cache)
+    key = sources_digest(sources)
+    if key is not None:
+        # Rebuilt when the sources, the code writing the workbook or the way it is built change
+        key = data_digest(key, code_version(__file__, inspect.getfile(RowBuffer)), write_only)
+    if key is not None and cache.is_fresh(dest_path, key):
+        logger.info('Up to date: %s', dest_path)
+        return
+
+    try:
+        touch(dest_path)
+    except Exception as e:
+        logger.error('Could not write output file: %s', dest_path)
+        logger.error('%s', e)
+        return
+
+    t0 = time.perf_counter()
+    wb_out = build_write_only(sources, mode, workers) if write_only else build_workbook(sources)
+    t1 = time.perf_counter()
 
     try:
         wb_out.save(dest_path)
@@ -90,91 +257,271 @@ def main():
     except Exception as e:
         logger.error('Could not save to: %s', dest_path)
         logger.error('%s', e)
+        return
+    t2 = time.perf_counter()
+    logger.debug('Workbook built in %s seconds, saved in %s seconds', round(t1 - t0, 4), round(t2 - t1, 4))
 
+    if key is not None:
+        cache.mark(dest_path, key)
+        cache.save()
 
-def insert_into_db(dbms='postgres', dbname=OUTPUT_BASENAME):
-    kwargs = DB_CONFIG.get(dbms)
+
+def connect_db(dbms='postgres', dbname=OUTPUT_BASENAME):
+    kwargs = dict(DB_CONFIG.get(dbms, {}))
     if dbms == 'postgres':
+        import psycopg2
         kwargs.update({'dbname': dbname})
-        conn = psycopg2.connect(**kwargs)
+        return psycopg2.connect(**kwargs)
     elif dbms == 'mysql':
+        import mysql.connector
         kwargs.update({'database': dbname})
-        conn = mysql.connector.connect(**kwargs)
+        return mysql.connector.connect(**kwargs)
     elif dbms == 'sqlite':
-        conn = sqlite3.connect(os.path.join(BASE_DIR, '{}.db'.format(dbname)))
-    else:
-        raise ValueError('Invalid DBMS')
+        return sqlite3.connect(os.path.join(BASE_DIR, '{}.db'.format(dbname)))
+    raise ValueError('Invalid DBMS')
 
-    cur = conn.cursor()
 
-    table_dict = {
-        'provinsi': [
-            'kode VARCHAR(20) NOT NULL PRIMARY KEY',
-            'provinsi VARCHAR(255) NOT NULL',
-        ],
-        'kabupaten_kota': [
-            'kode VARCHAR(20) NOT NULL PRIMARY KEY',
-            'kode_provinsi VARCHAR(20) NOT NULL',
-            'kabupaten_kota VARCHAR(255) NOT NULL',
-            'CONSTRAINT kabupaten_kota_kode_provinsi_fk FOREIGN KEY(kode_provinsi) REFERENCES provinsi(kode)',
-        ],
-        'kecamatan': [
-            'kode VARCHAR(20) NOT NULL PRIMARY KEY',
-            'kode_kabupaten_kota VARCHAR(20) NOT NULL',
-            'kecamatan VARCHAR(255) NOT NULL',
-            'CONSTRAINT kecamatan_kode_kabupaten_kota_fk FOREIGN KEY(kode_kabupaten_kota) REFERENCES kabupaten_kota(kode)',
-        ],
-        'desa_kelurahan': [
-            'kode VARCHAR(20) NOT NULL PRIMARY KEY',
-            'kode_kecamatan VARCHAR(20) NOT NULL',
-            'desa_kelurahan VARCHAR(255) NOT NULL',
-            'CONSTRAINT desa_kelurahan_kode_kecamatan_fk FOREIGN KEY(kode_kecamatan) REFERENCES kecamatan(kode)',
-        ]
-    }
+def iter_table_rows(table_name: str, sources: Optional[Dict[str, Iterable[Sequence]]] = None) -> Iterator[tuple]:
+    for row in iter_source(table_name, sources):
+        v1, v2 = row
+        if table_name == 'provinsi':
+            yield (v1, v2)
+        else:
+            yield (v1, parent_kode(str(v1)), v2)
+
+
+def copy_rows(cur, table_name: str, rows: Iterable[tuple]):
+    # PostgreSQL COPY text format, NULL is \N and control characters are escaped
+    def escape(value) -> str:
+        if value is None:
+            return '\\N'
+        return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+    buf = io.StringIO()
+    for row in rows:
+        buf.write('\t'.join(escape(value) for value in row))
+        buf.write('\n')
+    buf.seek(0)
+    cur.copy_expert('COPY {} FROM STDIN'.format(table_name), buf)
+
+
+def insert_rows(cur, dbms: str, table_name: str, rows: Iterable[tuple], batch_size: int = BATCH_SIZE,
+                bulk: bool = True) -> int:
+    placeholder = '?' if dbms == 'sqlite' else '%s'
+    count = 0
+    for batch in batched(rows, batch_size):
+        if bulk and dbms == 'postgres':
+            copy_rows(cur, table_name, batch)
+        elif bulk and dbms == 'mysql':
+            values = '({})'.format(', '.join([placeholder] * len(batch[0])))
+            sql = 'INSERT INTO {} VALUES {}'.format(table_name, ', '.join([values] * len(batch)))
+            cur.execute(sql, [value for row in batch for value in row])
+        else:
+            sql = 'INSERT INTO {} VALUES ({})'.format(table_name, ', '.join([placeholder] * len(batch[0])))
+            cur.executemany(sql, batch)
+        count += len(batch)
+    return count
 
-    src_dict = {
-        'provinsi': os.path.join(DATA_DIR, 'provinsi.xlsx'),
-        'kabupaten_kota': os.path.join(OUT_DIR, 'kabupaten-out.xlsx'),
-        'kecamatan': os.path.join(OUT_DIR, 'kecamatan-out.xlsx'),
-        'desa_kelurahan': os.path.join(OUT_DIR, 'desa-out.xlsx'),
-    }
 
+def begin_load(cur, dbms: str, bulk: bool = True):
     # Disable Foreign Key checks for MySQL
     if dbms == 'mysql':
         cur.execute('SET FOREIGN_KEY_CHECKS = 0')
+    elif dbms == 'sqlite' and bulk:
+        # The database is rebuilt from scratch, a crash only means running the load again
+        cur.execute('PRAGMA journal_mode = MEMORY')
+        cur.execute('PRAGMA synchronous = OFF')
+
+
+def create_table(cur, dbms: str, table_name: str):
+    columns = TABLES[table_name]
+    drop_sql = 'DROP TABLE IF EXISTS {}'.format(table_name)
+    if dbms != 'sqlite':
+        drop_sql += ' CASCADE'
+    cur.execute(drop_sql)
+    # SQLite cannot add constraints to an existing table
+    if dbms == 'sqlite' and table_name in FOREIGN_KEYS:
+        columns = columns + [foreign_key_sql(table_name)]
+    cur.execute('CREATE TABLE {} ({})'.format(table_name, ','.join(columns)))
 
-    for table_name, fpath in src_dict.items():
-        drop_sql = 'DROP TABLE IF EXISTS {}'.format(table_name)
-        if dbms != 'sqlite':
-            drop_sql += ' CASCADE'
-        cur.execute(drop_sql)
-        cur.execute('CREATE TABLE {} ({})'.format(table_name, ','.join(table_dict[table_name])))
-        wb = load_workbook(fpath, read_only=True)
-        ws = wb.active
-        for row in ws.iter_rows(ws.min_row, ws.max_row, 1, 2, True):
-            v1, v2 = row
-            if v1 is None or v2 is None:
-                logger.warn('Empty row in %s: %s, %s', fpath, v1, v2)
-            if table_name == 'provinsi':
-                sql = 'INSERT INTO {} VALUES  (%s, %s)'.format(table_name)
-                args = row
-            else:
-                fk = re.sub(r'\.\d+$', '', str(v1))
-                sql = 'INSERT INTO {} VALUES  (%s, %s, %s)'.format(table_name)
-                args = (v1, fk, v2)
-            if dbms == 'sqlite':
-                sql = sql.replace('%s', '?')
-            cur.execute(sql, args)
-
-        wb.close()
+
+def finish_load(cur, dbms: str, indexes: bool = True, wilayah: bool = False):
+    # Foreign keys are created after the load so rows are not checked one by one
+    if dbms != 'sqlite':
+        for table_name in FOREIGN_KEYS:
+            t0 = time.perf_counter()
+            cur.execute('ALTER TABLE {} ADD {}'.format(table_name, foreign_key_sql(table_name)))
+            td = round(time.perf_counter() - t0, 4)
+            logger.info('Created foreign key on %s in %s seconds', table_name, td)
 
     # Re-enable Foreign Key checks for MySQL
     if dbms == 'mysql':
         cur.execute('SET FOREIGN_KEY_CHECKS = 1')
 
-    conn.commit()
-    cur.close()
-    conn.close()
+    # Secondary indexes are also built after the load, and the planner statistics after those
+    tables = list(TABLES)
+    if indexes:
+        create_indexes(cur, dbms)
+    if wilayah:
+        create_wilayah(cur, dbms)
+        tables.append('wilayah')
+    analyze(cur, dbms, tables)
+
+
+def create_indexes(cur, dbms: str):
+    for table_name, indexes in INDEXES.items():
+        for columns in indexes:
+            t0 = time.perf_counter()
+            cur.execute('CREATE INDEX {0}_{1}_idx ON {0} ({2})'.format(table_name, columns[0], ', '.join(columns)))
+            td = round(time.perf_counter() - t0, 4)
+            logger.info('Created index on %s (%s) in %s seconds', table_name, ', '.join(columns), td)
+
+
+def create_wilayah(cur, dbms: str):
+    # One row per village with all four levels, for consumers that do not want the joins
+    t0 = time.perf_counter()
+    cur.execute('DROP TABLE IF EXISTS wilayah')
+    cur.execute(WILAYAH_SQL)
+    if dbms == 'sqlite':
+        # CREATE TABLE AS cannot declare constraints in SQLite
+        cur.execute('CREATE UNIQUE INDEX wilayah_kode_idx ON wilayah (kode)')
+    else:
+        cur.execute('ALTER TABLE wilayah ADD PRIMARY KEY (kode)')
+    cur.execute('CREATE INDEX wilayah_kode_kecamatan_idx ON wilayah (kode_kecamatan)')
+    td = round(time.perf_counter() - t0, 4)
+    logger.info('Created wilayah in %s seconds', td)
+
+
+def table_exists(cur, dbms: str, table_name: str) -> bool:
+    if dbms == 'sqlite':
+        cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,))
+    else:
+        schema = 'DATABASE()' if dbms == 'mysql' else 'current_schema()'
+        cur.execute('SELECT 1 FROM information_schema.tables WHERE table_schema = {} AND table_name = %s'
+                    .format(schema), (table_name,))
+    return cur.fetchone() is not None
+
+
+def analyze(cur, dbms: str, tables: Sequence[str]):
+    if dbms == 'mysql':
+        cur.execute('ANALYZE TABLE {}'.format(', '.join(tables)))
+        # MySQL returns a status row per table that has to be read before the next statement
+        cur.fetchall()
+    else:
+        cur.execute('ANALYZE')
+
+
+def upsert_sql(dbms: str, table_name: str) -> str:
+    columns = [column.split()[0] for column in TABLES[table_name]]
+    placeholder = '?' if dbms == 'sqlite' else '%s'
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        table_name, ', '.join(columns), ', '.join([placeholder] * len(columns)))
+    if dbms == 'mysql':
+        return sql + ' ON DUPLICATE KEY UPDATE ' + ', '.join('{0} = VALUES({0})'.format(c) for c in columns[1:])
+    return sql + ' ON CONFLICT (kode) DO UPDATE SET ' + ', '.join('{0} = excluded.{0}'.format(c) for c in columns[1:])
+
+
+def table_row(table_name: str, kode: str, nama: str) -> tuple:
+    return (kode, nama) if table_name == 'provinsi' else (kode, parent_kode(kode), nama)
+
+
+def apply_changes(cur, dbms: str, changes: Dict[str, Dict[str, List[tuple]]], batch_size: int = BATCH_SIZE) -> int:
+    # Children are deleted before their parents and parents upserted before their children,
+    # so the foreign keys hold after every statement
+    placeholder = '?' if dbms == 'sqlite' else '%s'
+    count = 0
+    for table_name in reversed(list(changes)):
+        table = changes[table_name]
+        kodes = [kode for kode, _ in table['removed']] + [old_kode for old_kode, _, _ in table['reparented']]
+        for batch in batched(kodes, batch_size):
+            cur.execute('DELETE FROM {} WHERE kode IN ({})'.format(table_name, ', '.join([placeholder] * len(batch))),
+                        batch)
+        count += len(kodes)
+    for table_name, table in changes.items():
+        rows = [table_row(table_name, kode, nama) for kode, nama in table['added']]
+        rows += [table_row(table_name, kode, nama) for kode, _, nama in table['renamed']]
+        rows += [table_row(table_name, kode, nama) for _, kode, nama in table['reparented']]
+        for batch in batched(rows, batch_size):
+            cur.executemany(upsert_sql(dbms, table_name), batch)
+        count += len(rows)
+        logger.info('Applied to %s: %s', table_name,
+                    ', '.join('{} {}'.format(len(table[kind]), kind) for kind in table))
+    return count
+
+
+def load_table(cur, dbms: str, table_name: str, sources: Optional[Dict[str, Iterable[Sequence]]] = None,
+               batch_size: int = BATCH_SIZE, bulk: bool = True) -> int:
+    t0 = time.perf_counter()
+    with metrics.stage('load', table=table_name, dbms=dbms, bulk=bulk) as stage:
+        stage.rows = insert_rows(cur, dbms, table_name, iter_table_rows(table_name, sources), batch_size, bulk)
+    td = round(time.perf_counter() - t0, 4)
+    logger.info('Loaded %s rows into %s in %s seconds', stage.rows, table_name, td)
+    return stage.rows
+
+
+def load_level(dbms: str, dbname: str, task: Tuple[str, Optional[Iterable[Sequence]]], batch_size: int = BATCH_SIZE,
+               bulk: bool = True) -> int:
+    # Shares nothing with the other levels, the rows are read from the extraction output when not given
+    table_name, rows = task
+    conn = connect_db(dbms, dbname)
+    cur = conn.cursor()
+    try:
+        begin_load(cur, dbms, bulk)
+        count = load_table(cur, dbms, table_name, None if rows is None else {table_name: rows}, batch_size, bulk)
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+    return count
+
+
+def insert_into_db(dbms='postgres', dbname=OUTPUT_BASENAME, sources: Optional[Dict[str, Iterable[Sequence]]] = None,
+                   batch_size: int = BATCH_SIZE, bulk: bool = True, indexes: bool = True, wilayah: bool = False,
+                   changes: Optional[Dict[str, Dict[str, List[tuple]]]] = None, mode: str = 'serial',
+                   workers: Optional[int] = None):
+    conn = connect_db(dbms, dbname)
+    cur = conn.cursor()
+    try:
+        if changes is not None:
+            # A release update touches only the changed codes, the tables and indexes stay in place
+            t0 = time.perf_counter()
+            with metrics.stage('apply_changes', dbms=dbms) as stage:
+                stage.rows = apply_changes(cur, dbms, changes, batch_size)
+                tables = list(TABLES)
+                # A wilayah table left as it was would still show the codes that were just changed
+                if wilayah or table_exists(cur, dbms, 'wilayah'):
+                    create_wilayah(cur, dbms)
+                    tables.append('wilayah')
+                analyze(cur, dbms, tables)
+            conn.commit()
+            td = round(time.perf_counter() - t0, 4)
+            logger.info('Applied %s changes in %s seconds', stage.rows, td)
+            return
+
+        begin_load(cur, dbms, bulk)
+
+        if dbms == 'sqlite' or mode == 'serial':
+            # The whole load is one transaction, a failure leaves the previous tables in place (on Postgres).
+            # SQLite takes one writer at a time, a connection per level would only wait on the lock.
+            for table_name in TABLES:
+                create_table(cur, dbms, table_name)
+                load_table(cur, dbms, table_name, sources, batch_size, bulk)
+        else:
+            # Every level is read and loaded on a connection of its own. There are no foreign keys until
+            # finish_load, so the levels do not depend on each other's rows. The empty tables are committed
+            # first, so a level that fails leaves the tables dropped or partly loaded.
+            for table_name in TABLES:
+                create_table(cur, dbms, table_name)
+            conn.commit()
+            tasks = [(table_name, sources.get(table_name) if sources is not None else None) for table_name in TABLES]
+            map_tasks(partial(load_level, dbms, dbname, batch_size=batch_size, bulk=bulk), tasks, mode,
+                      workers or len(TABLES))
+
+        finish_load(cur, dbms, indexes, wilayah)
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
 
 
 def dump_db(dbms='postgres', dbname=OUTPUT_BASENAME):
@@ -203,13 +550,14 @@ def dump_db(dbms='postgres', dbname=OUTPUT_BASENAME):
 
 
 if __name__ == '__main__':
-    t0 = time.process_time()
+    metrics.configure()
+    t0 = time.perf_counter()
     main()
     # insert_into_db(dbms='postgres')
     # insert_into_db(dbms='mysql')
     # insert_into_db(dbms='sqlite')
     # dump_db(dbms='postgres')
     # dump_db(dbms='mysql')
-    t1 = time.process_time()
+    t1 = time.perf_counter()
     td = round(t1-t0, 4)
     logger.info('Elapsed time: %s seconds', td)
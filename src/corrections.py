@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+from collections import Counter
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+import metrics
+from cache import data_digest
+from utils import BASE_DIR
+
+CORRECTIONS_PATH = os.path.join(BASE_DIR, 'src', 'corrections.json')
+
+# Rule kinds of a level in corrections.json:
+#   names       kode -> name, for a kode whose name cell is empty in the source
+#   excludes    codes left out of the output
+#   cells       file -> {name cell: name}, a cell replaced as a whole, e.g. a name wrapped over two lines
+#   skip_names  file -> names left out, e.g. what remains of a wrapped name
+#   prefixes    kabupaten/kota prefixes a cell holding several names is split on
+Rule = Tuple[str, ...]
+
+
+def load_corrections(fpath: str = CORRECTIONS_PATH) -> Dict[str, Dict[str, Any]]:
+    with open(fpath, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class Rules:
+    # The corrections of one level compiled into dict and set lookups, so a row costs a lookup
+    # instead of a check per rule. Hits are counted per rule, e.g. ('names', '12.03.04.2064').
+    def __init__(self, level: str, corrections: Optional[Dict[str, Dict[str, Any]]] = None):
+        if corrections is None:
+            corrections = load_corrections()
+        self.level = level
+        self.section = corrections.get(level, {})
+        self.names: Dict[str, str] = dict(self.section.get('names', {}))
+        self.excludes: FrozenSet[str] = frozenset(self.section.get('excludes', ()))
+        self.cells: Dict[str, Dict[str, str]] = {fname: dict(cells)
+                                                 for fname, cells in self.section.get('cells', {}).items()}
+        self.skip_names: Dict[str, FrozenSet[str]] = {fname: frozenset(names)
+                                                      for fname, names in self.section.get('skip_names', {}).items()}
+        self.prefixes: Optional[List[str]] = self.section.get('prefixes')
+        self.hits: Counter = Counter()
+
+    def digest(self) -> str:
+        return data_digest(self.section)
+
+    def cells_for(self, fpath: str) -> Dict[str, str]:
+        return self.cells.get(os.path.basename(fpath), {})
+
+    def skip_names_for(self, fpath: str) -> FrozenSet[str]:
+        return self.skip_names.get(os.path.basename(fpath), frozenset())
+
+    def rules(self) -> List[Rule]:
+        rules = [('names', kode) for kode in self.names]
+        rules += [('excludes', kode) for kode in sorted(self.excludes)]
+        rules += [('cells', fname, cell) for fname, cells in self.cells.items() for cell in cells]
+        rules += [('skip_names', fname, name) for fname, names in self.skip_names.items() for name in sorted(names)]
+        if self.prefixes:
+            rules.append(('prefixes',))
+        return rules
+
+    def report(self, logger: logging.Logger, name: str, complete: bool = True):
+        # Not complete when part of the files came from the build cache, their hits were not counted
+        rules = self.rules()
+        for rule in rules:
+            hits = self.hits[rule]
+            metrics.emit('rule', name, kind=rule[0], key=list(rule[1:]), hits=hits)
+            if hits == 0 and complete:
+                logger.warn('Correction never applied: %s %s', rule[0], ', '.join(repr(key) for key in rule[1:]))
+        logger.info('Corrections %s: %s rules, %s hits', self.level, len(rules), sum(self.hits.values()))
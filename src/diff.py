@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import time
+from argparse import ArgumentParser
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from combine import TABLES
+from kode import parent_kode
+from utils import OUT_DIR, create_logger, log_filename
+
+CHANGES_PATH = os.path.join(OUT_DIR, 'changes.json')
+KINDS = ('added', 'removed', 'renamed', 'reparented')
+
+logger = create_logger(log_filename(__file__))
+
+Changes = Dict[str, Dict[str, List[tuple]]]
+
+
+def load_xlsx(fpath: str) -> Dict[str, List[tuple]]:
+    # A combined release workbook, sheets in TABLES order with kode and name as the last two columns
+    from openpyxl import load_workbook
+
+    wb = load_workbook(fpath, read_only=True)
+    try:
+        return {table_name: [(row[-2], row[-1]) for row in ws.iter_rows(2, values_only=True) if row[-2] is not None]
+                for table_name, ws in zip(TABLES, wb)}
+    finally:
+        wb.close()
+
+
+def load_db(cur) -> Dict[str, List[tuple]]:
+    # Works on any DB-API cursor, e.g. the database a release update is applied to
+    sources = {}
+    for table_name in TABLES:
+        cur.execute('SELECT kode, {0} FROM {0} ORDER BY kode'.format(table_name))
+        sources[table_name] = cur.fetchall()
+    return sources
+
+
+def load_dataset(spec: Optional[str] = None) -> Dict[str, List[tuple]]:
+    # No spec means the current extraction outputs, otherwise a combined .xlsx or a SQLite .db release
+    if not spec:
+        import validate
+        return validate.load_sources()
+    if spec.endswith('.db'):
+        import sqlite3
+        conn = sqlite3.connect(spec)
+        try:
+            return load_db(conn.cursor())
+        finally:
+            conn.close()
+    return load_xlsx(spec)
+
+
+def sorted_rows(rows: Iterable[Sequence]) -> List[Tuple[str, Optional[str]]]:
+    return sorted((str(kode).strip(), nama) for kode, nama in rows if kode is not None)
+
+
+def diff_level(old_rows: Iterable[Sequence], new_rows: Iterable[Sequence]) -> Dict[str, List[tuple]]:
+    # Sorted merge join on kode, both sides are walked once
+    old, new = sorted_rows(old_rows), sorted_rows(new_rows)
+    changes = {kind: [] for kind in KINDS}
+    i = j = 0
+    while i < len(old) and j < len(new):
+        (old_kode, old_nama), (new_kode, new_nama) = old[i], new[j]
+        if old_kode == new_kode:
+            if old_nama != new_nama:
+                changes['renamed'].append((old_kode, old_nama, new_nama))
+            i += 1
+            j += 1
+        elif old_kode < new_kode:
+            changes['removed'].append(old[i])
+            i += 1
+        else:
+            changes['added'].append(new[j])
+            j += 1
+    changes['removed'].extend(old[i:])
+    changes['added'].extend(new[j:])
+    return match_moves(changes)
+
+
+def match_moves(changes: Dict[str, List[tuple]]) -> Dict[str, List[tuple]]:
+    # A region moved under another parent gets a new kode, a removed and an added kode with the same
+    # name and a different parent are one move when the name is unambiguous on both sides
+    removed_names = Counter(nama for _, nama in changes['removed'])
+    added_names = Counter(nama for _, nama in changes['added'])
+    removed = {nama: kode for kode, nama in changes['removed'] if removed_names[nama] == 1 and added_names[nama] == 1}
+    moves = {}
+    for new_kode, nama in changes['added']:
+        old_kode = removed.get(nama)
+        if old_kode is not None and '.' in old_kode and parent_kode(old_kode) != parent_kode(new_kode):
+            moves[old_kode] = new_kode
+    if moves:
+        moved = set(moves.values())
+        changes['reparented'] = [(kode, moves[kode], nama) for kode, nama in changes['removed'] if kode in moves]
+        changes['removed'] = [row for row in changes['removed'] if row[0] not in moves]
+        changes['added'] = [row for row in changes['added'] if row[0] not in moved]
+    return changes
+
+
+def diff(old: Dict[str, Iterable[Sequence]], new: Dict[str, Iterable[Sequence]]) -> Changes:
+    return {table_name: diff_level(old.get(table_name, ()), new.get(table_name, ())) for table_name in TABLES}
+
+
+def count_changes(changes: Changes) -> Dict[str, int]:
+    return {kind: sum(len(table[kind]) for table in changes.values()) for kind in KINDS}
+
+
+def save_changes(changes: Changes, dest_path: str = CHANGES_PATH, **info):
+    os.makedirs(os.path.dirname(os.path.abspath(dest_path)), exist_ok=True)
+    with open(dest_path, 'w', encoding='utf-8') as f:
+        json.dump(dict(info, counts=count_changes(changes), tables=changes), f, ensure_ascii=False, indent=1)
+
+
+def load_changes(fpath: str) -> Changes:
+    with open(fpath, 'r', encoding='utf-8') as f:
+        tables = json.load(f)['tables']
+    return {table_name: {kind: [tuple(row) for row in tables[table_name][kind]] for kind in KINDS}
+            for table_name in TABLES if table_name in tables}
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Changes between two releases: added, removed, renamed and reparented codes')
+    parser.add_argument('old', help='Previous release, a combined .xlsx or a SQLite .db')
+    parser.add_argument('new', nargs='?', default=None, help='New release (default: the current extraction outputs)')
+    parser.add_argument('-o', '--output', default=CHANGES_PATH, help='Changelog JSON path')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    old, new = load_dataset(args.old), load_dataset(args.new)
+    t1 = time.perf_counter()
+    changes = diff(old, new)
+    t2 = time.perf_counter()
+    save_changes(changes, args.output, old=args.old, new=args.new or 'current')
+    for table_name, table in changes.items():
+        logger.info('%s: %s', table_name, ', '.join('{} {}'.format(len(table[kind]), kind) for kind in KINDS))
+    logger.info('Loaded in %s seconds, compared in %s seconds', round(t1 - t0, 4), round(t2 - t1, 4))
+    logger.info('Changelog saved to: %s', args.output)
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import sqlite3
+import stat
+import time
+from argparse import ArgumentParser
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import metrics
+from combine import FOREIGN_KEYS, OUTPUT_BASENAME, TABLES, foreign_key_sql, iter_table_rows
+from kode import format_kode, kode_level
+from utils import BASE_DIR, create_logger, log_filename
+
+EMBEDDED_PATH = os.path.join(BASE_DIR, '{}.sqlite'.format(OUTPUT_BASENAME))
+# Smallest file of 1024 to 16384 on the full dataset, larger pages only made each cold lookup read more
+PAGE_SIZE = 4096
+# Stored in the header so apps can tell this build from a database loaded by combine.insert_into_db
+APPLICATION_ID = 0x4B574944
+FORMAT_VERSION = 1
+# Contentless, only the index is stored. The rowid is the kode without dots, codes of different levels
+# have different digit counts so they never collide, and format_kode turns a rowid back into the kode.
+FTS_SQL = "CREATE VIRTUAL TABLE nama_fts USING fts5(nama, content='', tokenize='unicode61 remove_diacritics 2')"
+SEARCH_SQL = 'SELECT rowid FROM nama_fts WHERE nama_fts MATCH ? ORDER BY rank LIMIT ?'
+SEARCH_LIMIT = 20
+WORD = re.compile(r'\w+')
+LEVEL_TABLES = list(TABLES)
+
+logger = create_logger(log_filename(__file__))
+
+
+def create_tables(cur):
+    # Rows are stored in the kode primary key b-tree itself, there is no separate rowid tree to look up
+    for table_name, columns in TABLES.items():
+        if table_name in FOREIGN_KEYS:
+            columns = columns + [foreign_key_sql(table_name)]
+        cur.execute('CREATE TABLE {} ({}) WITHOUT ROWID'.format(table_name, ','.join(columns)))
+    cur.execute(FTS_SQL)
+
+
+def load_table(cur, table_name: str, sources: Optional[Dict[str, Iterable[Sequence]]] = None) -> int:
+    # Inserted in kode order, so the b-tree pages fill up left to right
+    rows = sorted((str(row[0]),) + tuple(row[1:]) for row in iter_table_rows(table_name, sources))
+    cur.executemany('INSERT INTO {} VALUES ({})'.format(table_name, ', '.join(['?'] * len(TABLES[table_name]))), rows)
+    cur.executemany('INSERT INTO nama_fts (rowid, nama) VALUES (?, ?)',
+                    ((int(row[0].replace('.', '')), row[-1]) for row in rows))
+    return len(rows)
+
+
+def create_indexes(cur):
+    # Children of a region are answered from the index alone, the kode primary key comes with every entry
+    for table_name, (column, _) in FOREIGN_KEYS.items():
+        cur.execute('CREATE INDEX {0}_{1}_idx ON {0} ({1}, {0})'.format(table_name, column))
+    cur.execute("INSERT INTO nama_fts (nama_fts) VALUES ('optimize')")
+
+
+def build(sources: Optional[Dict[str, Iterable[Sequence]]] = None, dest_path: str = EMBEDDED_PATH,
+          page_size: int = PAGE_SIZE) -> int:
+    # Built next to the destination and moved in place, apps never see a half written file
+    tmp_path = '{}.tmp'.format(dest_path)
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    os.makedirs(os.path.dirname(os.path.abspath(dest_path)), exist_ok=True)
+
+    t0 = time.perf_counter()
+    count = 0
+    with metrics.stage('embedded', page_size=page_size) as stage:
+        conn = sqlite3.connect(tmp_path)
+        cur = conn.cursor()
+        cur.execute('PRAGMA page_size = {:d}'.format(page_size))
+        cur.execute('PRAGMA journal_mode = OFF')
+        cur.execute('PRAGMA synchronous = OFF')
+        create_tables(cur)
+        for table_name in TABLES:
+            count += load_table(cur, table_name, sources)
+        create_indexes(cur)
+        conn.commit()
+        cur.execute('ANALYZE')
+        cur.execute('PRAGMA application_id = {:d}'.format(APPLICATION_ID))
+        cur.execute('PRAGMA user_version = {:d}'.format(FORMAT_VERSION))
+        conn.commit()
+        # Rewrites every table and index without free space, in the page size set above
+        cur.execute('VACUUM')
+        cur.close()
+        conn.close()
+        stage.rows = count
+
+    os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+    os.replace(tmp_path, dest_path)
+    td = round(time.perf_counter() - t0, 4)
+    logger.info('Built %s: %s rows, %s KB in %s seconds', dest_path, count, os.path.getsize(dest_path) // 1024, td)
+    return count
+
+
+def connect(fpath: str = EMBEDDED_PATH) -> sqlite3.Connection:
+    # immutable=1 skips locking and change detection, the file is never written after the build
+    return sqlite3.connect('file:{}?mode=ro&immutable=1'.format(fpath), uri=True)
+
+
+def fts_query(text: str) -> str:
+    # Every word has to match, the last one as a prefix so a partly typed name already finds results
+    words = WORD.findall(text)
+    if not words:
+        return ''
+    return ' '.join('"{}"'.format(word) for word in words) + '*'
+
+
+def search(conn: sqlite3.Connection, text: str, limit: int = SEARCH_LIMIT) -> List[Tuple[str, str]]:
+    query = fts_query(text)
+    if not query:
+        return []
+    results = []
+    for (rowid,) in conn.execute(SEARCH_SQL, (query, limit)).fetchall():
+        kode = format_kode(rowid)
+        table_name = LEVEL_TABLES[kode_level(kode)]
+        row = conn.execute('SELECT kode, {0} FROM {0} WHERE kode = ?'.format(table_name), (kode,)).fetchone()
+        if row is not None:
+            results.append(row)
+    return results
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Build the read-only SQLite database apps embed')
+    parser.add_argument('-o', '--output', default=EMBEDDED_PATH,
+                        help='Database path (default: kode_wilayah_indonesia.sqlite)')
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE, help='SQLite page size (default: 4096)')
+    parser.add_argument('--no-check', dest='check', action='store_false', help='Skip the integrity check')
+    parser.add_argument('--metrics', metavar='SINKS', default=None, help='Structured metrics sinks')
+    args = parser.parse_args()
+    metrics.configure(args.metrics)
+
+    import validate
+
+    t0 = time.perf_counter()
+    build(validate.check() if args.check else None, args.output, args.page_size)
+    t1 = time.perf_counter()
+    td = round(t1-t0, 4)
+    logger.info('Elapsed time: %s seconds', td)
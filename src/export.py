@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from argparse import ArgumentParser
+from queue import Queue
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+import combine
+import embedded
+import lookup
+import metrics
+import validate
+from combine import BATCH_SIZE, OUTPUT_BASENAME, TABLES, iter_table_rows
+from rows import RowBuffer
+from standin import StandInConnection
+from utils import OUT_DIR, batched, create_logger, log_filename
+
+TARGETS = ('xlsx', 'snapshot', 'postgres', 'mysql', 'sqlite', 'embedded', 'tsv')
+DBMS = ('postgres', 'mysql', 'sqlite')
+# Targets that are only written from a dataset that passed validate.check
+CHECKED = DBMS + ('embedded',)
+QUEUE_SIZE = 8
+TSV_DIR = os.path.join(OUT_DIR, 'tsv')
+
+logger = create_logger(log_filename(__file__))
+
+
+class Sink(ABC):
+    name = 'sink'
+
+    def open(self):
+        pass
+
+    @abstractmethod
+    def write(self, table_name: str, rows: List[tuple]):
+        pass
+
+    def close(self):
+        pass
+
+
+class SourcesSink(Sink):
+    # Collects the (kode, nama) rows back into the sources dict combine and lookup take
+    def __init__(self):
+        self.sources: Dict[str, RowBuffer] = {}
+
+    def write(self, table_name: str, rows: List[tuple]):
+        if table_name not in self.sources:
+            self.sources[table_name] = RowBuffer(list(TABLES).index(table_name))
+        self.sources[table_name].extend((row[0], row[-1]) for row in rows)
+
+
+class XlsxSink(SourcesSink):
+    name = 'xlsx'
+
+    def __init__(self, use_cache: bool = True):
+        super().__init__()
+        self.use_cache = use_cache
+
+    def close(self):
+        combine.main(self.sources, self.use_cache)
+
+
+class SnapshotSink(SourcesSink):
+    name = 'snapshot'
+
+    def close(self):
+        lookup.build_index(self.sources)
+
+
+class EmbeddedSink(SourcesSink):
+    name = 'embedded'
+
+    def close(self):
+        embedded.build(self.sources)
+
+
+class DbSink(Sink):
+    def __init__(self, dbms: str, connect: Callable, batch_size: int = BATCH_SIZE, bulk: bool = True,
+                 indexes: bool = True, wilayah: bool = False):
+        self.name = dbms
+        self.dbms = dbms
+        self.connect = connect
+        self.batch_size = batch_size
+        self.bulk = bulk
+        self.indexes = indexes
+        self.wilayah = wilayah
+        self.counts: Dict[str, int] = {}
+
+    def open(self):
+        self.conn = self.connect()
+        self.cur = self.conn.cursor()
+        combine.begin_load(self.cur, self.dbms, self.bulk)
+        for table_name in TABLES:
+            combine.create_table(self.cur, self.dbms, table_name)
+
+    def write(self, table_name: str, rows: List[tuple]):
+        count = combine.insert_rows(self.cur, self.dbms, table_name, rows, self.batch_size, self.bulk)
+        self.counts[table_name] = self.counts.get(table_name, 0) + count
+
+    def close(self):
+        for table_name, count in self.counts.items():
+            logger.info('Loaded %s rows into %s.%s', count, self.dbms, table_name)
+        combine.finish_load(self.cur, self.dbms, self.indexes, self.wilayah)
+        self.conn.commit()
+        self.cur.close()
+        self.conn.close()
+
+
+class TsvSink(Sink):
+    name = 'tsv'
+
+    def __init__(self, dest_dir: str = TSV_DIR):
+        self.dest_dir = dest_dir
+        self.files = {}
+
+    def write(self, table_name: str, rows: List[tuple]):
+        if table_name not in self.files:
+            os.makedirs(self.dest_dir, exist_ok=True)
+            f = open(os.path.join(self.dest_dir, '{}.tsv'.format(table_name)), 'w', encoding='utf-8', newline='')
+            writer = csv.writer(f, dialect='excel-tab', lineterminator='\n')
+            writer.writerow([column.split()[0] for column in TABLES[table_name]])
+            self.files[table_name] = (f, writer)
+        self.files[table_name][1].writerows(rows)
+
+    def close(self):
+        for f, _ in self.files.values():
+            f.close()
+        logger.info('Data succesfully saved to: %s', self.dest_dir)
+
+
+def create_sink(target: str, use_cache: bool = True, stand_in: bool = False, dbname: str = OUTPUT_BASENAME,
+                wilayah: bool = False) -> Sink:
+    if target == 'xlsx':
+        return XlsxSink(use_cache)
+    if target == 'snapshot':
+        return SnapshotSink()
+    if target == 'tsv':
+        return TsvSink()
+    if target == 'embedded':
+        return EmbeddedSink()
+    if target in DBMS:
+        if stand_in and target != 'sqlite':
+            os.makedirs(OUT_DIR, exist_ok=True)
+            path = os.path.join(OUT_DIR, 'standin-{}.db'.format(target))
+            return DbSink(target, lambda: StandInConnection(target, path), wilayah=wilayah)
+        return DbSink(target, lambda: combine.connect_db(target, dbname), wilayah=wilayah)
+    raise ValueError('Invalid target: {}'.format(target))
+
+
+class SinkWorker(threading.Thread):
+    def __init__(self, sink: Sink, queue_size: int = QUEUE_SIZE):
+        super().__init__(name='export-{}'.format(sink.name), daemon=True)
+        self.sink = sink
+        self.queue = Queue(queue_size)
+        self.rows = 0
+        self.error: Optional[BaseException] = None
+
+    def run(self):
+        with metrics.stage('export', sink=self.sink.name) as stage:
+            try:
+                self.sink.open()
+                for table_name, rows in iter(self.queue.get, None):
+                    self.sink.write(table_name, rows)
+                    self.rows += len(rows)
+                self.sink.close()
+            except Exception as e:
+                self.error = e
+                stage.set(error=str(e))
+                logger.error('Export to %s failed', self.sink.name)
+                logger.error('%s', e)
+                # Keep draining so the reader is never blocked by a dead sink
+                for _ in iter(self.queue.get, None):
+                    pass
+            stage.rows = self.rows
+
+
+def run(targets: Sequence[str], sources: Optional[Dict[str, Iterable[Sequence]]] = None, use_cache: bool = True,
+        stand_in: bool = False, batch_size: int = BATCH_SIZE,
+        wilayah: bool = False, check: bool = True) -> Dict[str, Optional[BaseException]]:
+    errors: Dict[str, Optional[BaseException]] = {}
+    if check and any(target in CHECKED for target in targets):
+        # A broken hierarchy fails here in a second instead of at the foreign keys after a full load
+        try:
+            sources = validate.check(sources)
+        except validate.ValidationError as e:
+            logger.error('Skipping database targets: %s', e)
+            errors = {target: e for target in targets if target in CHECKED}
+            targets = [target for target in targets if target not in CHECKED]
+
+    workers = [SinkWorker(create_sink(target, use_cache, stand_in, wilayah=wilayah)) for target in targets]
+    for worker in workers:
+        worker.start()
+
+    # The dataset is read once and every batch goes to each sink, a full queue blocks the reader
+    for table_name in TABLES:
+        for rows in batched(iter_table_rows(table_name, sources), batch_size):
+            for worker in workers:
+                worker.queue.put((table_name, rows))
+    for worker in workers:
+        worker.queue.put(None)
+
+    for worker in workers:
+        worker.join()
+    errors.update((worker.sink.name, worker.error) for worker in workers)
+    return errors
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Export the combined data to several targets in one pass')
+    parser.add_argument('-t', '--target', dest='targets', action='append', choices=TARGETS,
+                        help='Output target, may be repeated (default: xlsx and sqlite)')
+    parser.add_argument('--stand-in', action='store_true',
+                        help='Load postgres and mysql targets into local SQLite stand-ins under output/')
+    parser.add_argument('--wilayah', action='store_true', help='Also build the flattened wilayah table')
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false', help='Ignore the build cache')
+    parser.add_argument('--no-check', dest='check', action='store_false',
+                        help='Skip the integrity check before loading databases')
+    parser.add_argument('--metrics', metavar='SINKS', default=None, help='Structured metrics sinks')
+    args = parser.parse_args()
+    metrics.configure(args.metrics)
+
+    t0 = time.perf_counter()
+    errors = run(args.targets or ('xlsx', 'sqlite'), use_cache=args.use_cache, stand_in=args.stand_in,
+                 wilayah=args.wilayah, check=args.check)
+    t1 = time.perf_counter()
+    td = round(t1-t0, 4)
+    logger.info('Elapsed time: %s seconds', td)
+    if any(errors.values()):
+        raise SystemExit(1)
@@ -1,80 +1,60 @@
 # -*- coding: utf-8 -*-
 
 import os
-import re
 import time
-from concurrent.futures import ThreadPoolExecutor
+from argparse import ArgumentParser
+from collections import Counter
+from functools import partial
 from glob import glob
-from multiprocessing import cpu_count
-
-from openpyxl import Workbook, load_workbook
-from openpyxl.worksheet.worksheet import Worksheet
-
+from itertools import chain
+from typing import List, Optional, Tuple
+
+import corrections
+import metrics
+import planner
+from cache import BuildCache, code_version, data_digest, rows_digest
+from corrections import Rules
+from kode import is_kode_desa, is_numbered_name, kode_sort_key, normalize_value
+from planner import Shard
+from rows import RowBuffer
 from utils import DATA_DIR as BASE_DATA_DIR
 from utils import OUT_DIR as BASE_OUT_DIR
-from utils import create_logger, log_filename, normalize_value, touch
+from utils import add_executor_arguments, create_logger, log_filename, merge_sorted, read_xlsx, write_rows
 
 DATA_DIR = os.path.join(BASE_DATA_DIR, 'desa')
-OUT_DIR = os.path.join(BASE_OUT_DIR, 'desa')
-
-os.makedirs(OUT_DIR, exist_ok=True)
 
 logger = create_logger(log_filename(__file__))
-patches = {
-    '12.03.04.2064': 'Pangurabaan',
-    '12.14.06.2011': 'Hiliganowo',
-    '12.20.07.2004': 'Pintu Padang',
-    '14.01.02.2030': 'Naumbai',
-    '14.01.07.2030': 'Kuntu Darussalam',
-    '14.02.03.2022': 'Dusun Tua',
-    '14.07.05.2025': 'Bakti Makmur',
-    '14.09.01.2015': 'Pulaubinjai',
-    '14.10.05.2004': 'Bagan Melibur',
-    '72.01.02.2017': 'Laonggo',
-    '72.01.02.2028': 'Nanga-Nangaon',
-    '72.07.06.2021': 'Meselesek',
-}
-excludes = {
-    '13.02.02.1036'
-}
-
-
-def lookup_name(ws: Worksheet, min_row: int, name_ncol: int) -> str:
-    nrow = min_row + 2
-    name = ws.cell(nrow, name_ncol).value
-    if name is None:
-        name = ws.cell(nrow, name_ncol+1).value
-    return name
-
-
-def extract_data(src_path: str):
-    logger.info('Processing %s', src_path)
-    basename, ext = os.path.splitext(os.path.basename(src_path))
-    dest_path = os.path.join(OUT_DIR, '{}-out{}'.format(basename, ext))
-
-    try:
-        touch(dest_path)
-    except Exception as e:
-        logger.error('Could not write output file: %s', dest_path)
-        logger.error('%s', e)
-        return
 
-    wb = load_workbook(src_path, read_only=True)
-    ws = wb.active
+
+def scan_rows(shard: Shard, rules: Rules, engine: str = 'xml') -> Tuple[List[str], List[str], Counter]:
+    # Codes and names are collected separately and only paired per file, so a shard may end
+    # anywhere without splitting a kode from its name
+    src_path = shard.path
+    if shard.min_row > 1 or shard.max_row is not None:
+        logger.info('Processing %s rows %s-%s', src_path, shard.min_row, shard.max_row or 'end')
+    else:
+        logger.info('Processing %s', src_path)
 
     list_kode = []
     list_nama = []
-
-    for row in ws.iter_rows(ws.min_row, ws.max_row, 1, 7, True):
+    # Looked up once per shard, most files have no cell or name rules
+    fname = os.path.basename(src_path)
+    names = rules.names
+    cells = rules.cells_for(src_path)
+    skip_names = rules.skip_names_for(src_path)
+    hits = Counter()
+
+    for row in read_xlsx(src_path, 1, 7, shard.min_row, engine, shard.max_row):
         kode, v2, v3, v4, v5, v6, v7 = row
         if kode is not None:
             kode = str(kode).strip()
             for k in kode.split('\n'):
                 k = k.strip()
-                if re.match(r'^(\d{2}\.){3}\d{4}$', k):
+                if is_kode_desa(k):
                     list_kode.append(k)
-                    if k in patches:
-                        list_nama.append(patches[k])
+                    if k in names:
+                        list_nama.append(names[k])
+                        hits['names', k] += 1
 
         cols_nama = [v6, v7]
         if v6 is None and v7 is None:
@@ -83,92 +63,110 @@ def extract_data(src_path: str):
             if nama is None:
                 continue
             nama = str(nama).strip()
-            if nama.startswith('6 Bambalemo'):
-                list_nama.append('Bambalemo Ranomaisi')
+            if nama in cells:
+                list_nama.append(cells[nama])
+                hits['cells', fname, nama] += 1
                 continue
             for n in nama.split('\n'):
-                if re.match(r'^\d+ .+$', n.strip()):
+                if is_numbered_name(n.strip()):
                     val = normalize_value(n)
-                    if os.path.basename(src_path) == '6.xlsx' and val in ['Ulu', 'Ilir']:
+                    if val in skip_names:
+                        hits['skip_names', fname, val] += 1
                         continue
                     list_nama.append(val)
 
-    wb.close()
+    return list_kode, list_nama, hits
+
+
+def merge_parts(src_path: str, parts: List[Tuple[List[str], List[str], Counter]], rules: Rules) -> RowBuffer:
+    list_kode = list(chain.from_iterable(part[0] for part in parts))
+    list_nama = list(chain.from_iterable(part[1] for part in parts))
+    # Shards may run in worker processes, their hits are only added up here
+    hits = sum((part[2] for part in parts), Counter())
 
     count_kode = len(list_kode)
     count_nama = len(list_nama)
     if count_kode == count_nama:
-        logger.info('Kode: %s. Nama: %s. %s', count_kode, count_nama, dest_path)
+        logger.info('Kode: %s. Nama: %s. %s', count_kode, count_nama, src_path)
     else:
-        logger.warn('Kode: %s. Nama: %s. %s', count_kode, count_nama, dest_path)
+        logger.warn('Kode: %s. Nama: %s. %s', count_kode, count_nama, src_path)
+        metrics.emit('mismatch', 'extract_desa', file=os.path.basename(src_path), kode=count_kode, nama=count_nama)
 
     if count_nama > count_kode:
         list_kode.extend([None for i in range(count_nama-count_kode)])
     elif count_kode > count_nama:
         list_nama.extend([None for i in range(count_kode-count_nama)])
 
-    wb_out = Workbook(write_only=True)
-    ws_out = wb_out.create_sheet(title='DESA-KELURAHAN')
-    ws_out.column_dimensions['A'].width = 14
-    ws_out.column_dimensions['B'].width = 50
+    excludes = rules.excludes
+    hits.update(('excludes', kode) for kode in list_kode if kode in excludes)
+    # Sorted per file so join_files only has to merge
+    rows = RowBuffer(3, sorted((row for row in zip(list_kode, list_nama) if row[0] not in excludes), key=kode_sort_key))
+    rules.hits.update(hits)
+    patched = sum(count for rule, count in hits.items() if rule[0] == 'names')
+    metrics.emit('file', 'extract_desa', file=os.path.basename(src_path), kode=count_kode, nama=count_nama,
+                 patched=patched, excluded=len(list_kode) - len(rows), rows=len(rows))
+    return rows
 
-    for row in zip(list_kode, list_nama):
-        if row[0] in excludes:
-            continue
-        ws_out.append(row)
 
-    try:
-        wb_out.save(dest_path)
-        logger.info('Data succesfully saved to: %s', dest_path)
-    except Exception as e:
-        logger.error('Could not save to: %s', dest_path)
-        logger.error('%s', e)
+def extract_data(src_path: str, engine: str = 'xml', rules: Optional[Rules] = None) -> RowBuffer:
+    rules = rules or Rules('desa')
+    return merge_parts(src_path, [scan_rows(Shard(src_path, 1, None), rules, engine)], rules)
 
 
-def join_files():
+def join_files(results: List[List[Tuple[Optional[str], Optional[str]]]], use_cache: bool = True):
     dest_path = os.path.join(BASE_OUT_DIR, 'desa-out.xlsx')
-    try:
-        touch(dest_path)
-    except Exception as e:
-        logger.error('Could not write output file: %s', dest_path)
-        logger.error('%s', e)
+    title, widths = 'DESA-KELURAHAN', (14, 50)
+    cache = BuildCache('desa', enabled=use_cache)
+    # Rebuilt when the rows, the way they are written or the writer code change
+    key = data_digest(rows_digest(chain.from_iterable(results)), title, widths, code_version(__file__))
+    if cache.is_fresh(dest_path, key):
+        logger.info('Up to date: %s', dest_path)
         return
 
-    wb_out = Workbook(write_only=True)
-    ws_out = wb_out.create_sheet('DESA-KELURAHAN')
-    ws_out.column_dimensions['A'].width = 14
-    ws_out.column_dimensions['B'].width = 50
-
-    fpaths = glob(os.path.join(OUT_DIR, '*.xlsx'))
-    for fpath in fpaths:
-        wb = load_workbook(fpath, read_only=True)
-        ws = wb.active
-        for row in ws.iter_rows(ws.min_row, ws.max_row, 1, 2, True):
+    def iter_rows():
+        for row in merge_sorted(results, logger):
             v1, v2 = row
             if v1 is None or v2 is None:
-                logger.warn('Empty row in %s: %s, %s', fpath, v1, v2)
-            ws_out.append(row)
-        wb.close()
-
-    try:
-        wb_out.save(dest_path)
-        logger.info('Data succesfully saved to: %s', dest_path)
-    except Exception as e:
-        logger.error('Could not save to: %s', dest_path)
-        logger.error('%s', e)
+                logger.warn('Empty row: %s, %s', v1, v2)
+            yield row
+
+    with metrics.stage('join_desa') as stage:
+        stage.rows = sum(len(rows) for rows in results)
+        if write_rows(dest_path, title, iter_rows(), widths, logger):
+            cache.mark(dest_path, key)
+            cache.save()
+
+
+def extract_all(mode: str = 'process', workers: Optional[int] = None, engine: str = 'xml',
+                use_cache: bool = True) -> List[List[Tuple[Optional[str], Optional[str]]]]:
+    fnames = planner.sort_paths(glob(os.path.join(DATA_DIR, '*.xlsx')))
+    # Loaded per run rather than on import, the workers get them along with each shard
+    rules = Rules('desa')
+    salt = data_digest(rules.digest(), code_version(__file__, corrections.__file__))
+    cache = BuildCache('desa', salt, use_cache, logger=logger, rows_type=partial(RowBuffer, 3))
+    runner = partial(planner.map_shards, partial(scan_rows, rules=rules, engine=engine),
+                     partial(merge_parts, rules=rules), mode=mode, workers=workers,
+                     weights=planner.page_weights('desa', fnames))
+    with metrics.stage('extract_desa', mode=mode, engine=engine) as stage:
+        results = cache.map(partial(extract_data, engine=engine, rules=rules), fnames, mode, workers, runner)
+        stage.rows = sum(len(rows) for rows in results)
+        stage.set(files=len(fnames), cache_hits=cache.hits, cache_misses=cache.misses)
+    rules.report(logger, 'extract_desa', complete=cache.hits == 0)
+    return results
+
+
+def main(mode: str = 'process', workers: Optional[int] = None, engine: str = 'xml', use_cache: bool = True):
+    join_files(extract_all(mode, workers, engine, use_cache), use_cache)
 
 
 if __name__ == '__main__':
-    t0 = time.process_time()
-    fnames = glob(os.path.join(DATA_DIR, '*.xlsx'))
-    with ThreadPoolExecutor(max_workers=cpu_count()) as executor:
-        executor.map(extract_data, fnames)
-        try:
-            executor.shutdown(wait=True)
-        except Exception as e:
-            logger.error('%s', e)
-
-    join_files()
-    t1 = time.process_time()
+    parser = ArgumentParser(description='Extract desa/kelurahan data')
+    add_executor_arguments(parser)
+    args = parser.parse_args()
+    metrics.configure(args.metrics)
+
+    t0 = time.perf_counter()
+    main(args.mode, args.workers, args.engine, args.use_cache)
+    t1 = time.perf_counter()
     td = round(t1-t0, 4)
     logger.info('Elapsed time: %s seconds', td)
@@ -1,31 +1,24 @@
 # -*- coding: utf-8 -*-
 
 import os
-import re
 import time
+from typing import Iterable, Tuple
 
-from openpyxl import Workbook, load_workbook
-
-from utils import DATA_DIR, OUT_DIR, create_logger, log_filename, touch
+import metrics
+from corrections import Rules
+from kode import KAB_KOTA_SPLIT, is_kode_kabupaten, kabupaten_split_pattern, split_kabupaten_names
+from rows import RowBuffer
+from utils import DATA_DIR, OUT_DIR, create_logger, log_filename, read_xlsx, write_rows
 
 logger = create_logger(log_filename(__file__))
 
 
-def main():
-    src_path = os.path.join(DATA_DIR, 'kabupaten.xlsx')
-    dest_path = os.path.join(OUT_DIR, 'kabupaten-out.xlsx')
-
+@metrics.timed('extract_kabupaten')
+def extract_data(src_path: str = os.path.join(DATA_DIR, 'kabupaten.xlsx'), engine: str = 'xml') -> RowBuffer:
     logger.info('Processing %s', src_path)
-
-    try:
-        touch(dest_path)
-    except Exception as e:
-        logger.error('Could not write output file: %s', dest_path)
-        logger.error('%s', e)
-        return
-
-    wb = load_workbook(src_path, read_only=True)
-    ws = wb.active
+    # Loaded per run rather than on import
+    rules = Rules('kabupaten')
+    name_split = kabupaten_split_pattern(rules.prefixes) if rules.prefixes else KAB_KOTA_SPLIT
 
     list_kode = []
     list_nama = []
@@ -34,7 +27,7 @@ def main():
 
     nrow = 0
 
-    for row in ws.iter_rows(1, ws.max_row, 2, 3, True):
+    for row in read_xlsx(src_path, 2, 3, engine=engine):
         nrow += 1
         kode, nama = row
         if kode is None:
@@ -42,43 +35,41 @@ def main():
         kode = str(kode).strip()
         if len(kode) < 5:
             kode += '0'
-        if not re.match(r'^\d{2}\.\d{2}$', kode):
+        if not is_kode_kabupaten(kode):
             continue
         list_kode.append(kode)
         dict_kode[nrow] = kode
         if nama is None:
             continue
-        nama = re.sub(r'(\w) (KAB|KAB\.|KOTA) (?!KAB |KAB\. |KOTA )', r'\1\n\2 ', nama.strip())
-        for i, n in enumerate(nama.split('\n')):
-            dict_nama[nrow+i] = re.sub(r'^(KAB) ', r'\1. ', n)
-
-    wb.close()
+        names = split_kabupaten_names(nama, name_split)
+        if len(names) > 1:
+            rules.hits[('prefixes',)] += 1
+        for i, n in enumerate(names):
+            dict_nama[nrow+i] = n
 
     for nrow, nama in dict_nama.items():
         if nrow in dict_kode:
             list_nama.append(nama)
 
     logger.info('Kode: %s. Nama: %s', len(list_kode), len(list_nama))
+    rules.report(logger, 'extract_kabupaten')
+
+    return RowBuffer(1, zip(list_kode, list_nama))
 
-    wb_out = Workbook(write_only=True)
-    ws_out = wb_out.create_sheet(title='KABUPATEN-KOTA')
-    ws_out.column_dimensions['A'].width = 6
-    ws_out.column_dimensions['B'].width = 50
 
-    for row in zip(list_kode, list_nama):
-        ws_out.append(row)
+def save_data(rows: Iterable[Tuple[str, str]]):
+    dest_path = os.path.join(OUT_DIR, 'kabupaten-out.xlsx')
+    write_rows(dest_path, 'KABUPATEN-KOTA', rows, (6, 50), logger)
 
-    try:
-        wb_out.save(dest_path)
-        logger.info('Data succesfully saved to: %s', dest_path)
-    except Exception as e:
-        logger.error('Could not save to: %s', dest_path)
-        logger.error('%s', e)
+
+def main():
+    save_data(extract_data())
 
 
 if __name__ == '__main__':
-    t0 = time.process_time()
+    metrics.configure()
+    t0 = time.perf_counter()
     main()
-    t1 = time.process_time()
+    t1 = time.perf_counter()
     td = round(t1-t0, 4)
     logger.info('Elapsed time: %s seconds', td)
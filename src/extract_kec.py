@@ -1,44 +1,34 @@
 # -*- coding: utf-8 -*-
 
 import os
-import re
 import time
-from concurrent.futures import ThreadPoolExecutor
-from multiprocessing import cpu_count
+from argparse import ArgumentParser
+from functools import partial
 from glob import glob
-from openpyxl import Workbook, load_workbook
-
-from utils import DATA_DIR, OUT_DIR, create_logger, log_filename, normalize_value, touch
+from itertools import chain
+from typing import List, Optional, Tuple
+
+import metrics
+import planner
+from cache import BuildCache, code_version, data_digest, rows_digest
+from kode import is_kode_kecamatan, kode_sort_key, normalize_value
+from planner import Shard
+from rows import RowBuffer
+from utils import (DATA_DIR, OUT_DIR, add_executor_arguments, create_logger, log_filename, merge_sorted, read_xlsx,
+                   write_rows)
 
 logger = create_logger(log_filename(__file__))
 
 
-def get_output_path(src_path: str) -> str:
-    basename, ext = os.path.splitext(os.path.basename(src_path))
-    return os.path.join(OUT_DIR, '{}-out{}'.format(basename, ext))
-
-
-def extract_data(src_path):
-    logger.info('Processing %s', src_path)
-
-    dest_path = get_output_path(src_path)
-
-    try:
-        touch(dest_path)
-    except Exception as e:
-        logger.error('Could not write output file: %s', dest_path)
-        logger.error('%s', e)
-        return
-
-    wb = load_workbook(src_path, read_only=True)
-    ws = wb.active
+def scan_rows(shard: Shard, engine: str = 'xml') -> List[Tuple[str, str]]:
+    if shard.min_row > 1 or shard.max_row is not None:
+        logger.info('Processing %s rows %s-%s', shard.path, shard.min_row, shard.max_row or 'end')
+    else:
+        logger.info('Processing %s', shard.path)
 
-    wb_out = Workbook(write_only=True)
-    ws_out = wb_out.create_sheet(title='KECAMATAN')
-    ws_out.column_dimensions['A'].width = 9
-    ws_out.column_dimensions['B'].width = 50
+    rows = []
 
-    for row in ws.iter_rows(ws.min_row, ws.max_row, 1, 4, True):
+    for row in read_xlsx(shard.path, 1, 4, shard.min_row, engine, shard.max_row):
         v1, v2, v3, v4 = row
         if v1 is None and v2 is None:
             continue
@@ -48,62 +38,65 @@ def extract_data(src_path):
         else:
             kode = str(v1).strip()
             nama = str(v2 or v3).strip()
-        if not re.match(r'^(\d{2}\.){2}\d{2}$', kode):
+        if not is_kode_kecamatan(kode):
             continue
-        ws_out.append([kode, normalize_value(nama)])
+        rows.append((kode, normalize_value(nama)))
 
-    wb.close()
+    return rows
 
-    try:
-        wb_out.save(dest_path)
-        logger.info('Data succesfully saved to: %s', dest_path)
-    except Exception as e:
-        logger.error('Could not save to: %s', dest_path)
-        logger.error('%s', e)
 
+def merge_parts(src_path: str, parts: List[List[Tuple[str, str]]]) -> RowBuffer:
+    rows = RowBuffer(2, sorted(chain.from_iterable(parts), key=kode_sort_key))
+    logger.info('Kode: %s. %s', len(rows), src_path)
+    return rows
+
+
+def extract_data(src_path: str, engine: str = 'xml') -> RowBuffer:
+    return merge_parts(src_path, [scan_rows(Shard(src_path, 1, None), engine)])
 
-def join_files(fpaths):
-    dest_path = os.path.join(OUT_DIR, 'kecamatan-out.xlsx')
 
-    try:
-        touch(dest_path)
-    except Exception as e:
-        logger.error('Could not write output file: %s', dest_path)
-        logger.error('%s', e)
+def join_files(results: List[List[Tuple[str, str]]], use_cache: bool = True):
+    dest_path = os.path.join(OUT_DIR, 'kecamatan-out.xlsx')
+    title, widths = 'KECAMATAN', (9, 50)
+    cache = BuildCache('kecamatan', enabled=use_cache)
+    # Rebuilt when the rows, the way they are written or the writer code change
+    key = data_digest(rows_digest(chain.from_iterable(results)), title, widths, code_version(__file__))
+    if cache.is_fresh(dest_path, key):
+        logger.info('Up to date: %s', dest_path)
         return
 
-    wb_out = Workbook(write_only=True)
-    ws_out = wb_out.create_sheet(title='KECAMATAN')
-    ws_out.column_dimensions['A'].width = 9
-    ws_out.column_dimensions['B'].width = 50
+    with metrics.stage('join_kecamatan') as stage:
+        stage.rows = sum(len(rows) for rows in results)
+        if write_rows(dest_path, title, merge_sorted(results, logger), widths, logger):
+            cache.mark(dest_path, key)
+            cache.save()
+
+
+def extract_all(mode: str = 'process', workers: Optional[int] = None, engine: str = 'xml',
+                use_cache: bool = True) -> List[List[Tuple[str, str]]]:
+    fnames = planner.sort_paths(glob(os.path.join(DATA_DIR, 'kecamatan*.xlsx')))
+    cache = BuildCache('kecamatan', code_version(__file__), use_cache, logger=logger, rows_type=partial(RowBuffer, 2))
+    # The kecamatan page index is per provinsi rather than per file, so shards are sized by row count
+    runner = partial(planner.map_shards, partial(scan_rows, engine=engine), merge_parts, mode=mode, workers=workers)
+    with metrics.stage('extract_kecamatan', mode=mode, engine=engine) as stage:
+        results = cache.map(partial(extract_data, engine=engine), fnames, mode, workers, runner)
+        stage.rows = sum(len(rows) for rows in results)
+        stage.set(files=len(fnames), cache_hits=cache.hits, cache_misses=cache.misses)
+    return results
 
-    for fpath in fpaths:
-        opath = get_output_path(fpath)
-        wb = load_workbook(opath, read_only=True)
-        ws = wb.active
-        for row in ws.iter_rows(values_only=True):
-            ws_out.append(row)
-        wb.close()
 
-    try:
-        wb_out.save(dest_path)
-        logger.info('Data succesfully saved to: %s', dest_path)
-    except Exception as e:
-        logger.error('Could not save to: %s', dest_path)
-        logger.error('%s', e)
+def main(mode: str = 'process', workers: Optional[int] = None, engine: str = 'xml', use_cache: bool = True):
+    join_files(extract_all(mode, workers, engine, use_cache), use_cache)
 
 
 if __name__ == '__main__':
-    t0 = time.process_time()
-    fnames = glob(os.path.join(DATA_DIR, 'kecamatan*.xlsx'))
-    with ThreadPoolExecutor(max_workers=cpu_count()) as executor:
-        executor.map(extract_data, fnames)
-        try:
-            executor.shutdown(wait=True)
-        except Exception as e:
-            logger.error('%s', e)
-
-    join_files(fnames)
-    t1 = time.process_time()
+    parser = ArgumentParser(description='Extract kecamatan data')
+    add_executor_arguments(parser)
+    args = parser.parse_args()
+    metrics.configure(args.metrics)
+
+    t0 = time.perf_counter()
+    main(args.mode, args.workers, args.engine, args.use_cache)
+    t1 = time.perf_counter()
     td = round(t1-t0, 4)
     logger.info('Elapsed time: %s seconds', td)
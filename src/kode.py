@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import re
+from typing import Any, Iterable, List, Pattern, Sequence, Tuple
+
+# Length of a kode string at each level (provinsi, kabupaten/kota, kecamatan, desa/kelurahan)
+# and the position of its separators, e.g. 12.03.04.2064
+KODE_LENGTHS = (2, 5, 8, 13)
+LEVEL_BY_LENGTH = {length: level for level, length in enumerate(KODE_LENGTHS)}
+SEPARATORS = (2, 5, 8)
+DIGIT_COUNTS = (2, 4, 6, 10)
+
+LEADING_NUMBER = re.compile(r'^\d+\s+')
+NUMBERED_NAME = re.compile(r'^\d+ .+$')
+KAB_PREFIX = re.compile(r'^(KAB) ')
+
+
+def is_kode(value: str, level: int) -> bool:
+    # Fixed shape check without going through a regex, most non-kode cells fail on the length
+    if len(value) != KODE_LENGTHS[level]:
+        return False
+    for i in SEPARATORS[:level]:
+        if value[i] != '.':
+            return False
+    digits = value.replace('.', '')
+    return len(digits) == DIGIT_COUNTS[level] and digits.isascii() and digits.isdigit()
+
+
+def kode_level(value: str) -> int:
+    level = LEVEL_BY_LENGTH.get(len(value), -1)
+    if level < 0 or not is_kode(value, level):
+        return -1
+    return level
+
+
+def is_kode_kabupaten(value: str) -> bool:
+    return is_kode(value, 1)
+
+
+def is_kode_kecamatan(value: str) -> bool:
+    return is_kode(value, 2)
+
+
+def is_kode_desa(value: str) -> bool:
+    return is_kode(value, 3)
+
+
+def format_kode(value: Any) -> str:
+    # Accepts a kode with or without separators, e.g. 1203042064 becomes 12.03.04.2064
+    value = str(value).strip()
+    if value.isdigit() and len(value) in DIGIT_COUNTS:
+        return '.'.join(value[start:end] for start, end in zip((0, 2, 4, 6), (2, 4, 6, 10)) if start < len(value))
+    return value
+
+
+def kode_sort_key(row: Sequence) -> Tuple[bool, str]:
+    # Codes of one level have the same width, so string order is numeric order; rows without a kode go last
+    return row[0] is None, row[0] or ''
+
+
+def parent_kode(value: str) -> str:
+    # Same as re.sub(r'\.\d+$', '', value)
+    head, sep, tail = value.rpartition('.')
+    if sep and tail.isdecimal():
+        return head
+    return value
+
+
+def is_numbered_name(value: str) -> bool:
+    return NUMBERED_NAME.match(value) is not None
+
+
+def normalize_value(value: Any) -> str:
+    if value is None:
+        return ''
+    value = str(value).strip()
+    if value[:1].isdigit():
+        value = LEADING_NUMBER.sub('', value)
+    # str.split() splits on the same whitespace as \s and drops the ends, which strip() already did
+    return ' '.join(value.split())
+
+
+def normalize_many(values: Iterable[Any]) -> List[str]:
+    normalize = normalize_value
+    return [normalize(value) for value in values]
+
+
+def kabupaten_split_pattern(prefixes: Sequence[str]) -> Pattern:
+    # Splits before a prefix that follows a word, unless another prefix comes next
+    alternatives = '|'.join(re.escape(prefix) for prefix in prefixes)
+    return re.compile(r'(\w) ({0}) (?!(?:{0}) )'.format(alternatives))
+
+
+KAB_KOTA_SPLIT = kabupaten_split_pattern(('KAB', 'KAB.', 'KOTA'))
+
+
+def split_kabupaten_names(value: str, pattern: Pattern = KAB_KOTA_SPLIT) -> List[str]:
+    # A single cell may hold several names, e.g. "KAB. X KOTA Y", each starting with KAB/KAB./KOTA
+    value = pattern.sub(r'\1\n\2 ', value.strip())
+    return [KAB_PREFIX.sub(r'\1. ', n) for n in value.split('\n')]
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+import time
+from argparse import ArgumentParser, Namespace
+from typing import List, Optional
+
+import metrics
+from utils import EXECUTOR_MODES, XLSX_ENGINES, add_executor_arguments, create_logger, log_filename
+
+DBMS = ('postgres', 'mysql', 'sqlite')
+
+logger = create_logger(log_filename(__file__))
+
+
+# Every stage module is imported inside its subcommand, so e.g. loading SQLite never imports openpyxl
+# or the Postgres and MySQL drivers
+def run_extract_kab(args: Namespace):
+    import extract_kab
+    extract_kab.save_data(extract_kab.extract_data(engine=args.engine))
+
+
+def run_extract_kec(args: Namespace):
+    import extract_kec
+    extract_kec.main(args.mode, args.workers, args.engine, args.use_cache)
+
+
+def run_extract_desa(args: Namespace):
+    import extract_desa
+    extract_desa.main(args.mode, args.workers, args.engine, args.use_cache)
+
+
+def run_combine(args: Namespace):
+    import combine
+    combine.main(use_cache=args.use_cache, write_only=args.write_only, dest_path=args.output, mode=args.mode,
+                 workers=args.workers)
+
+
+def run_load(args: Namespace):
+    import combine
+    import diff
+    import validate
+    dbname = args.dbname or combine.OUTPUT_BASENAME
+    sources = validate.check() if args.check else None
+    changes = None
+    if args.changes:
+        changes = diff.load_changes(args.changes)
+    elif args.delta:
+        # The loaded release is the old side, only what differs from the new data is written
+        conn = combine.connect_db(args.dbms, dbname)
+        try:
+            changes = diff.diff(diff.load_db(conn.cursor()), sources or diff.load_dataset())
+        finally:
+            conn.close()
+    combine.insert_into_db(args.dbms, dbname, sources, args.batch_size or combine.BATCH_SIZE, args.bulk, args.indexes,
+                           args.wilayah, changes, args.mode, args.workers)
+
+
+def run_embed(args: Namespace):
+    import embedded
+    import validate
+    embedded.build(validate.check() if args.check else None, args.output or embedded.EMBEDDED_PATH,
+                   args.page_size or embedded.PAGE_SIZE)
+
+
+def run_diff(args: Namespace):
+    import diff
+    changes = diff.diff(diff.load_dataset(args.old), diff.load_dataset(args.new))
+    diff.save_changes(changes, args.output or diff.CHANGES_PATH, old=args.old, new=args.new or 'current')
+    for table_name, table in changes.items():
+        logger.info('%s: %s', table_name, ', '.join('{} {}'.format(len(table[kind]), kind) for kind in diff.KINDS))
+
+
+def run_dump(args: Namespace):
+    import combine
+    combine.dump_db(args.dbms, args.dbname or combine.OUTPUT_BASENAME)
+
+
+def create_parser() -> ArgumentParser:
+    parser = ArgumentParser(prog='python -m kode_wilayah', description='Kode wilayah Indonesia build steps')
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND', required=True)
+
+    sub = subparsers.add_parser('extract-kab', help='Extract kabupaten/kota data')
+    sub.add_argument('-e', '--engine', choices=XLSX_ENGINES, default='xml',
+                     help='Reader for source workbooks (default: xml)')
+    sub.add_argument('--metrics', metavar='SINKS', default=None, help='Structured metrics sinks')
+    sub.set_defaults(func=run_extract_kab)
+
+    sub = subparsers.add_parser('extract-kec', help='Extract kecamatan data')
+    add_executor_arguments(sub)
+    sub.set_defaults(func=run_extract_kec)
+
+    sub = subparsers.add_parser('extract-desa', help='Extract desa/kelurahan data')
+    add_executor_arguments(sub)
+    sub.set_defaults(func=run_extract_desa)
+
+    sub = subparsers.add_parser('combine', help='Combine the extracted data into one workbook')
+    sub.add_argument('-o', '--output', default=None, help='Workbook path (default: kode_wilayah_indonesia.xlsx)')
+    sub.add_argument('--workbook', dest='write_only', action='store_false',
+                     help='Build through a regular workbook instead of write-only sheets')
+    sub.add_argument('-m', '--mode', choices=EXECUTOR_MODES, default='process',
+                     help='Execution mode for reading the levels (default: process)')
+    sub.add_argument('-w', '--workers', type=int, default=None, help='Number of workers (default: CPU count)')
+    sub.add_argument('--no-cache', dest='use_cache', action='store_false', help='Ignore the build cache')
+    sub.add_argument('--metrics', metavar='SINKS', default=None, help='Structured metrics sinks')
+    sub.set_defaults(func=run_combine)
+
+    sub = subparsers.add_parser('load', help='Load the extracted data into a database')
+    sub.add_argument('dbms', choices=DBMS)
+    sub.add_argument('-d', '--dbname', default=None, help='Database name (default: kode_wilayah_indonesia)')
+    sub.add_argument('-b', '--batch-size', type=int, default=None, help='Rows per insert batch (default: 5000)')
+    sub.add_argument('--no-bulk', dest='bulk', action='store_false', help='Row by row inserts instead of COPY')
+    sub.add_argument('--no-indexes', dest='indexes', action='store_false', help='Skip the secondary indexes')
+    sub.add_argument('--wilayah', action='store_true', help='Also build the flattened wilayah table')
+    sub.add_argument('--no-check', dest='check', action='store_false',
+                     help='Skip the integrity check before loading')
+    sub.add_argument('--delta', action='store_true',
+                     help='Upsert only what differs from the data already in the database')
+    sub.add_argument('--changes', metavar='PATH', default=None, help='Apply a changelog written by the diff command')
+    sub.add_argument('-m', '--mode', choices=EXECUTOR_MODES, default='serial',
+                     help='Execution mode for loading the levels, postgres and mysql only. Anything but serial '
+                          'commits each level on its own, a failed level leaves the tables partly loaded '
+                          '(default: serial)')
+    sub.add_argument('-w', '--workers', type=int, default=None, help='Number of workers (default: one per level)')
+    sub.add_argument('--metrics', metavar='SINKS', default=None, help='Structured metrics sinks')
+    sub.set_defaults(func=run_load)
+
+    sub = subparsers.add_parser('embed', help='Build the read-only SQLite database apps embed')
+    sub.add_argument('-o', '--output', default=None,
+                     help='Database path (default: kode_wilayah_indonesia.sqlite)')
+    sub.add_argument('--page-size', type=int, default=None, help='SQLite page size (default: 4096)')
+    sub.add_argument('--no-check', dest='check', action='store_false', help='Skip the integrity check')
+    sub.add_argument('--metrics', metavar='SINKS', default=None, help='Structured metrics sinks')
+    sub.set_defaults(func=run_embed)
+
+    sub = subparsers.add_parser('diff', help='Compare two releases by kode')
+    sub.add_argument('old', help='Previous release, a combined .xlsx or a SQLite .db')
+    sub.add_argument('new', nargs='?', default=None, help='New release (default: the current extraction outputs)')
+    sub.add_argument('-o', '--output', default=None, help='Changelog JSON path (default: output/changes.json)')
+    sub.set_defaults(func=run_diff, metrics=None)
+
+    sub = subparsers.add_parser('dump', help='Dump a loaded database with pg_dump or mysqldump')
+    sub.add_argument('dbms', choices=DBMS[:2])
+    sub.add_argument('-d', '--dbname', default=None, help='Database name (default: kode_wilayah_indonesia)')
+    sub.set_defaults(func=run_dump, metrics=None)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None):
+    args = create_parser().parse_args(argv)
+    metrics.configure(args.metrics)
+
+    t0 = time.perf_counter()
+    args.func(args)
+    t1 = time.perf_counter()
+    td = round(t1-t0, 4)
+    logger.info('Elapsed time: %s seconds', td)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import snapshot
+from kode import kode_level
+from snapshot import SNAPSHOT_PATH
+
+LEVELS = ('provinsi', 'kabupaten_kota', 'kecamatan', 'desa_kelurahan')
+# Width of each dot separated segment of a kode, e.g. 12.03.04.2064
+SEGMENT_WIDTHS = (2, 2, 2, 4)
+CODE_WIDTH = sum(SEGMENT_WIDTHS)
+SEGMENT_SLICES = tuple((sum(SEGMENT_WIDTHS[:i]), width) for i, width in enumerate(SEGMENT_WIDTHS))
+
+# A library logger, the host application decides where its records go
+logger = logging.getLogger(__name__)
+
+
+def encode_kode(kode: str) -> Tuple[int, int]:
+    # Returns (level, code) where code is the kode digits right padded with zeros to CODE_WIDTH
+    kode = str(kode).strip()
+    level = kode_level(kode)
+    if level < 0:
+        raise ValueError('Invalid kode: {}'.format(kode))
+    digits = kode.replace('.', '')
+    return level, int(digits) * 10 ** (CODE_WIDTH - len(digits))
+
+
+def decode_kode(level: int, code: int) -> str:
+    digits = '{:0{}d}'.format(code, CODE_WIDTH)
+    return '.'.join(digits[start:start+width] for start, width in SEGMENT_SLICES[:level+1])
+
+
+def _child_range(level: int, code: int) -> Tuple[int, int]:
+    # All descendants of a kode share its leading digits
+    span = 10 ** (CODE_WIDTH - sum(SEGMENT_WIDTHS[:level+1]))
+    return code, code + span
+
+
+class RegionIndex:
+    def __init__(self, codes: List[Sequence[int]], offsets: List[Sequence[int]], names: List[bytes],
+                 source: Optional[snapshot.Snapshot] = None):
+        self.codes = codes
+        self.offsets = offsets
+        self.names = names
+        # Keeps the mmap of a loaded snapshot open for as long as the index is used
+        self.source = source
+
+    @classmethod
+    def from_rows(cls, sources: Dict[str, Iterable[Sequence]]) -> 'RegionIndex':
+        codes, offsets, names = [], [], []
+        for level, table_name in enumerate(LEVELS):
+            items = {}
+            for row in sources.get(table_name, ()):
+                kode, nama = row[0], row[1]
+                if kode is None or nama is None:
+                    continue
+                row_level, code = encode_kode(kode)
+                if row_level == level:
+                    items.setdefault(code, str(nama))
+            level_codes = array('Q', sorted(items))
+            level_offsets = array('I', [0])
+            blob = []
+            for code in level_codes:
+                blob.append(items[code].encode('utf-8'))
+                level_offsets.append(level_offsets[-1] + len(blob[-1]))
+            codes.append(level_codes)
+            offsets.append(level_offsets)
+            names.append(b''.join(blob))
+        return cls(codes, offsets, names)
+
+    @classmethod
+    def load(cls, path: str = SNAPSHOT_PATH, verify: bool = True) -> 'RegionIndex':
+        source = snapshot.read(path, verify)
+        codes, offsets, names = zip(*source.levels)
+        return cls(list(codes), list(offsets), list(names), source)
+
+    def save(self, path: str = SNAPSHOT_PATH):
+        snapshot.write(path, list(zip(self.codes, self.offsets, self.names)))
+
+    def close(self):
+        if self.source is not None:
+            self.codes, self.offsets, self.names = [], [], []
+            self.source.close()
+            self.source = None
+
+    def __len__(self) -> int:
+        return sum(len(level_codes) for level_codes in self.codes)
+
+    def _find(self, kode: str) -> Tuple[int, int]:
+        # Returns (level, position) or (-1, -1) when the kode does not exist
+        try:
+            level, code = encode_kode(kode)
+        except ValueError:
+            return -1, -1
+        level_codes = self.codes[level]
+        pos = bisect_left(level_codes, code)
+        if pos < len(level_codes) and level_codes[pos] == code:
+            return level, pos
+        return -1, -1
+
+    def _name(self, level: int, pos: int) -> str:
+        offsets = self.offsets[level]
+        return str(self.names[level][offsets[pos]:offsets[pos+1]], 'utf-8')
+
+    def items(self, level: int) -> Iterator[Tuple[str, str]]:
+        for pos, code in enumerate(self.codes[level]):
+            yield decode_kode(level, code), self._name(level, pos)
+
+    def is_valid(self, kode: str) -> bool:
+        return self._find(kode)[0] >= 0
+
+    def get(self, kode: str, default: Optional[str] = None) -> Optional[str]:
+        level, pos = self._find(kode)
+        if level < 0:
+            return default
+        return self._name(level, pos)
+
+    def parent(self, kode: str) -> Optional[str]:
+        level, pos = self._find(kode)
+        if level <= 0:
+            return None
+        parent_kode = str(kode).strip().rsplit('.', 1)[0]
+        return parent_kode if self.is_valid(parent_kode) else None
+
+    def children(self, kode: str) -> List[Tuple[str, str]]:
+        level, pos = self._find(kode)
+        if level < 0 or level + 1 >= len(LEVELS):
+            return []
+        start, stop = _child_range(level, self.codes[level][pos])
+        child_codes = self.codes[level+1]
+        lo = bisect_left(child_codes, start)
+        hi = bisect_left(child_codes, stop, lo)
+        return [(decode_kode(level+1, child_codes[i]), self._name(level+1, i)) for i in range(lo, hi)]
+
+
+_index = None
+
+
+def get_index(path: str = SNAPSHOT_PATH) -> RegionIndex:
+    global _index
+    if _index is None:
+        _index = RegionIndex.load(path)
+    return _index
+
+
+def get(kode: str, default: Optional[str] = None) -> Optional[str]:
+    return get_index().get(kode, default)
+
+
+def parent(kode: str) -> Optional[str]:
+    return get_index().parent(kode)
+
+
+def children(kode: str) -> List[Tuple[str, str]]:
+    return get_index().children(kode)
+
+
+def is_valid(kode: str) -> bool:
+    return get_index().is_valid(kode)
+
+
+def build_index(sources: Optional[Dict[str, Iterable[Sequence]]] = None, dest_path: str = SNAPSHOT_PATH) -> RegionIndex:
+    # combine pulls in openpyxl and the database drivers, only needed when building
+    from combine import iter_source
+
+    index = RegionIndex.from_rows({level: iter_source(level, sources) for level in LEVELS})
+    index.save(dest_path)
+    return index
+
+
+if __name__ == '__main__':
+    from utils import create_logger, log_filename
+
+    logger = create_logger(log_filename(__file__))
+    t0 = time.perf_counter()
+    index = build_index()
+    t1 = time.perf_counter()
+    logger.info('Indexed %s codes into %s in %s seconds', len(index), SNAPSHOT_PATH, round(t1-t0, 4))
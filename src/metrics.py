@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Sequence as SequenceABC
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, List, Optional, TextIO
+
+# Comma separated sink specs: "stdout", "stderr", "file:<path>" or "udp://<host>:<port>".
+# Kept in the environment so worker processes started with spawn pick up the same sinks, see init_worker.
+# Nothing is configured on import, the command line entry points call configure.
+METRICS_ENV = 'KODE_WILAYAH_METRICS'
+
+
+class Sink(ABC):
+    @abstractmethod
+    def emit(self, event: Dict[str, Any]):
+        pass
+
+    def close(self):
+        pass
+
+
+class StreamSink(Sink):
+    def __init__(self, stream: TextIO):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def emit(self, event: Dict[str, Any]):
+        line = json.dumps(event, separators=(',', ':'), default=str)
+        with self.lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+
+class FileSink(StreamSink):
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Line buffered append, so events from worker processes interleave by whole lines
+        super().__init__(open(path, 'a', buffering=1, encoding='utf-8'))
+
+    def close(self):
+        self.stream.close()
+
+
+class UDPSink(Sink):
+    # StatsD line protocol: stage timings as "|ms", everything numeric else as "|c"
+    def __init__(self, host: str, port: int, prefix: str = 'kode_wilayah'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def emit(self, event: Dict[str, Any]):
+        name = '.'.join(str(part) for part in (self.prefix, event['event'], event.get('name')) if part)
+        lines = []
+        for key, value in event.items():
+            if key in ('ts', 'pid') or isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            if key.endswith('_s'):
+                lines.append('{}.{}:{}|ms'.format(name, key[:-2], round(value * 1000, 3)))
+            else:
+                lines.append('{}.{}:{}|c'.format(name, key, value))
+        if lines:
+            try:
+                self.sock.sendto('\n'.join(lines).encode('utf-8'), self.address)
+            except OSError:
+                pass
+
+    def close(self):
+        self.sock.close()
+
+
+_sinks: List[Sink] = []
+
+
+def parse_sink(spec: str) -> Sink:
+    if spec == 'stdout':
+        return StreamSink(sys.stdout)
+    if spec == 'stderr':
+        return StreamSink(sys.stderr)
+    if spec.startswith('file:'):
+        return FileSink(spec[5:])
+    if spec.startswith('udp://'):
+        host, _, port = spec[6:].rpartition(':')
+        return UDPSink(host or '127.0.0.1', int(port))
+    raise ValueError('Invalid metrics sink: {}'.format(spec))
+
+
+def configure(spec: Optional[str] = None):
+    close()
+    spec = spec if spec is not None else os.environ.get(METRICS_ENV, '')
+    for item in spec.split(','):
+        if item.strip():
+            _sinks.append(parse_sink(item.strip()))
+    if spec:
+        os.environ[METRICS_ENV] = spec
+
+
+def init_worker():
+    # Forked workers inherit the sinks, spawned ones import this module afresh and read them from the environment
+    if not _sinks and os.environ.get(METRICS_ENV):
+        configure()
+
+
+def close():
+    while _sinks:
+        _sinks.pop().close()
+
+
+def emit(event: str, name: Optional[str] = None, **fields: Any):
+    if not _sinks:
+        return
+    record = {'ts': round(time.time(), 6), 'pid': os.getpid(), 'event': event}
+    if name is not None:
+        record['name'] = name
+    record.update(fields)
+    for sink in _sinks:
+        sink.emit(record)
+
+
+class Stage:
+    def __init__(self, name: str, fields: Dict[str, Any]):
+        self.name = name
+        self.fields = fields
+        self.rows = None
+
+    def set(self, **fields: Any):
+        self.fields.update(fields)
+
+
+@contextmanager
+def stage(name: str, **fields: Any) -> Iterator[Stage]:
+    # Timings are always cheap to take, the event is only built when a sink is configured
+    current = Stage(name, fields)
+    t0 = time.perf_counter()
+    c0 = time.process_time()
+    status = 'ok'
+    try:
+        yield current
+    except BaseException:
+        status = 'error'
+        raise
+    finally:
+        if _sinks:
+            wall = time.perf_counter() - t0
+            record = {'wall_s': round(wall, 6), 'cpu_s': round(time.process_time() - c0, 6), 'status': status}
+            if current.rows is not None:
+                record['rows'] = current.rows
+                record['rows_per_s'] = round(current.rows / wall, 1) if wall else None
+            record.update(current.fields)
+            emit('stage', name, **record)
+
+
+def timed(name: Optional[str] = None) -> Callable:
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name or func.__name__) as current:
+                result = func(*args, **kwargs)
+                if isinstance(result, SequenceABC) and not isinstance(result, str):
+                    current.rows = len(result)
+                return result
+        return wrapper
+    return decorator
+
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+from argparse import ArgumentParser
+from typing import Dict, Optional, Sequence
+
+import export
+import extract_desa
+import extract_kab
+import extract_kec
+import metrics
+from rows import RowBuffer
+from utils import DATA_DIR, add_executor_arguments, create_logger, log_filename, merge_sorted, read_xlsx
+
+logger = create_logger(log_filename(__file__))
+
+
+def extract(mode: str = 'process', workers: Optional[int] = None, engine: str = 'xml',
+            use_cache: bool = True) -> Dict[str, Sequence[Sequence]]:
+    # Columnar buffers instead of lists of tuples, the desa level alone is 80k+ rows
+    kecamatan = extract_kec.extract_all(mode, workers, engine, use_cache)
+    desa = extract_desa.extract_all(mode, workers, engine, use_cache)
+    return {
+        'provinsi': RowBuffer(0, read_xlsx(os.path.join(DATA_DIR, 'provinsi.xlsx'), engine=engine)),
+        'kabupaten_kota': extract_kab.extract_data(engine=engine),
+        'kecamatan': RowBuffer(2, merge_sorted(kecamatan, logger)),
+        'desa_kelurahan': RowBuffer(3, merge_sorted(desa, logger)),
+    }
+
+
+def run(targets: Sequence[str] = ('xlsx',), mode: str = 'process', workers: Optional[int] = None, engine: str = 'xml',
+        use_cache: bool = True, debug: bool = False, stand_in: bool = False) -> Dict[str, Optional[BaseException]]:
+    with metrics.stage('extract', mode=mode, engine=engine) as stage:
+        sources = extract(mode, workers, engine, use_cache)
+        stage.rows = sum(len(rows) for rows in sources.values())
+
+    # Intermediate files are only needed for inspecting a single stage
+    if debug:
+        extract_kab.save_data(sources['kabupaten_kota'])
+        extract_kec.join_files([sources['kecamatan']], use_cache)
+        extract_desa.join_files([sources['desa_kelurahan']], use_cache)
+
+    # Every target is fed from the same in-memory rows by its own worker
+    return export.run(targets, sources, use_cache, stand_in)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Extract and combine all data without intermediate files')
+    parser.add_argument('-t', '--target', dest='targets', action='append', choices=export.TARGETS,
+                        help='Output target, may be repeated (default: xlsx)')
+    parser.add_argument('-d', '--debug', action='store_true', help='Also write intermediate *-out.xlsx files')
+    parser.add_argument('--stand-in', action='store_true',
+                        help='Load postgres and mysql targets into local SQLite stand-ins under output/')
+    add_executor_arguments(parser)
+    args = parser.parse_args()
+    metrics.configure(args.metrics)
+
+    t0 = time.perf_counter()
+    errors = run(args.targets or ('xlsx',), args.mode, args.workers, args.engine, args.use_cache, args.debug,
+                 args.stand_in)
+    t1 = time.perf_counter()
+    td = round(t1-t0, 4)
+    logger.info('Elapsed time: %s seconds', td)
+    if any(errors.values()):
+        raise SystemExit(1)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+from itertools import groupby
+from multiprocessing import cpu_count
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from utils import BASE_DIR, map_tasks, sheet_max_row
+
+INDEX_DIR = os.path.join(BASE_DIR, 'src')
+NUMBER = re.compile(r'(\d+)')
+
+
+class Shard(NamedTuple):
+    path: str
+    min_row: int
+    max_row: Optional[int]
+    cost: float = 0
+
+
+def natural_key(fpath: str) -> tuple:
+    # data/desa/2.xlsx sorts before data/desa/10.xlsx
+    return tuple(int(part) if part.isdigit() else part for part in NUMBER.split(os.path.basename(fpath)))
+
+
+def sort_paths(fpaths: Sequence[str]) -> List[str]:
+    return sorted(fpaths, key=natural_key)
+
+
+def read_page_index(fpath: str) -> List[int]:
+    # One line per provinsi, "8-274" or a single page such as "600"
+    pages = []
+    with open(fpath, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                start, _, end = line.partition('-')
+                pages.append(int(end or start) - int(start) + 1)
+    return pages
+
+
+def page_weights(level: str, fpaths: Sequence[str]) -> Dict[str, int]:
+    # Line N of index-halaman-<level>.txt holds the pages of data/<level>/N.xlsx
+    index_path = os.path.join(INDEX_DIR, 'index-halaman-{}.txt'.format(level))
+    if not os.path.exists(index_path):
+        return {}
+    pages = read_page_index(index_path)
+    weights = {}
+    for fpath in fpaths:
+        number = os.path.splitext(os.path.basename(fpath))[0]
+        if number.isdigit() and 0 < int(number) <= len(pages):
+            weights[fpath] = pages[int(number) - 1]
+    return weights
+
+
+def plan(fpaths: Sequence[str], weights: Optional[Dict[str, int]] = None) -> List[Shard]:
+    # One shard per file. A row range cannot seek into the sheet XML, so every shard of a split file
+    # would parse the shared strings and all the rows before its own again.
+    fpaths = sort_paths(fpaths)
+    # Page counts when known, otherwise the row count from the sheet dimension, as the cost of a file
+    weights = weights or {}
+    return [Shard(fpath, 1, None, weights.get(fpath) or sheet_max_row(fpath) or 1) for fpath in fpaths]
+
+
+def map_shards(scan: Callable[[Shard], object], merge: Callable[[str, list], object], fpaths: Sequence[str],
+               mode: str = 'process', workers: Optional[int] = None,
+               weights: Optional[Dict[str, int]] = None) -> list:
+    # Shards run in parallel, their results are merged per file in row order and returned in file order
+    workers = workers or cpu_count()
+    shards = plan(fpaths, weights)
+    # Longest first: each worker takes the next largest file when it is free, so a big file is not the
+    # last task left running while the other workers idle
+    order = sorted(range(len(shards)), key=lambda i: -shards[i].cost)
+    parts = [None] * len(shards)
+    for i, part in zip(order, map_tasks(scan, [shards[i] for i in order], mode, workers)):
+        parts[i] = part
+    merged = {fpath: merge(fpath, [part for _, part in group])
+              for fpath, group in groupby(zip(shards, parts), key=lambda item: item[0].path)}
+    return [merged[fpath] for fpath in fpaths]
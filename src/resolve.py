@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import io
+import sys
+import time
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import cpu_count
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
+
+from kode import format_kode
+from lookup import LEVELS, RegionIndex
+from snapshot import SNAPSHOT_PATH
+from utils import create_logger, log_filename, open_log_files
+
+CHUNK_SIZE = 20000
+EMPTY = (None,) * len(LEVELS)
+
+logger = create_logger(log_filename(__file__))
+
+_hierarchy: Optional[Dict[str, Tuple[Optional[str], ...]]] = None
+
+
+def build_hierarchy(index: RegionIndex) -> Dict[str, Tuple[Optional[str], ...]]:
+    # kode -> (provinsi, kabupaten_kota, kecamatan, desa_kelurahan) names, so a record needs one dict
+    # lookup instead of walking desa -> kecamatan -> kabupaten -> provinsi
+    hierarchy = {}
+    for level in range(len(LEVELS)):
+        for kode, nama in index.items(level):
+            parent = hierarchy.get(kode.rpartition('.')[0], EMPTY) if level else EMPTY
+            hierarchy[kode] = parent[:level] + (nama,) + EMPTY[level+1:]
+    return hierarchy
+
+
+def get_hierarchy(path: str = SNAPSHOT_PATH) -> Dict[str, Tuple[Optional[str], ...]]:
+    global _hierarchy
+    if _hierarchy is None:
+        index = RegionIndex.load(path)
+        _hierarchy = build_hierarchy(index)
+        index.close()
+    return _hierarchy
+
+
+def resolve_codes(codes: List[str]) -> Dict[str, Tuple[Optional[str], ...]]:
+    hierarchy = get_hierarchy()
+    return {kode: hierarchy.get(format_kode(kode), EMPTY) for kode in set(codes)}
+
+
+def resolve_chunk(args: Tuple[List[str], int, str, int]) -> Tuple[str, int, int]:
+    # Takes raw CSV records and returns them as CSV text with the names appended,
+    # plus the number of records and of unresolved codes
+    lines, column, delimiter, width = args
+    rows = list(csv.reader(lines, delimiter=delimiter))
+    # Every distinct kode of the chunk is resolved once
+    names = resolve_codes([row[column] if len(row) > column else '' for row in rows])
+    buf = io.StringIO()
+    writer = csv.writer(buf, delimiter=delimiter, lineterminator='\n')
+    missing = 0
+    for row in rows:
+        resolved = names[row[column] if len(row) > column else '']
+        if resolved is EMPTY:
+            missing += 1
+        # Rows shorter than the header are padded, so the names always land under their own headers
+        padding = [''] * (width - len(row))
+        writer.writerow(row + padding + ['' if nama is None else nama for nama in resolved])
+    return buf.getvalue(), len(rows), missing
+
+
+def iter_records(f: TextIO) -> Iterator[str]:
+    # Joins physical lines until the quotes balance, so quoted fields may contain newlines
+    pending = ''
+    for line in f:
+        pending += line
+        if pending.count('"') % 2 == 0:
+            yield pending
+            pending = ''
+    if pending:
+        yield pending
+
+
+def iter_chunks(records: Iterator[str], size: int) -> Iterator[List[str]]:
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def resolve_csv(src: TextIO, dest: TextIO, column: str = 'kode_desa', delimiter: str = ',',
+                chunk_size: int = CHUNK_SIZE, workers: Optional[int] = 1) -> Tuple[int, int]:
+    records = iter_records(src)
+    header_line = next(records, None)
+    if header_line is None:
+        return 0, 0
+    header = next(csv.reader([header_line], delimiter=delimiter))
+    if column not in header:
+        raise ValueError('Column {} not found in header: {}'.format(column, ', '.join(header)))
+    csv.writer(dest, delimiter=delimiter, lineterminator='\n').writerow(header + list(LEVELS))
+    tasks = ((chunk, header.index(column), delimiter, len(header)) for chunk in iter_chunks(records, chunk_size))
+
+    count = missing = 0
+    workers = workers or cpu_count()
+    if workers == 1:
+        for text, rows, unresolved in map(resolve_chunk, tasks):
+            dest.write(text)
+            count += rows
+            missing += unresolved
+        return count, missing
+
+    # At most two chunks per worker are in flight, so large files are never read ahead into memory
+    open_log_files()
+    with ProcessPoolExecutor(max_workers=workers, initializer=get_hierarchy) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(resolve_chunk, task))
+            if len(pending) >= workers * 2:
+                text, rows, unresolved = pending.popleft().result()
+                dest.write(text)
+                count += rows
+                missing += unresolved
+        while pending:
+            text, rows, unresolved = pending.popleft().result()
+            dest.write(text)
+            count += rows
+            missing += unresolved
+    return count, missing
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Append provinsi, kabupaten/kota, kecamatan and desa names to a CSV file')
+    parser.add_argument('src', nargs='?', default='-', help='Input CSV (default: stdin)')
+    parser.add_argument('-o', '--output', default='-', help='Output CSV (default: stdout)')
+    parser.add_argument('-c', '--column', default='kode_desa', help='Column holding the kode (default: kode_desa)')
+    parser.add_argument('-d', '--delimiter', default=',')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Records per chunk')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Worker processes, 0 for one per CPU')
+    args = parser.parse_args()
+
+    src = sys.stdin if args.src == '-' else open(args.src, 'r', encoding='utf-8', newline='')
+    dest = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8', newline='')
+    t0 = time.perf_counter()
+    try:
+        count, missing = resolve_csv(src, dest, args.column, args.delimiter, args.chunk_size, args.workers or None)
+    finally:
+        if src is not sys.stdin:
+            src.close()
+        if dest is not sys.stdout:
+            dest.close()
+    td = time.perf_counter() - t0
+    logger.info('Resolved %s rows (%s unknown kode) in %s seconds, %s rows/s',
+                count, missing, round(td, 4), round(count / td) if td else count)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+from array import array
+from collections.abc import Sequence as SequenceABC
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from kode import DIGIT_COUNTS, is_kode
+
+# Stands for a kode that is kept as is in RowBuffer.other (None, an int or a malformed string)
+RAW = (1 << 64) - 1
+SEGMENT_SLICES = ((0, 2), (2, 4), (4, 6), (6, 10))
+
+
+class RowBuffer(SequenceABC):
+    # Columnar (kode, nama) rows of one level: codes as integers in an array, names interned once
+    # per buffer and referenced by index. Iterating yields the same tuples that were appended.
+    __slots__ = ('level', 'codes', 'name_ids', 'names', 'name_index', 'other')
+
+    def __init__(self, level: int, rows: Iterable[Sequence] = ()):
+        self.level = level
+        self.codes = array('Q')
+        self.name_ids = array('I')
+        # Name id 0 is None
+        self.names: List[Optional[str]] = [None]
+        self.name_index: Dict[Optional[str], int] = {None: 0}
+        self.other: Dict[int, Any] = {}
+        self.extend(rows)
+
+    def append(self, row: Sequence):
+        kode, nama = row[0], row[1]
+        if isinstance(kode, str) and is_kode(kode, self.level):
+            self.codes.append(int(kode.replace('.', '')))
+        else:
+            self.other[len(self.codes)] = kode
+            self.codes.append(RAW)
+        name_id = self.name_index.get(nama)
+        if name_id is None:
+            name_id = self.name_index[nama] = len(self.names)
+            self.names.append(nama)
+        self.name_ids.append(name_id)
+
+    def extend(self, rows: Iterable[Sequence]):
+        for row in rows:
+            self.append(row)
+
+    def kode(self, i: int) -> Any:
+        code = self.codes[i]
+        if code == RAW:
+            return self.other[i]
+        digits = '{:0{}d}'.format(code, DIGIT_COUNTS[self.level])
+        return '.'.join(digits[start:end] for start, end in SEGMENT_SLICES[:self.level+1])
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[Tuple[Any, Optional[str]], 'RowBuffer']:
+        # A slice is a new buffer of the same level, like a list slice is a new list
+        if isinstance(i, slice):
+            return RowBuffer(self.level, (self[j] for j in range(*i.indices(len(self.codes)))))
+        if i < 0:
+            i += len(self.codes)
+        if not 0 <= i < len(self.codes):
+            raise IndexError('RowBuffer index out of range')
+        return self.kode(i), self.names[self.name_ids[i]]
+
+    def __iter__(self) -> Iterator[Tuple[Any, Optional[str]]]:
+        names = self.names
+        for i, name_id in enumerate(self.name_ids):
+            yield self.kode(i), names[name_id]
+
+    def __eq__(self, other) -> bool:
+        return list(self) == list(other)
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+import re
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from heapq import nlargest, nsmallest
+from typing import Any, Dict, List, Optional, Tuple
+
+from lookup import LEVELS, RegionIndex
+
+# Kabupaten/kota names are stored as "KAB. X" or "KOTA X" (see kode.split_kabupaten_names), users also
+# type "kab x", "kabupaten x" or leave the prefix out entirely
+KAB_KOTA_PREFIX = re.compile(r'^(kabupaten|kab\.?|kota)\s+')
+APOSTROPHES = re.compile(r"['`’]")
+NON_WORD = re.compile(r'[^0-9a-z]+')
+KINDS = {'kabupaten': 'kab', 'kab': 'kab', 'kab.': 'kab', 'kota': 'kota'}
+
+GRAM = 3
+# A prefix like "s" matches thousands of names, only the first ones in key order are ranked
+MAX_PREFIX_SCAN = 200
+# Sorts after every normalized key that starts with a given prefix
+PREFIX_END = '\uffff'
+POSTING_BUDGET = 2000
+# Candidates scored per fuzzy query, those sharing the most of the selected grams first
+MAX_CANDIDATES = 200
+MIN_SIMILARITY = 0.4
+
+
+def normalize_name(value: str, kab_kota: bool = True) -> Tuple[Optional[str], str]:
+    # Returns (kind, key) where kind is 'kab', 'kota' or None. The KAB/KOTA prefix is only a kind for queries
+    # and kabupaten/kota names, a village called "Kota Baru" keeps it in its key.
+    value = ' '.join(str(value).casefold().split())
+    kind = None
+    match = KAB_KOTA_PREFIX.match(value) if kab_kota else None
+    if match:
+        kind = KINDS[match.group(1)]
+        value = value[match.end():]
+    value = NON_WORD.sub(' ', APOSTROPHES.sub('', value)).strip()
+    return kind, value
+
+
+def grams(key: str) -> set:
+    padded = ' {} '.format(key)
+    return {padded[i:i+GRAM] for i in range(len(padded) - GRAM + 1)}
+
+
+class SearchIndex:
+    def __init__(self, index: RegionIndex):
+        self.index = index
+        self.kodes: List[str] = []
+        self.names: List[str] = []
+        self.keys: List[str] = []
+        self.kinds: List[Optional[str]] = []
+        self.levels = array('B')
+
+        for level in range(len(LEVELS)):
+            for kode, nama in index.items(level):
+                kind, key = normalize_name(nama, level == LEVELS.index('kabupaten_kota'))
+                self.kodes.append(kode)
+                self.names.append(nama)
+                self.keys.append(key)
+                self.kinds.append(kind)
+                self.levels.append(level)
+
+        # Sorted (suffix, id) pairs starting at every word of the key, so "serdang" finds "deli serdang"
+        pairs = []
+        for i, key in enumerate(self.keys):
+            start = 0
+            while start >= 0:
+                pairs.append((key[start:], i))
+                start = key.find(' ', start)
+                if start >= 0:
+                    start += 1
+        pairs.sort()
+        self.prefix_keys = [pair[0] for pair in pairs]
+        self.prefix_ids = array('I', [pair[1] for pair in pairs])
+
+        self.positions = {kode: i for i, kode in enumerate(self.kodes)}
+
+        postings = defaultdict(list)
+        # Gram count of each key, the fuzzy match needs it for every candidate
+        self.gram_counts = array('H')
+        for i, key in enumerate(self.keys):
+            key_grams = grams(key)
+            self.gram_counts.append(len(key_grams))
+            for gram in key_grams:
+                postings[gram].append(i)
+        self.postings: Dict[str, array] = {gram: array('I', ids) for gram, ids in postings.items()}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _prefix_matches(self, key: str, scores: Dict[int, float]) -> bool:
+        exact = False
+        lo = bisect_left(self.prefix_keys, key)
+        hi = min(bisect_left(self.prefix_keys, key + PREFIX_END, lo), lo + MAX_PREFIX_SCAN)
+        for pos in range(lo, hi):
+            i = self.prefix_ids[pos]
+            name_key = self.keys[i]
+            if name_key == key:
+                score = 3.0
+                exact = True
+            elif name_key.startswith(key):
+                score = 2.0
+            else:
+                score = 1.5
+            # Closer in length to the query ranks higher among equal kinds of match
+            score += len(key) / len(name_key) * 0.5
+            if score > scores.get(i, 0):
+                scores[i] = score
+        return exact
+
+    def _fuzzy_matches(self, key: str, scores: Dict[int, float]):
+        query_grams = grams(key)
+        # Only the rarest grams select candidates, up to a fixed number of posting entries. Common grams
+        # ("an ", "ng ") would pull in half the dataset and carry little signal anyway
+        lists, total = [], 0
+        for ids in sorted((self.postings.get(gram, ()) for gram in query_grams), key=len):
+            if total + len(ids) > POSTING_BUDGET and len(lists) >= 2:
+                break
+            lists.append(ids)
+            total += len(ids)
+        counts = Counter()
+        for ids in lists:
+            counts.update(ids)
+        needed = min(len(lists), max(2, (len(lists) + 1) // 2))
+        # Grams whose postings were skipped may still be shared, at most this many on top of the counted ones
+        skipped = len(query_grams) - len(lists)
+        candidates = [(count, i) for i, count in counts.items() if count >= needed]
+        if len(candidates) > MAX_CANDIDATES:
+            candidates = nlargest(MAX_CANDIDATES, candidates)
+        for count, i in candidates:
+            if 2 * (count + skipped) < MIN_SIMILARITY * (len(query_grams) + self.gram_counts[i]):
+                continue
+            # A gram of the query is a gram of the name when it occurs in the padded name, so the name's
+            # gram set is never built
+            padded = ' {} '.format(self.keys[i])
+            shared = sum(1 for gram in query_grams if gram in padded)
+            similarity = 2 * shared / (len(query_grams) + self.gram_counts[i])
+            if similarity >= MIN_SIMILARITY and similarity > scores.get(i, 0):
+                scores[i] = similarity
+
+    def hierarchy(self, kode: str) -> List[Dict[str, str]]:
+        parts = kode.split('.')
+        parents = []
+        for n in range(1, len(parts)):
+            parent = '.'.join(parts[:n])
+            i = self.positions.get(parent)
+            parents.append({'kode': parent, 'nama': self.names[i] if i is not None else None})
+        return parents
+
+    def search(self, query: str, limit: int = 10, level: Optional[int] = None) -> List[Dict[str, Any]]:
+        kind, key = normalize_name(query)
+        if not key:
+            return []
+        scores: Dict[int, float] = {}
+        exact = self._prefix_matches(key, scores)
+        if kind is not None:
+            # Villages and kecamatan keep the prefix in their key, "kota baru" also looks for a desa Kota Baru
+            exact = self._prefix_matches(normalize_name(query, False)[1], scores) or exact
+        # Typo tolerance only kicks in when no name matched exactly and the prefix index cannot fill the page
+        if not exact and len(scores) < limit and len(key) >= GRAM:
+            self._fuzzy_matches(key, scores)
+
+        def rank(i: int) -> Tuple[float, int, str]:
+            score = scores[i]
+            # An explicit KAB/KOTA in the query prefers that kabupaten/kota over villages of the same name
+            if kind is not None and self.kinds[i] == kind:
+                score += 1.0
+            return -score, self.levels[i], self.kodes[i]
+
+        ids = nsmallest(limit, (i for i in scores if level is None or self.levels[i] == level), key=rank)
+        return [{
+            'kode': self.kodes[i],
+            'nama': self.names[i],
+            'level': LEVELS[self.levels[i]],
+            'score': round(-rank(i)[0], 3),
+            'parents': self.hierarchy(self.kodes[i]),
+        } for i in ids]
+
+
+_search_index = None
+
+
+def get_search_index() -> SearchIndex:
+    global _search_index
+    if _search_index is None:
+        from lookup import get_index
+        _search_index = SearchIndex(get_index())
+    return _search_index
+
+
+def search(query: str, limit: int = 10, level: Optional[int] = None) -> List[Dict[str, Any]]:
+    return get_search_index().search(query, limit, level)
+
+
+if __name__ == '__main__':
+    import sys
+
+    t0 = time.perf_counter()
+    index = get_search_index()
+    t1 = time.perf_counter()
+    print('Indexed {} names in {} seconds'.format(len(index), round(t1-t0, 4)))
+    for query in sys.argv[1:]:
+        t0 = time.perf_counter()
+        results = index.search(query)
+        td = (time.perf_counter() - t0) * 1000
+        print('{!r}: {} results in {:.3f} ms'.format(query, len(results), td))
+        for result in results:
+            parents = ' / '.join(parent['nama'] for parent in result['parents'])
+            print('  {:.3f} {:14} {} ({})'.format(result['score'], result['kode'], result['nama'], parents))
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from argparse import ArgumentParser
+from functools import lru_cache
+from typing import Any, Tuple
+from urllib.parse import parse_qs, unquote
+
+from lookup import LEVELS, RegionIndex
+from search import SearchIndex
+from utils import BASE_DIR, create_logger, log_filename
+
+DEFAULT_SOURCE = os.path.join(BASE_DIR, 'kode_wilayah_indonesia.xlsx')
+CACHE_SIZE = 4096
+MAX_BODY = 1 << 20
+MAX_BATCH = 10000
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large'}
+
+logger = create_logger(log_filename(__file__))
+
+
+def load_sqlite(fpath: str) -> RegionIndex:
+    conn = sqlite3.connect('file:{}?mode=ro'.format(fpath), uri=True)
+    try:
+        return RegionIndex.from_rows({
+            table_name: conn.execute('SELECT kode, {0} FROM {0}'.format(table_name)) for table_name in LEVELS})
+    finally:
+        conn.close()
+
+
+def load_xlsx(fpath: str) -> RegionIndex:
+    # Sheets of the combined workbook are in LEVELS order, kode and name are always the last two columns
+    from openpyxl import load_workbook
+
+    wb = load_workbook(fpath, read_only=True)
+    try:
+        return RegionIndex.from_rows({
+            table_name: ((row[-2], row[-1]) for row in ws.iter_rows(2, values_only=True))
+            for table_name, ws in zip(LEVELS, wb)})
+    finally:
+        wb.close()
+
+
+def load_index(fpath: str) -> RegionIndex:
+    ext = os.path.splitext(fpath)[1].lower()
+    if ext in ('.db', '.sqlite', '.sqlite3'):
+        return load_sqlite(fpath)
+    if ext == '.xlsx':
+        return load_xlsx(fpath)
+    if ext == '.bin':
+        return RegionIndex.load(fpath)
+    raise ValueError('Unsupported source: {}'.format(fpath))
+
+
+def dump_json(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class RegionService:
+    def __init__(self, index: RegionIndex, cache_size: int = CACHE_SIZE):
+        self.index = index
+        self.search_index = SearchIndex(index)
+        self.requests = 0
+        # Responses for a single kode are immutable, so hot ones are kept already encoded. Only known codes
+        # reach the caches, a scan of unknown ones would otherwise push the hot ones out.
+        self.kode_body = lru_cache(maxsize=cache_size)(self._kode_body)
+        self.children_body = lru_cache(maxsize=cache_size)(self._children_body)
+
+    def _kode_body(self, kode: str) -> bytes:
+        return dump_json({'kode': kode, 'nama': self.index.get(kode), 'parent': self.index.parent(kode)})
+
+    def _children_body(self, kode: str) -> bytes:
+        return dump_json([{'kode': k, 'nama': n} for k, n in self.index.children(kode)])
+
+    def resolve(self, body: bytes) -> Tuple[int, bytes]:
+        try:
+            codes = json.loads(body or b'null')
+        except ValueError:
+            return 400, dump_json({'error': 'Body must be JSON'})
+        if isinstance(codes, dict):
+            codes = codes.get('kode')
+        if not isinstance(codes, list) or not all(isinstance(kode, str) for kode in codes):
+            return 400, dump_json({'error': 'Expected a list of kode strings'})
+        if len(codes) > MAX_BATCH:
+            return 413, dump_json({'error': 'At most {} kode per request'.format(MAX_BATCH)})
+        get = self.index.get
+        return 200, dump_json({kode: get(kode) for kode in codes})
+
+    def search(self, query: str) -> Tuple[int, bytes]:
+        params = parse_qs(query)
+        try:
+            limit = min(int(params.get('limit', ['10'])[0]), 100)
+        except ValueError:
+            return 400, dump_json({'error': 'limit must be a number'})
+        q = params.get('q', [''])[0]
+        if not q.strip():
+            return 400, dump_json({'error': 'Missing q'})
+        return 200, dump_json(self.search_index.search(q, limit))
+
+    def stats(self) -> bytes:
+        caches = {}
+        for name, func in (('kode', self.kode_body), ('children', self.children_body)):
+            info = func.cache_info()
+            caches[name] = {'hits': info.hits, 'misses': info.misses, 'size': info.currsize, 'maxsize': info.maxsize}
+        return dump_json({'regions': len(self.index), 'requests': self.requests, 'cache': caches})
+
+    def handle(self, method: str, path: str, body: bytes) -> Tuple[int, bytes]:
+        self.requests += 1
+        path, _, query = path.partition('?')
+        path = unquote(path)
+        if path == '/resolve':
+            if method != 'POST':
+                return 405, dump_json({'error': 'Use POST'})
+            return self.resolve(body)
+        if method != 'GET':
+            return 405, dump_json({'error': 'Use GET'})
+        if path == '/search':
+            return self.search(query)
+        if path.startswith('/kode/'):
+            kode = path[6:]
+            result = self.kode_body(kode) if self.index.is_valid(kode) else None
+        elif path.startswith('/children/'):
+            kode = path[10:]
+            result = self.children_body(kode) if self.index.is_valid(kode) else None
+        elif path == '/stats':
+            result = self.stats()
+        else:
+            return 404, dump_json({'error': 'Unknown endpoint'})
+        if result is None:
+            return 404, dump_json({'error': 'Kode not found'})
+        return 200, result
+
+    async def serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Minimal HTTP/1.1 with keep-alive, enough for internal clients and the load test
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self.respond(writer, 400, dump_json({'error': 'Malformed request'}), False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length') or 0)
+                if length > MAX_BODY:
+                    await self.respond(writer, 413, dump_json({'error': 'Body too large'}), False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+                status, payload = self.handle(method, target, body)
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer: asyncio.StreamWriter, status: int, payload: bytes, keep_alive: bool):
+        head = 'HTTP/1.1 {} {}\r\nContent-Type: application/json; charset=utf-8\r\nContent-Length: {}\r\n{}\r\n'.format(
+            status, REASONS[status], len(payload), '' if keep_alive else 'Connection: close\r\n')
+        writer.write(head.encode('latin-1') + payload)
+        await writer.drain()
+
+
+async def serve(service: RegionService, host: str, port: int):
+    server = await asyncio.start_server(service.serve_client, host, port)
+    logger.info('Serving %s regions on http://%s:%s', len(service.index), host, port)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='HTTP lookup service over the region codes')
+    parser.add_argument('-s', '--source', default=DEFAULT_SOURCE,
+                        help='Combined .xlsx, SQLite .db or snapshot .bin to load (default: the combined workbook)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=8080)
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE, help='Cached responses per endpoint')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    index = load_index(args.source)
+    td = round(time.perf_counter() - t0, 4)
+    logger.info('Loaded %s in %s seconds', args.source, td)
+    try:
+        asyncio.run(serve(RegionService(index, args.cache_size), args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from typing import List, Sequence, Tuple
+
+BASE_DIR = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+SNAPSHOT_PATH = os.path.join(BASE_DIR, 'kode_wilayah_indonesia.bin')
+
+# File layout, all integers little endian:
+#   header       magic, version, level count, crc32 of everything after the header, payload size
+#   level table  one entry per level: row count, codes offset, name offsets offset, names offset, names size
+#   sections     codes (uint64 per row), name offsets (uint32 per row + 1), UTF-8 names blob
+# Every section starts on an 8 byte boundary so it can be cast in place from the mmap.
+MAGIC = b'KWIS'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHHIQ')
+LEVEL_ENTRY = struct.Struct('<QQQQQ')
+ALIGNMENT = 8
+
+Level = Tuple[Sequence[int], Sequence[int], bytes]
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def _padding(size: int) -> bytes:
+    return b'\0' * (-size % ALIGNMENT)
+
+
+def _little_endian(values: array) -> bytes:
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def write(path: str, levels: Sequence[Level]):
+    table_size = LEVEL_ENTRY.size * len(levels)
+    pos = HEADER.size + table_size + len(_padding(HEADER.size + table_size))
+    entries = []
+    sections = []
+
+    for codes, offsets, names in levels:
+        codes = _little_endian(array('Q', codes))
+        offsets = _little_endian(array('I', offsets))
+        entry = [len(codes) // 8]
+        for data in (codes, offsets, names):
+            entry.append(pos)
+            sections.append(data + _padding(len(data)))
+            pos += len(sections[-1])
+        entry.append(len(names))
+        entries.append(LEVEL_ENTRY.pack(*entry))
+
+    table = b''.join(entries)
+    payload = table + _padding(HEADER.size + len(table)) + b''.join(sections)
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, len(levels), zlib.crc32(payload), len(payload))
+
+    # Write to a temporary file first so readers never map a half written snapshot
+    tmp_path = '{}.tmp'.format(path)
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+
+class Snapshot:
+    def __init__(self, path: str = SNAPSHOT_PATH, verify: bool = True):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        self._views = []
+        self.levels = []
+
+        try:
+            self.levels = self._parse(path, verify)
+        except Exception:
+            self.close()
+            raise
+
+    def _parse(self, path: str, verify: bool) -> List[Level]:
+        view = self._view
+        if len(view) < HEADER.size:
+            raise SnapshotError('Truncated snapshot: {}'.format(path))
+        magic, version, nlevels, checksum, size = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise SnapshotError('Not a snapshot file: {}'.format(path))
+        if version != FORMAT_VERSION:
+            raise SnapshotError('Unsupported snapshot version {}: {}'.format(version, path))
+        if len(view) != HEADER.size + size:
+            raise SnapshotError('Truncated snapshot: {}'.format(path))
+        if verify and zlib.crc32(view[HEADER.size:]) != checksum:
+            raise SnapshotError('Checksum mismatch: {}'.format(path))
+
+        levels = []
+        for i in range(nlevels):
+            count, codes_pos, offsets_pos, names_pos, names_size = LEVEL_ENTRY.unpack_from(
+                view, HEADER.size + i * LEVEL_ENTRY.size)
+            codes = self._slice(codes_pos, count * 8)
+            offsets = self._slice(offsets_pos, (count + 1) * 4)
+            if sys.byteorder == 'little':
+                codes = self._track(codes.cast('Q'))
+                offsets = self._track(offsets.cast('I'))
+            else:
+                codes = array('Q', codes)
+                codes.byteswap()
+                offsets = array('I', offsets)
+                offsets.byteswap()
+            levels.append((codes, offsets, self._slice(names_pos, names_size)))
+        return levels
+
+    def _track(self, view: memoryview) -> memoryview:
+        self._views.append(view)
+        return view
+
+    def _slice(self, pos: int, size: int) -> memoryview:
+        if pos + size > len(self._view):
+            raise SnapshotError('Section out of bounds')
+        return self._track(self._view[pos:pos + size])
+
+    def close(self):
+        # The mmap can only be closed once no memoryview references it anymore
+        self.levels = []
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._view.release()
+        self._mmap.close()
+
+    def __enter__(self) -> 'Snapshot':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read(path: str = SNAPSHOT_PATH, verify: bool = True) -> Snapshot:
+    return Snapshot(path, verify)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import re
+import sqlite3
+from typing import Any, Iterable, List, Optional, Sequence, TextIO
+
+# SQLite backed stand-in for the psycopg2 and mysql.connector connections used by combine, so the
+# Postgres and MySQL load paths (COPY, multi-row INSERT, deferred foreign keys) run without a server
+
+COPY_SQL = re.compile(r'^COPY (\w+) FROM STDIN$')
+ADD_FOREIGN_KEY = re.compile(r'^ALTER TABLE (\w+) ADD CONSTRAINT \w+ FOREIGN KEY\((\w+)\) REFERENCES (\w+)\((\w+)\)$')
+COPY_ESCAPES = {'\\\\': '\\', '\\t': '\t', '\\n': '\n', '\\r': '\r'}
+COPY_ESCAPE = re.compile(r'\\[\\tnr]')
+ON_DUPLICATE_KEY = re.compile(r' ON DUPLICATE KEY UPDATE (.+)$')
+VALUES_COLUMN = re.compile(r'VALUES\((\w+)\)')
+TABLE_EXISTS = re.compile(r'^SELECT 1 FROM information_schema\.tables WHERE table_schema = \S+ AND table_name = %s$')
+
+
+class StandInError(sqlite3.IntegrityError):
+    pass
+
+
+def unescape_copy(value: str) -> Optional[str]:
+    if value == '\\N':
+        return None
+    return COPY_ESCAPE.sub(lambda m: COPY_ESCAPES[m.group(0)], value)
+
+
+class StandInCursor:
+    def __init__(self, conn: 'StandInConnection'):
+        self.conn = conn
+        self.cur = conn.db.cursor()
+
+    def _translate(self, sql: str) -> Optional[str]:
+        self.conn.statements.append(sql)
+        if sql.startswith('SET '):
+            return None
+        match = ADD_FOREIGN_KEY.match(sql)
+        if match:
+            # SQLite cannot add a constraint later, the existing rows are checked the way the server would
+            table_name, column, ref_table, ref_column = match.groups()
+            missing = self.cur.execute('SELECT COUNT(*) FROM {0} WHERE {1} NOT IN (SELECT {3} FROM {2})'.format(
+                table_name, column, ref_table, ref_column)).fetchone()[0]
+            if missing:
+                raise StandInError('{} rows of {}.{} have no parent in {}'.format(missing, table_name, column, ref_table))
+            return None
+        if TABLE_EXISTS.match(sql):
+            return "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?"
+        if sql.startswith('ANALYZE TABLE '):
+            return 'ANALYZE'
+        if sql == 'ALTER TABLE wilayah ADD PRIMARY KEY (kode)':
+            return 'CREATE UNIQUE INDEX wilayah_kode_idx ON wilayah (kode)'
+        match = ON_DUPLICATE_KEY.search(sql)
+        if match:
+            # MySQL upsert to the SQLite form, every table is keyed on kode
+            updates = VALUES_COLUMN.sub(r'excluded.\1', match.group(1))
+            sql = sql[:match.start()] + ' ON CONFLICT (kode) DO UPDATE SET ' + updates
+        return sql.replace(' CASCADE', '').replace('%s', '?')
+
+    def execute(self, sql: str, params: Sequence[Any] = ()):
+        sql = self._translate(sql)
+        if sql is not None:
+            self.cur.execute(sql, params)
+
+    def executemany(self, sql: str, seq_of_params: Iterable[Sequence[Any]]):
+        sql = self._translate(sql)
+        if sql is not None:
+            self.cur.executemany(sql, seq_of_params)
+
+    def copy_expert(self, sql: str, file: TextIO):
+        self.conn.statements.append(sql)
+        table_name = COPY_SQL.match(sql).group(1)
+        rows = [[unescape_copy(value) for value in line.rstrip('\n').split('\t')] for line in file]
+        if rows:
+            placeholders = ', '.join(['?'] * len(rows[0]))
+            self.cur.executemany('INSERT INTO {} VALUES ({})'.format(table_name, placeholders), rows)
+
+    def fetchone(self) -> Optional[tuple]:
+        return self.cur.fetchone()
+
+    def fetchall(self) -> List[tuple]:
+        return self.cur.fetchall()
+
+    def close(self):
+        self.cur.close()
+
+
+class StandInConnection:
+    def __init__(self, dbms: str, path: str = ':memory:'):
+        self.dbms = dbms
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.statements: List[str] = []
+
+    def cursor(self) -> StandInCursor:
+        return StandInCursor(self)
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
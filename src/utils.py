@@ -1,36 +1,87 @@
 # -*- coding: utf-8 -*-
 
+import heapq
 import logging
 import os
-import re
+import posixpath
 import sys
-from typing import Any, Tuple, Union
+import zipfile
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+from multiprocessing import cpu_count, parent_process
+from xml.etree.ElementTree import iterparse
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import metrics
+from kode import kode_sort_key
 
 BASE_DIR = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
 DATA_DIR = os.path.join(BASE_DIR, 'src', 'data')
 OUT_DIR = os.path.join(BASE_DIR, 'output')
 LOGS_DIR = os.path.join(BASE_DIR, 'logs')
 
-os.makedirs(OUT_DIR, exist_ok=True)
-os.makedirs(LOGS_DIR, exist_ok=True)
+EXECUTOR_MODES = ('process', 'thread', 'serial')
+XLSX_ENGINES = ('xml', 'openpyxl')
+CONSOLE_HANDLER = 'console'
+
+SHEET_MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+
+class LogFileHandler(logging.FileHandler):
+    # Opened on the first record, so importing a module creates neither logs/ nor its log file. Only the main
+    # process starts the file over, once, after that every process appends so none writes over another's lines.
+    def __init__(self, filename: str):
+        super().__init__(filename, mode='w' if parent_process() is None else 'a', delay=True)
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        if self.mode == 'w':
+            open(self.baseFilename, 'w').close()
+            self.mode = 'a'
+        return super()._open()
+
+
+def open_log_files():
+    # Called before starting worker processes, a log file first opened after they wrote to it would be started over
+    loggers = [logging.getLogger()] + [logger for logger in logging.Logger.manager.loggerDict.values()
+                                       if isinstance(logger, logging.Logger)]
+    for logger in loggers:
+        for handler in logger.handlers:
+            if isinstance(handler, LogFileHandler):
+                handler.acquire()
+                try:
+                    if handler.stream is None:
+                        handler.stream = handler._open()
+                finally:
+                    handler.release()
 
 
 def create_logger(filename: str, level: Union[int, str, None] = logging.INFO, console: bool = True) -> logging.Logger:
+    # Each module logs to its own file through a named logger, the console handler lives on the root logger
+    # and is attached once, so importing several stages does not duplicate log lines
     log_formatter = logging.Formatter('%(asctime)s [%(levelname)s]: %(message)s')
-    logger = logging.getLogger()
-    file_handler = logging.FileHandler(filename=filename, mode='w')
-    file_handler.setFormatter(log_formatter)
-    logger.addHandler(file_handler)
+    logger = logging.getLogger(os.path.splitext(os.path.basename(filename))[0])
+    root_logger = logging.getLogger()
+
+    filename = os.path.abspath(filename)
+    if not any(getattr(handler, 'baseFilename', None) == filename for handler in logger.handlers):
+        file_handler = LogFileHandler(filename)
+        file_handler.setFormatter(log_formatter)
+        logger.addHandler(file_handler)
 
-    if console:
+    if console and not any(handler.get_name() == CONSOLE_HANDLER for handler in root_logger.handlers):
         console_handler = logging.StreamHandler()
+        console_handler.set_name(CONSOLE_HANDLER)
         console_handler.setFormatter(log_formatter)
-        logger.addHandler(console_handler)
-
-    logger.setLevel(level)
+        root_logger.addHandler(console_handler)
 
     if '-v' in sys.argv or '--verbose' in sys.argv:
-        logger.setLevel(logging.DEBUG)
+        level = logging.DEBUG
+    logger.setLevel(level)
+    root_logger.setLevel(level)
 
     return logger
 
@@ -45,9 +96,229 @@ def touch(fname: str, times: Union[Tuple[int, int], Tuple[float, float], None] =
         os.utime(fname, times)
 
 
-def normalize_value(value: Any) -> str:
-    if value is None:
-        return ''
-    value = str(value).strip().replace('\n', ' ')
-    value = re.sub(r'^\d+\s+', '', value)
-    return re.sub(r'\s+', ' ', value)
+def add_executor_arguments(parser: ArgumentParser):
+    parser.add_argument('-m', '--mode', choices=EXECUTOR_MODES, default='process',
+                        help='Execution mode for per-file extraction (default: process)')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='Number of workers (default: CPU count)')
+    parser.add_argument('-e', '--engine', choices=XLSX_ENGINES, default='xml',
+                        help='Reader for source workbooks (default: xml)')
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false',
+                        help='Ignore and do not update the build cache')
+    parser.add_argument('--metrics', metavar='SINKS', default=None,
+                        help='Structured metrics sinks: stdout, stderr, file:<path>, udp://<host>:<port>')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Verbose logging')
+
+
+def map_tasks(func: Callable, items: Sequence, mode: str = 'process', workers: Optional[int] = None) -> List:
+    return list(imap_tasks(func, items, mode, workers))
+
+
+def imap_tasks(func: Callable, items: Sequence, mode: str = 'process', workers: Optional[int] = None) -> Iterator:
+    # Results are returned in the same order as items regardless of completion order, each one as soon
+    # as it and those before it are done, so the caller can use the first while the rest still run
+    if mode not in EXECUTOR_MODES:
+        raise ValueError('Invalid execution mode: {}'.format(mode))
+    items = list(items)
+    workers = max(1, min(workers or cpu_count(), len(items) or 1))
+    if mode == 'serial' or workers == 1:
+        return (func(item) for item in items)
+    return _imap_executor(func, items, mode, workers)
+
+
+def _imap_executor(func: Callable, items: List, mode: str, workers: int) -> Iterator:
+    if mode == 'process':
+        open_log_files()
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=metrics.init_worker)
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+    with executor:
+        yield from executor.map(func, items)
+
+
+def _column_index(ref: str) -> int:
+    idx = 0
+    for char in ref:
+        if char.isdigit():
+            break
+        idx = idx * 26 + ord(char) - 64
+    return idx
+
+
+def _cast_number(value: str) -> Union[int, float]:
+    if '.' in value or 'E' in value or 'e' in value:
+        return float(value)
+    return int(value)
+
+
+def _read_text(node) -> str:
+    # Plain <t> plus the <t> of every rich text run, phonetic runs are ignored
+    snippets = []
+    for child in node:
+        if child.tag == SHEET_MAIN_NS + 't':
+            snippets.append(child.text or '')
+        elif child.tag == SHEET_MAIN_NS + 'r':
+            snippets.append(child.findtext(SHEET_MAIN_NS + 't') or '')
+    return ''.join(snippets)
+
+
+def _active_sheet_path(archive: zipfile.ZipFile) -> str:
+    with archive.open('xl/workbook.xml') as f:
+        root = next(el for _, el in iterparse(f) if el.tag == SHEET_MAIN_NS + 'workbook')
+    view = root.find('{0}bookViews/{0}workbookView'.format(SHEET_MAIN_NS))
+    active = int(view.get('activeTab', 0)) if view is not None else 0
+    sheets = root.findall('{0}sheets/{0}sheet'.format(SHEET_MAIN_NS))
+    rel_id = sheets[min(active, len(sheets) - 1)].get(REL_NS + 'id')
+
+    target = None
+    with archive.open('xl/_rels/workbook.xml.rels') as f:
+        for _, el in iterparse(f):
+            if el.tag == PKG_REL_NS + 'Relationship' and el.get('Id') == rel_id:
+                target = el.get('Target')
+                break
+    if not target:
+        raise ValueError('Active sheet {} has no relationship in {}'.format(rel_id, archive.filename))
+    if target.startswith('/'):
+        return target.lstrip('/')
+    return posixpath.normpath(posixpath.join('xl', target))
+
+
+def sheet_max_row(fpath: str) -> Optional[int]:
+    # Last row from the <dimension> element at the top of the active sheet, without reading sheetData
+    with zipfile.ZipFile(fpath) as archive:
+        with archive.open(_active_sheet_path(archive)) as f:
+            for _, el in iterparse(f, events=('start',)):
+                if el.tag == SHEET_MAIN_NS + 'dimension':
+                    last = el.get('ref', '').rpartition(':')[2].lstrip('ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+                    return int(last) if last.isdigit() else None
+                if el.tag == SHEET_MAIN_NS + 'sheetData':
+                    return None
+    return None
+
+
+def iter_xlsx_rows(fpath: str, min_col: int = 1, max_col: int = 2, min_row: int = 1,
+                   max_row: Optional[int] = None) -> Iterator[tuple]:
+    with zipfile.ZipFile(fpath) as archive:
+        shared_strings = []
+        if 'xl/sharedStrings.xml' in archive.namelist():
+            with archive.open('xl/sharedStrings.xml') as f:
+                for _, el in iterparse(f):
+                    if el.tag == SHEET_MAIN_NS + 'si':
+                        shared_strings.append(_read_text(el).replace('x005F_', ''))
+                        el.clear()
+
+        row_tag = SHEET_MAIN_NS + 'row'
+        value_tag = SHEET_MAIN_NS + 'v'
+        inline_tag = SHEET_MAIN_NS + 'is'
+        empty = (None,) * (max_col - min_col + 1)
+        nrow = 0
+
+        with archive.open(_active_sheet_path(archive)) as f:
+            for _, el in iterparse(f):
+                if el.tag != row_tag:
+                    continue
+                ref = el.get('r')
+                row_idx = int(ref) if ref else nrow + 1
+                # Rows missing from sheetData are empty rows
+                for _ in range(max(nrow + 1, min_row), row_idx if max_row is None else min(row_idx, max_row + 1)):
+                    yield empty
+                if max_row is not None and row_idx > max_row:
+                    return
+                nrow = row_idx
+                if row_idx < min_row:
+                    el.clear()
+                    continue
+
+                values = list(empty)
+                ncol = 0
+                for cell in el:
+                    ref = cell.get('r')
+                    ncol = _column_index(ref) if ref else ncol + 1
+                    if ncol < min_col or ncol > max_col:
+                        continue
+                    data_type = cell.get('t', 'n')
+                    if data_type == 'inlineStr':
+                        child = cell.find(inline_tag)
+                        value = _read_text(child) if child is not None else None
+                    else:
+                        value = cell.findtext(value_tag) or None
+                        if value is None:
+                            pass
+                        elif data_type == 'n':
+                            value = _cast_number(value)
+                        elif data_type == 's':
+                            value = shared_strings[int(value)]
+                        elif data_type == 'b':
+                            value = bool(int(value))
+                    values[ncol - min_col] = value
+                el.clear()
+                yield tuple(values)
+
+
+def read_xlsx(fpath: str, min_col: int = 1, max_col: int = 2, min_row: int = 1, engine: str = 'xml',
+              max_row: Optional[int] = None) -> Iterator[tuple]:
+    if engine == 'xml':
+        yield from iter_xlsx_rows(fpath, min_col, max_col, min_row, max_row)
+        return
+    if engine != 'openpyxl':
+        raise ValueError('Invalid XLSX engine: {}'.format(engine))
+
+    from openpyxl import load_workbook
+
+    wb = load_workbook(fpath, read_only=True)
+    try:
+        ws = wb.active
+        yield from ws.iter_rows(min_row, max_row or ws.max_row, min_col, max_col, True)
+    finally:
+        wb.close()
+
+
+def merge_sorted(results: Iterable[Iterable[Sequence]], logger: Optional[logging.Logger] = None) -> Iterator[Sequence]:
+    # Streaming k-way merge of per-file rows that are each sorted by kode, duplicates end up next to each other
+    previous = None
+    for row in heapq.merge(*results, key=kode_sort_key):
+        if row[0] is not None and row[0] == previous and logger is not None:
+            logger.warn('Duplicate kode: %s, %s', row[0], row[1])
+        previous = row[0]
+        yield row
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def write_rows(dest_path: str, title: str, rows: Iterable[Sequence], widths: Sequence[int],
+               logger: Optional[logging.Logger] = None) -> bool:
+    from openpyxl import Workbook
+    from openpyxl.utils import get_column_letter
+
+    logger = logger or logging.getLogger()
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(dest_path)), exist_ok=True)
+        touch(dest_path)
+    except Exception as e:
+        logger.error('Could not write output file: %s', dest_path)
+        logger.error('%s', e)
+        return False
+
+    wb_out = Workbook(write_only=True)
+    ws_out = wb_out.create_sheet(title=title)
+    for ncol, width in enumerate(widths, 1):
+        ws_out.column_dimensions[get_column_letter(ncol)].width = width
+
+    for row in rows:
+        ws_out.append(row)
+
+    try:
+        wb_out.save(dest_path)
+        logger.info('Data succesfully saved to: %s', dest_path)
+        return True
+    except Exception as e:
+        logger.error('Could not save to: %s', dest_path)
+        logger.error('%s', e)
+        return False
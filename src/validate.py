@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import time
+from argparse import ArgumentParser
+from collections import Counter
+from collections.abc import Sequence as SequenceABC
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import metrics
+from combine import SOURCE_PATHS, TABLES
+from kode import kode_level, parent_kode
+from utils import OUT_DIR, create_logger, log_filename, read_xlsx
+
+REPORT_PATH = os.path.join(OUT_DIR, 'validation.json')
+CHECKS = ('empty', 'format', 'duplicate', 'orphan')
+
+logger = create_logger(log_filename(__file__))
+
+
+class ValidationError(Exception):
+    def __init__(self, report: dict):
+        super().__init__('{} integrity issues: {}'.format(
+            len(report['issues']), ', '.join('{} {}'.format(n, check) for check, n in report['counts'].items() if n)))
+        self.report = report
+
+
+def load_sources(sources: Optional[Dict[str, Iterable[Sequence]]] = None) -> Dict[str, List[Sequence]]:
+    # Every level as a list, so the same rows can be validated and then loaded
+    sources = dict(sources or {})
+    for level, fpath in SOURCE_PATHS.items():
+        if not isinstance(sources.get(level), SequenceABC):
+            sources[level] = list(sources[level]) if level in sources else list(read_xlsx(fpath))
+    return sources
+
+
+def issue(check: str, level: str, kode, nama, detail: str = '') -> dict:
+    return {'check': check, 'level': level, 'kode': kode, 'nama': nama, 'detail': detail}
+
+
+def validate_level(level: int, table_name: str, rows: Sequence[Sequence], parents: Optional[set]) -> tuple:
+    issues = []
+    codes = [None if v1 is None else str(v1).strip() for v1, _ in rows]
+    kodes = set(codes)
+    kodes.discard(None)
+
+    for (v1, v2), kode in zip(rows, codes):
+        if not kode or v2 is None or not str(v2).strip():
+            issues.append(issue('empty', table_name, kode, v2))
+        elif kode_level(kode) != level:
+            issues.append(issue('format', table_name, kode, v2, 'expected a level {} kode'.format(level)))
+
+    # Set operations instead of per row lookups, only the offending codes are walked again
+    if len(kodes) < len(rows):
+        duplicates = {kode for kode, n in Counter(codes).items() if n > 1 and kode}
+        issues.extend(issue('duplicate', table_name, kode, v2) for kode, (_, v2) in zip(codes, rows)
+                      if kode in duplicates)
+    if parents is not None:
+        orphans = {parent_kode(kode) for kode in kodes} - parents
+        issues.extend(issue('orphan', table_name, kode, v2, 'no parent {}'.format(parent_kode(kode)))
+                      for kode, (_, v2) in zip(codes, rows) if kode and parent_kode(kode) in orphans)
+    return kodes, issues
+
+
+@metrics.timed('validate')
+def validate(sources: Optional[Dict[str, Iterable[Sequence]]] = None) -> dict:
+    sources = load_sources(sources)
+    report = {'levels': {}, 'issues': [], 'counts': dict.fromkeys(CHECKS, 0)}
+    parents = None
+    for level, table_name in enumerate(TABLES):
+        rows = sources[table_name]
+        parents, issues = validate_level(level, table_name, rows, parents)
+        report['levels'][table_name] = {'rows': len(rows), 'distinct': len(parents), 'issues': len(issues)}
+        report['issues'].extend(issues)
+        for item in issues:
+            report['counts'][item['check']] += 1
+        metrics.emit('validation', table_name, **report['levels'][table_name])
+    report['ok'] = not report['issues']
+    return report
+
+
+def save_report(report: dict, dest_path: str = REPORT_PATH):
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    with open(dest_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=1, default=str)
+
+
+def check(sources: Optional[Dict[str, Iterable[Sequence]]] = None,
+          dest_path: Optional[str] = REPORT_PATH) -> Dict[str, List[Sequence]]:
+    # Validates and returns the rows as lists, raises ValidationError before anything is loaded
+    sources = load_sources(sources)
+    t0 = time.perf_counter()
+    report = validate(sources)
+    td = round(time.perf_counter() - t0, 4)
+    if dest_path:
+        save_report(report, dest_path)
+    rows = sum(level['rows'] for level in report['levels'].values())
+    if not report['ok']:
+        for item in report['issues'][:20]:
+            logger.error('%s in %s: %s, %s %s', item['check'], item['level'], item['kode'], item['nama'],
+                         item['detail'])
+        raise ValidationError(report)
+    logger.info('Validated %s rows in %s seconds', rows, td)
+    return sources
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Check the combined data for empty, malformed, duplicate and orphan codes')
+    parser.add_argument('-o', '--output', default=REPORT_PATH, help='JSON report path, - for stdout')
+    parser.add_argument('--metrics', metavar='SINKS', default=None, help='Structured metrics sinks')
+    args = parser.parse_args()
+    metrics.configure(args.metrics)
+
+    report = validate()
+    if args.output == '-':
+        print(json.dumps(report, ensure_ascii=False, indent=1, default=str))
+    else:
+        save_report(report, args.output)
+        logger.info('Report saved to: %s', args.output)
+    for table_name, level in report['levels'].items():
+        logger.info('%s: %s rows, %s distinct, %s issues', table_name, level['rows'], level['distinct'],
+                    level['issues'])
+    if not report['ok']:
+        raise SystemExit(1)